@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the CPU time versus the number of bytes for response compression.
+
+The payloads resemble the JSON and CSV responses of generic_get_multiple. Both
+whole-body and streamed (flushed per chunk) compression are measured.
+
+    python3 benchmarks/compression_benchmark.py --rows 20000
+"""
+
+import argparse
+import csv
+import importlib.util
+import io
+import json
+import os
+import random
+import time
+import uuid
+
+from datetime import datetime, timedelta
+
+# Load the compression module on its own, the openapi_server package requires a full configuration
+module_spec = importlib.util.spec_from_file_location('compression', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'openapi_server', 'compression.py'))
+compression_module = importlib.util.module_from_spec(module_spec)
+module_spec.loader.exec_module(compression_module)
+
+ResponseCompression = compression_module.ResponseCompression
+brotli = compression_module.brotli
+
+BREEDS = ['Bulldog', 'Labrador', 'Poodle', 'Beagle', 'Boxer', 'Dachshund', 'Husky']
+CITIES = ['Amsterdam', 'Rotterdam', 'Utrecht', 'Eindhoven', 'Groningen', 'Zwolle']
+
+
+def create_entities(rows):
+    random.seed(42)
+    start = datetime(2020, 1, 1)
+
+    return [{
+        'pet_id': str(uuid.UUID(int=random.getrandbits(128))),
+        'name': f"Pet {index}",
+        'breed': random.choice(BREEDS),
+        'age': random.randint(0, 15),
+        'weight': round(random.uniform(2, 60), 2),
+        'active': random.random() > 0.2,
+        'created': (start + timedelta(minutes=random.randint(0, 500000))).isoformat() + 'Z',
+        'owner': {
+            'email': f"owner{random.randint(0, rows // 10)}@example.com",
+            'city': random.choice(CITIES)
+        }
+    } for index in range(rows)]
+
+
+def create_payloads(entities):
+    json_payload = json.dumps({'results': entities}).encode()
+
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=';')
+    writer.writerow(['pet_id', 'name', 'breed', 'age', 'weight', 'active', 'created', 'owner.email', 'owner.city'])
+    for entity in entities:
+        writer.writerow([
+            entity['pet_id'], entity['name'], entity['breed'], entity['age'], str(entity['weight']).replace('.', ','),
+            entity['active'], entity['created'], entity['owner']['email'], entity['owner']['city']])
+
+    return {'json': json_payload, 'csv': output.getvalue().encode()}
+
+
+def measure(compression, encoding, payload, chunk_size):
+    start = time.process_time()
+
+    if chunk_size:
+        chunks = (payload[i:i + chunk_size] for i in range(0, len(payload), chunk_size))
+        size = sum(len(chunk) for chunk in compression.compress_stream(chunks, encoding))
+    else:
+        compress, flush = compression.create_compressor(encoding)
+        size = len(compress(payload) + flush(True))
+
+    return size, time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=20000, help='number of entities within the payload')
+    parser.add_argument('--chunk-size', type=int, default=64 * 1024, help='chunk size of streamed responses')
+    args = parser.parse_args()
+
+    settings = [('gzip', level, None) for level in [1, 6, 9]]
+    if brotli is not None:
+        settings += [('br', None, quality) for quality in [1, 4, 11]]
+    else:
+        print('Brotli is not installed, only gzip is measured\n')
+
+    payloads = create_payloads(create_entities(args.rows))
+
+    print(f"{'payload':<8} {'encoding':<9} {'level':>5} {'mode':<9} {'bytes':>12} {'ratio':>7} "
+          f"{'cpu ms':>9} {'MB/s':>8}")
+
+    for name, payload in payloads.items():
+        print(f"{name:<8} {'identity':<9} {'-':>5} {'-':<9} {len(payload):>12} {1:>7.2f} {0:>9.1f} {'-':>8}")
+
+        for encoding, level, quality in settings:
+            compression = ResponseCompression(level=level or 6, brotli_quality=quality or 4)
+
+            for mode, chunk_size in [('body', None), ('streamed', args.chunk_size)]:
+                size, cpu_time = measure(compression, encoding, payload, chunk_size)
+                throughput = len(payload) / (1024 * 1024) / cpu_time if cpu_time else float('inf')
+
+                print(f"{name:<8} {encoding:<9} {level or quality:>5} {mode:<9} {size:>12} "
+                      f"{len(payload) / size:>7.2f} {cpu_time * 1000:>9.1f} {throughput:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+Load tests the whole API: routing, request hooks, authentication, controllers, serialization and gunicorn.
+
+The API is started under gunicorn from a copy of this directory, with the in-memory database seeded with pets, the
+specification benchmarks/loadtest_openapi.yaml and a stub JWKS endpoint for the tokens of the load test. A mix of
+routes is requested at a fixed concurrency, after which the throughput and latency percentiles of each route are
+reported, so worker and thread settings can be compared on data. The load test fails when the share of responses
+outside 2xx exceeds --max-error-rate, so a broken route is not mistaken for a fast one.
+
+    python3 benchmarks/loadtest.py --workers 2 --threads 8 --concurrency 16 --duration 30 \
+        --mix single=60,list=25,export=5,post=5,put=5
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+import requests
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+
+API_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SPECIFICATION = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'loadtest_openapi.yaml')
+
+AUDIENCE = 'loadtest'
+ISSUER = 'https://loadtest.local/'
+KEY_ID = 'loadtest'
+SCOPES = ['loadtest.read', 'loadtest.edit']
+
+BREEDS = ['Bulldog', 'Labrador', 'Poodle', 'Beagle', 'Boxer', 'Dachshund', 'Husky']
+CITIES = ['Amsterdam', 'Rotterdam', 'Utrecht', 'Eindhoven', 'Groningen', 'Zwolle']
+
+CONFIG = """
+OAUTH_EXPECTED_AUDIENCE = {audience!r}
+OAUTH_EXPECTED_ISSUER = {issuer!r}
+OAUTH_JWKS_URL = {jwks_url!r}
+
+BASE_URL = {base_url!r}
+ORIGINS = []
+
+DATABASE_TYPE = 'memory'
+MEMORY_DATABASE = {{"seed": {seed!r}, "latency": {latency!r}, "error_rate": {error_rate!r}}}
+"""
+
+
+def create_pet(rng):
+    return {
+        'name': f"Pet {rng.randint(0, 1000000)}",
+        'breed': rng.choice(BREEDS),
+        'age': rng.randint(0, 15),
+        'owner': {
+            'email': f"owner{rng.randint(0, 1000)}@example.com",
+            'city': rng.choice(CITIES)
+        }
+    }
+
+
+class JWKSServer:
+    """Serves the public key of the load test's signing key, like the JWKS endpoint of an identity provider"""
+
+    def __init__(self):
+        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+        jwk = json.loads(RSAAlgorithm.to_jwk(self.private_key.public_key()))
+        body = json.dumps({'keys': [{**jwk, 'kid': KEY_ID, 'use': 'sig', 'alg': 'RS256'}]}).encode()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}/keys"
+
+    def create_token(self, lifetime):
+        now = int(time.time())
+        claims = {
+            'aud': AUDIENCE, 'iss': ISSUER, 'iat': now, 'nbf': now, 'exp': now + lifetime,
+            'upn': 'loadtest@example.com', 'scopes': SCOPES
+        }
+        private_key = self.private_key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+
+        return jwt.encode(claims, private_key, algorithm='RS256', headers={'kid': KEY_ID})
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def create_app_directory(directory, args, jwks_url, base_url, rng):
+    """Copies the API into a directory with the load test's configuration, specification and seeded pets"""
+
+    app_directory = os.path.join(directory, 'app')
+    shutil.copytree(os.path.join(API_DIRECTORY, 'openapi_server'), os.path.join(app_directory, 'openapi_server'),
+                    ignore=shutil.ignore_patterns('__pycache__'))
+    shutil.copy(os.path.join(API_DIRECTORY, 'main.py'), app_directory)
+
+    os.makedirs(os.path.join(app_directory, 'openapi_server', 'openapi'), exist_ok=True)
+    shutil.copy(SPECIFICATION, os.path.join(app_directory, 'openapi_server', 'openapi', 'openapi.yaml'))
+
+    ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(args.entities)]
+    seed = os.path.join(directory, 'seed.json')
+    with open(seed, 'w') as seed_file:
+        json.dump({'Pets': {id: create_pet(rng) for id in ids}}, seed_file)
+
+    with open(os.path.join(app_directory, 'config.py'), 'w') as config_file:
+        config_file.write(CONFIG.format(
+            audience=AUDIENCE, issuer=ISSUER, jwks_url=jwks_url, base_url=base_url, seed=seed,
+            latency=[float(value) for value in args.latency.split(',')], error_rate=args.error_rate))
+
+        # Extra settings, such as COMPRESSION or ADMISSION_CONTROL, are appended to the configuration
+        if args.config:
+            with open(args.config, 'r') as extra_config:
+                config_file.write(extra_config.read())
+
+    return app_directory, ids
+
+
+def start_server(app_directory, args, port, log):
+    # gunicorn 20.0 can not be run as a module, its entry point is called instead
+    command = [
+        sys.executable, '-c', 'from gunicorn.app.wsgiapp import run; run()', '--bind', f"127.0.0.1:{port}",
+        '--workers', str(args.workers), '--threads', str(args.threads), '--timeout', '240', 'main:app']
+    process = subprocess.Popen(command, cwd=app_directory, stdout=log, stderr=subprocess.STDOUT)
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn stopped with exit code {process.returncode}")
+
+        try:
+            requests.get(f"http://127.0.0.1:{port}/pets/ready", timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.2)
+
+    process.terminate()
+    raise RuntimeError("gunicorn did not start within 60 seconds")
+
+
+class Operations:
+    """The operations of the mix, each returning the (route, status, seconds) of the requests it made"""
+
+    def __init__(self, base_url, ids, page_size, rng):
+        self.base_url = base_url
+        self.ids = ids
+        self.page_size = page_size
+        self.rng = rng
+
+    @staticmethod
+    def request(session, route, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=240, **kwargs)
+            response.content
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 0
+
+        return (route, status, time.perf_counter() - start), response
+
+    def single(self, session):
+        result, _ = self.request(session, 'single', 'GET', f"{self.base_url}/pets/{self.rng.choice(self.ids)}")
+        return [result]
+
+    def list(self, session):
+        result, response = self.request(
+            session, 'list', 'GET', f"{self.base_url}/pets", params={'page_size': self.page_size})
+        results = [result]
+
+        next_page = response.json().get('next_page') if response is not None and response.ok else None
+        if next_page:
+            result, _ = self.request(session, 'list_next', 'GET', next_page)
+            results.append(result)
+
+        return results
+
+    def export(self, session):
+        result, _ = self.request(
+            session, 'export', 'GET', f"{self.base_url}/pets-export", headers={'Content-Type': 'text/csv'})
+        return [result]
+
+    def post(self, session):
+        result, _ = self.request(session, 'post', 'POST', f"{self.base_url}/pets", json=create_pet(self.rng))
+        return [result]
+
+    def put(self, session):
+        result, _ = self.request(
+            session, 'put', 'PUT', f"{self.base_url}/pets/{self.rng.choice(self.ids)}", json=create_pet(self.rng))
+        return [result]
+
+
+def run_load(base_url, token, ids, args):
+    """Runs the mix of operations at a fixed concurrency, returning the results after the warm-up"""
+
+    mix = dict((name, int(weight)) for name, weight in (item.split('=') for item in args.mix.split(',')))
+    results = []
+    lock = threading.Lock()
+
+    start = time.monotonic()
+    measure_from = start + args.warmup
+    deadline = measure_from + args.duration
+
+    def run(index):
+        operations = Operations(base_url, ids, args.page_size, random.Random(args.seed + index))
+        session = requests.Session()
+        session.headers['Authorization'] = f"Bearer {token}"
+
+        while time.monotonic() < deadline:
+            name = operations.rng.choices(list(mix), weights=list(mix.values()))[0]
+            measured = time.monotonic() >= measure_from
+            operation_results = getattr(operations, name)(session)
+
+            if measured:
+                with lock:
+                    results.extend(operation_results)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0
+
+
+def create_report(results, duration):
+    routes = defaultdict(list)
+    for route, status, seconds in results:
+        routes[route].append((status, seconds))
+    routes['total'] = [(status, seconds) for _, status, seconds in results]
+
+    report = {}
+    for route, requests_made in routes.items():
+        latencies = sorted(seconds * 1000 for _, seconds in requests_made)
+        report[route] = {
+            'requests': len(requests_made),
+            'errors': sum(1 for status, _ in requests_made if not 200 <= status < 300),
+            'throughput': round(len(requests_made) / duration, 1),
+            'p50': round(percentile(latencies, 0.50), 1),
+            'p95': round(percentile(latencies, 0.95), 1),
+            'p99': round(percentile(latencies, 0.99), 1)
+        }
+
+    return report
+
+
+def print_report(report, args):
+    print(f"workers={args.workers} threads={args.threads} concurrency={args.concurrency} duration={args.duration}s")
+    print(f"{'route':<12}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+
+    for route, row in report.items():
+        print(f"{route:<12}{row['requests']:>10}{row['errors']:>8}{row['throughput']:>10}"
+              f"{row['p50']:>10}{row['p95']:>10}{row['p99']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=2, help="The number of gunicorn workers")
+    parser.add_argument('--threads', type=int, default=8, help="The number of threads per gunicorn worker")
+    parser.add_argument('--concurrency', type=int, default=16, help="The number of concurrent clients")
+    parser.add_argument('--duration', type=int, default=30, help="The number of seconds to measure")
+    parser.add_argument('--warmup', type=int, default=5, help="The number of seconds before measuring")
+    parser.add_argument('--mix', default='single=60,list=25,export=5,post=5,put=5',
+                        help="The weight of each operation: single, list, export, post and put")
+    parser.add_argument('--entities', type=int, default=5000, help="The number of seeded pets")
+    parser.add_argument('--page-size', type=int, default=50, help="The page size of the list operation")
+    parser.add_argument('--latency', default='0',
+                        help="The latency injected into each database call in seconds, or a range like 0.01,0.05")
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help="The share of database calls failing with an injected transient error")
+    parser.add_argument('--max-error-rate', type=float, default=0,
+                        help="The share of responses outside 2xx above which the load test fails")
+    parser.add_argument('--config', help="A Python file with extra configuration, e.g. COMPRESSION settings")
+    parser.add_argument('--output', help="Write the report as JSON to this file")
+    parser.add_argument('--seed', type=int, default=42, help="The seed of the random pets and operations")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    jwks_server = JWKSServer()
+    port = get_free_port()
+    base_url = f"http://127.0.0.1:{port}"
+
+    with tempfile.TemporaryDirectory() as directory:
+        app_directory, ids = create_app_directory(directory, args, jwks_server.url, base_url, rng)
+
+        with open(os.path.join(directory, 'gunicorn.log'), 'w+') as log:
+            try:
+                process = start_server(app_directory, args, port, log)
+            except RuntimeError as e:
+                log.seek(0)
+                sys.exit(f"{str(e)}\n{log.read()}")
+
+            try:
+                token = jwks_server.create_token(args.warmup + args.duration + 3600)
+                results = run_load(base_url, token, ids, args)
+            finally:
+                process.terminate()
+                process.wait()
+                jwks_server.stop()
+
+    report = create_report(results, args.duration)
+    print_report(report, args)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'settings': vars(args), 'routes': report}, output, indent=2)
+
+    error_rate = report['total']['errors'] / max(report['total']['requests'], 1)
+    if not report['total']['requests'] or error_rate > args.max_error_rate:
+        failing = ', '.join(route for route, row in report.items() if row['errors'] and route != 'total')
+        sys.exit(f"{error_rate:.2%} of the responses were outside 2xx ({failing or 'no requests made'})")
+
+
+if __name__ == '__main__':
+    main()
@@ -18,3 +18,100 @@ KMS_KEY_INFO = {
     "key": "",
     "location": ""
 }
+
+CURSORS = {
+    "signing_keys": [""],
+    "ttl": 86400
+}
+
+PARTITIONED_EXPORTS = {
+    "partition_count": 8,
+    "max_workers": 4
+}
+
+EXPORT_JOBS = {
+    "store": "local",
+    "directory": "/tmp/exports",
+    "path": "exports",
+    "max_workers": 2,
+    "page_size": 1000
+}
+
+COMPRESSION = {
+    "level": 6,
+    "brotli_quality": 4,
+    "min_size": 1024
+}
+
+OPENAPI_RELOAD_INTERVAL = 30
+
+REQUEST_COALESCING = {
+    "max_wait": 10
+}
+
+ADMISSION_CONTROL = {
+    "limits": {"export": 2, "list": 8, "single": 32, "write": 8},
+    "queue_sizes": {"export": 0, "list": 16, "single": 64, "write": 16},
+    "max_wait": 5,
+    "user_rate": {"rate": 10, "burst": 20}
+}
+
+RESILIENCE = {
+    "request_budget": 60,
+    "operation_timeout": 30,
+    "timeouts": {"kms": 5, "audit": 5},
+    "circuit_breaker": {"failure_rate": 0.5, "min_calls": 20, "window": 30, "open_seconds": 30}
+}
+
+UPDATE_RETRIES = {
+    "attempts": 5,
+    "base_delay": 0.05,
+    "max_delay": 1
+}
+
+IDEMPOTENCY = {
+    "backend": "local",
+    "max_size": 10000,
+    "ttl": 86400,
+    "max_wait": 10
+}
+
+CHANGE_FEED = {
+    "heartbeat": 15,
+    "max_duration": 120,
+    "retry": 3000,
+    "queue_size": 100,
+    "max_subscribers": 4,
+    "poll_interval": 2
+}
+
+TOKEN_CACHE = {
+    "max_size": 10000,
+    "max_ttl": 600,
+    "jwks_refresh_interval": 3600
+}
+
+ENTITY_CACHE = {
+    "backend": "local",
+    "max_size": 10000,
+    "ttl": 60
+}
+
+PROFILING = {
+    "scope": "profile.admin",
+    "mode": "sampling",
+    "output": "local",
+    "directory": "/tmp/profiles"
+}
+
+LIST_BUDGET = {
+    "max_rows": 10000,
+    "max_bytes": 50000000,
+    "fallback": "stream"
+}
+
+COST_ACCOUNTING = {
+    "header": True,
+    "log": True,
+    "slow_query_ms": 1000
+}
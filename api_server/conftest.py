@@ -0,0 +1,14 @@
+import importlib.util
+import os
+import sys
+
+TEST_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'openapi_server', 'test')
+
+# The tests run with their own configuration and specification instead of the ones of a deployment
+config_spec = importlib.util.spec_from_file_location('config', os.path.join(TEST_DIRECTORY, 'config.py'))
+sys.modules['config'] = importlib.util.module_from_spec(config_spec)
+config_spec.loader.exec_module(sys.modules['config'])
+
+from openapi_server import openapi_spec  # noqa: E402
+
+openapi_spec.OPENAPI_PATH = os.path.join(TEST_DIRECTORY, 'openapi', 'openapi.yaml')
@@ -8,24 +8,51 @@ from flask import request, current_app, g
 
 from openapi_server.datastoredatabase import DatastoreDatabase
 from openapi_server.firestoredatabase import FirestoreDatabase
+from openapi_server.memorydatabase import MemoryDatabase
 
 from openapi_server import encoder, openapi_spec
+from openapi_server.compression import ResponseCompression
+from openapi_server.cost_accounting import CostAccounting
+from openapi_server.profiling import RequestProfiler
+from openapi_server.resilience import Resilience
+from openapi_server.resolver import GenericOperationResolver, is_generic_handler
 
+# The response headers of the API that browsers may read
+EXPOSE_HEADERS = [
+    'Content-Disposition', 'ETag', 'Idempotent-Replayed', 'Link', 'Retry-After', 'X-Backend-Cost', 'X-Profile-Id',
+    'X-Response-Truncated', 'X-Watermark']
 
-def get_app():
+
+def get_app(specification_dir='./openapi/'):
     """
     Returns the OpenAPI app
+
+    :param specification_dir: The directory of the OpenAPI specification openapi.yaml
+    :type specification_dir: str
     """
 
-    app = connexion.App(__name__, specification_dir='./openapi/')
+    app = connexion.App(__name__, specification_dir=specification_dir)
     app.app.json_encoder = encoder.JSONEncoder
     app.add_api('openapi.yaml',
                 arguments={'title': 'Dynamic Data Manipulator API'},
+                resolver=GenericOperationResolver(),
                 strict_validation=True)
     if 'GAE_INSTANCE' in os.environ or 'K_SERVICE' in os.environ:
-        CORS(app.app, origins=config.ORIGINS, expose_headers=['Content-Disposition'])
+        CORS(app.app, origins=config.ORIGINS, expose_headers=EXPOSE_HEADERS)
     else:
-        CORS(app.app, expose_headers=['Content-Disposition'])
+        CORS(app.app, expose_headers=EXPOSE_HEADERS)
+
+    if hasattr(config, 'COMPRESSION'):
+        ResponseCompression(app.app, **config.COMPRESSION)
+
+    if hasattr(config, 'COST_ACCOUNTING'):
+        CostAccounting(app.app, **config.COST_ACCOUNTING)
+
+    if hasattr(config, 'RESILIENCE'):
+        Resilience(app.app, **config.RESILIENCE)
+
+    if hasattr(config, 'PROFILING'):
+        RequestProfiler(app.app, **config.PROFILING)
 
     with app.app.app_context():
         current_app.__pii_filter_def__ = None
@@ -46,12 +73,20 @@ def get_app():
                 current_app.db_client = DatastoreDatabase()
             elif config.DATABASE_TYPE == 'firestore':
                 current_app.db_client = FirestoreDatabase()
+            elif config.DATABASE_TYPE == 'memory':
+                current_app.db_client = MemoryDatabase()
+
+    # Compile the route plans before the first request
+    openapi_spec.get_route_planner()
 
     @app.app.before_request
     def before_request_func():
+        # The handlers of generic operations bind the route plan of their path themselves
+        if is_generic_handler(current_app.view_functions.get(request.endpoint)):
+            return
+
         try:
-            g.db_table_name, g.db_table_id, g.db_keys, g.response_keys, \
-                g.request_id, g.request_queries, g.forced_filters = openapi_spec.get_database_info(request)
+            openapi_spec.bind_route_plan(request, openapi_spec.get_route_plan(request))
         except ValueError as e:
             g.ip = request.remote_addr
             g.user = ''
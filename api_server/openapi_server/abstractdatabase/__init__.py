@@ -1,3 +1,14 @@
-from .abstractdatabase import DatabaseInterface, EntityParser, ForcedFilters
+from .abstractdatabase import DatabaseInterface, EntityParser, AuditDiff, ChangePoller, ChangeSet, ForcedFilters, \
+    PreconditionFailed, UpdateConflict, create_change_event, create_entity_response, create_etag, \
+    data_type_validator, format_watermark, get_active_filters, get_change_position, get_change_set, \
+    get_filter_value, get_if_match_version, get_inequality_field, get_value, has_active_filters, is_after_watermark, \
+    iterate_chunks, limit_page_bytes, normalize_change_time, parse_etag, parse_watermark, patch_entity, \
+    read_partitions, reduce_aggregate, run_with_retries, validate_if_match
 
-__all__ = ['DatabaseInterface', 'EntityParser', 'ForcedFilters']
+__all__ = ['DatabaseInterface', 'EntityParser', 'AuditDiff', 'ChangePoller', 'ChangeSet', 'ForcedFilters',
+           'PreconditionFailed', 'UpdateConflict', 'create_change_event', 'create_entity_response', 'create_etag',
+           'data_type_validator', 'format_watermark', 'get_active_filters', 'get_change_position', 'get_change_set',
+           'get_filter_value', 'get_if_match_version', 'get_inequality_field', 'get_value', 'has_active_filters',
+           'is_after_watermark', 'iterate_chunks', 'limit_page_bytes', 'normalize_change_time', 'parse_etag',
+           'parse_watermark', 'patch_entity', 'read_partitions', 'reduce_aggregate', 'run_with_retries',
+           'validate_if_match']
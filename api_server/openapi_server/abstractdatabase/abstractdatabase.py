@@ -1,16 +1,28 @@
 # flake8: noqa
 
+import base64
+import itertools
+import json
+import logging
 import operator
+import pandas as pd
+import queue
+import random
+import threading
+import time
+import types
 
 from abc import ABC, abstractmethod
-from flask import g
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from flask import g, request
 from functools import reduce
 
 
 class DatabaseInterface(ABC):
 
     @abstractmethod
-    def process_audit_logging(self, old_data, new_data):
+    def process_audit_logging(self, changes, entity_id):
         pass
 
     @abstractmethod
@@ -25,14 +37,41 @@ class DatabaseInterface(ABC):
     def post_single(self, body, kind, db_keys, res_keys):
         pass
 
+    @abstractmethod
+    def patch_single(self, id, body, kind, db_keys, res_keys):
+        pass
+
     @abstractmethod
     def get_multiple(self, kind, db_keys, res_keys, filters):
         pass
 
     @abstractmethod
-    def get_multiple_page(self, kind, db_keys, res_keys, filters, page_cursor, page_size, page_action):
+    def get_multiple_page(self, kind, db_keys, res_keys, filters, page_cursor, page_size, page_action,
+                          max_bytes=None):
+        pass
+
+    @abstractmethod
+    def get_multiple_partitioned(self, kind, db_keys, res_keys, filters, partition_count, max_workers, ordered):
+        pass
+
+    @abstractmethod
+    def get_aggregate(self, kind, filters, aggregate, field, group_by):
         pass
 
+    @abstractmethod
+    def watch_changes(self, kind, filters, publish):
+        pass
+
+
+class PreconditionFailed(Exception):
+    """Raised when an entity does not match the If-Match header of the request"""
+    pass
+
+
+class UpdateConflict(Exception):
+    """Raised when an update keeps conflicting with concurrent updates"""
+    pass
+
 
 class EntityParser:
 
@@ -80,6 +119,51 @@ class EntityParser:
 
         return entity_to_return
 
+    def parse_patch(self, keys, patch):
+        """Returns the target field paths and values of a JSON merge-patch
+
+        Only the properties within the patch are validated against the schema. A null value removes the field.
+
+        :param keys: List of keys for database entity
+        :type keys: dict
+        :param patch: The JSON merge-patch
+        :type patch: dict
+
+        :rtype: dict
+        """
+
+        if not isinstance(patch, dict):
+            raise ValueError("The request body is not a JSON merge-patch object")
+
+        field_paths = {}
+        for key, value in patch.items():
+            if key not in keys or key.startswith('_'):
+                raise ValueError(f"Property '{key}' is not within the schema")
+
+            if key == g.db_table_id:
+                raise ValueError(f"Property '{key}' can not be changed")
+
+            if isinstance(keys[key], dict) and '_properties' in keys[key]:
+                if isinstance(value, dict):
+                    field_paths.update(self.parse_patch(keys[key]['_properties'], value))
+                elif value is None:
+                    field_paths.update({'.'.join(target): None for target in self.flatten(
+                        keys[key]['_properties']).values()})
+                else:
+                    raise ValueError(f"Property '{key}' is not of type 'object'")
+                continue
+
+            if value is None and keys[key].get('required', False):
+                raise ValueError(f"Property '{key}' is required")
+
+            schema_type = keys[key].get('type')
+            if value is not None and not is_schema_type(value, schema_type):
+                raise ValueError(f"Property '{key}' is not of type '{schema_type}'")
+
+            field_paths['.'.join(keys[key].get('_target', [key]))] = value
+
+        return field_paths
+
     def create_update_object(self, keys, entity):
         target_keys = self.flatten(d=keys, sep='.')
 
@@ -117,6 +201,86 @@ class EntityParser:
         return dict(items)
 
 
+class AuditDiff:
+
+    def __init__(self):
+        pass
+
+    def compare(self, old_data, update_object, parent_key=None):
+        """Returns the changes for each leaf path touched by an update
+
+        Only the attributes within the update object are compared, so the entity never has to be copied. Because
+        nested objects are replaced as a whole, leaves missing from a nested update object are logged as removed. A
+        missing attribute that stays empty is not a change.
+
+        :param old_data: The entity before the update
+        :type old_data: dict
+        :param update_object: The parsed update object
+        :type update_object: dict
+        :param parent_key: The path of the current nested object
+        :type parent_key: str | None
+
+        :rtype: dict
+        """
+
+        changes = {}
+        for key, new_value in update_object.items():
+            path = f"{parent_key}.{key}" if parent_key else key
+            exists = isinstance(old_data, dict) and key in old_data
+            old_value = old_data[key] if exists else None
+
+            if isinstance(new_value, dict) and new_value and (not exists or isinstance(old_value, dict)):
+                changes.update(self.compare(old_value if exists else {}, new_value, path))
+
+                if exists:
+                    for removed_key in set(old_value) - set(new_value):
+                        changes.update(self.removed(old_value[removed_key], f"{path}.{removed_key}"))
+            elif not exists:
+                if new_value is not None:
+                    changes[path] = {"new": new_value}
+            elif old_value != new_value:
+                changes[path] = {"old": old_value, "new": new_value}
+
+        return changes
+
+    def compare_paths(self, old_data, field_paths):
+        """Returns the changes for the field paths of a partial update, a None value being a removed field
+
+        :param old_data: The entity before the update
+        :type old_data: dict
+        :param field_paths: The new value for each dotted field path
+        :type field_paths: dict
+
+        :rtype: dict
+        """
+
+        changes = {}
+        for path, new_value in field_paths.items():
+            try:
+                old_value = get_from_dict(old_data, path.split('.'))
+            except (KeyError, AttributeError, TypeError):
+                if new_value is not None:
+                    changes[path] = {"new": new_value}
+                continue
+
+            if old_value != new_value:
+                changes[path] = {"old": old_value, "new": new_value}
+
+        return changes
+
+    def removed(self, old_value, path):
+        """Returns a removal for each leaf path of a value"""
+
+        if isinstance(old_value, dict) and old_value:
+            changes = {}
+            for key in old_value:
+                changes.update(self.removed(old_value[key], f"{path}.{key}"))
+
+            return changes
+
+        return {path: {"old": old_value, "new": None}}
+
+
 class ForcedFilters:
 
     def __init__(self):
@@ -167,6 +331,569 @@ class ForcedFilters:
             raise PermissionError("Unauthorized request")
 
 
+def create_etag(version):
+    """Returns a strong ETag for a version of an entity, from which the version can be read back with parse_etag"""
+    return f'"{base64.urlsafe_b64encode(version.encode()).decode().rstrip("=")}"'
+
+
+def parse_etag(etag):
+    """Returns the version of an entity within an ETag, or None if it is not an ETag of this API"""
+    value = etag.strip()
+    value = value[2:] if value.startswith('W/') else value
+    value = value.strip('"')
+
+    try:
+        return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode()
+    except ValueError:
+        return None
+
+
+def get_if_match_version():
+    """Returns the version of an entity within the If-Match header of the request, if it contains a single ETag"""
+    if_match = request.headers.get('If-Match')
+    if not if_match or if_match.strip() == '*' or ',' in if_match:
+        return None
+
+    return parse_etag(if_match)
+
+
+def validate_if_match(etag):
+    """Raises an error when the If-Match header of the request does not contain the ETag of the entity"""
+    if_match = request.headers.get('If-Match')
+    if not if_match or if_match.strip() == '*':
+        return
+
+    if etag not in [value.strip().replace('W/', '', 1) for value in if_match.split(',')]:
+        raise PreconditionFailed("The entity has been changed since it was read")
+
+
+def run_with_retries(func, exceptions, attempts=5, base_delay=0.05, max_delay=1):
+    """Runs a function, retrying on conflicts with an exponential backoff and full jitter
+
+    :param func: The function to run
+    :type func: function
+    :param exceptions: The exceptions of conflicts to retry on
+    :type exceptions: tuple
+    :param attempts: The maximum number of attempts
+    :type attempts: int
+    :param base_delay: The maximum delay in seconds after the first attempt
+    :type base_delay: float
+    :param max_delay: The maximum delay in seconds after any attempt
+    :type max_delay: float
+    """
+
+    for attempt in range(attempts):
+        try:
+            return func()
+        except exceptions:
+            if attempt == attempts - 1:
+                raise UpdateConflict("The entity is updated concurrently, please try again")
+
+            time.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+
+
 def get_from_dict(data_dict, map_list):
     """Returns a dictionary based on a mapping"""
     return reduce(operator.getitem, map_list, data_dict)
+
+
+def is_schema_type(value, schema_type):
+    """Returns if a value is of an OpenAPI schema type"""
+    python_types = {
+        'string': str,
+        'integer': int,
+        'number': (int, float),
+        'boolean': bool,
+        'array': list,
+        'object': dict
+    }
+
+    if schema_type not in python_types:
+        return True
+
+    if isinstance(value, bool) and schema_type != 'boolean':
+        return False
+
+    return isinstance(value, python_types[schema_type])
+
+
+class ChangeSet:
+    """Tracks the watermark and deleted entities of a query on a path with change tracking
+
+    The watermark is the position of the latest change read: its change timestamp and the identifier of its entity.
+    Writes within the same tick share a timestamp, so the query reads from the timestamp of the watermark on and the
+    changes up to its position are skipped. Entities marked with the tombstone field are removed from the results and
+    returned as deleted identifiers instead.
+    """
+
+    def __init__(self, settings, watermark):
+        self.field = settings['field']
+        self.tombstone_field = settings.get('tombstone_field')
+        self.changed_since = watermark[0] if watermark else None
+        self.start = watermark
+        self.watermark = watermark
+        self.deleted = []
+
+    def filter(self, entities, get_id, get_changed, get_tombstone):
+        """Yields the changed entities that are not deleted, while keeping track of the watermark
+
+        :param entities: The entities read from the database
+        :type entities: iterable
+        :param get_id: Function returning the identifier of an entity
+        :type get_id: function
+        :param get_changed: Function returning the change timestamp of an entity
+        :type get_changed: function
+        :param get_tombstone: Function returning the tombstone value of an entity
+        :type get_tombstone: function
+        """
+
+        for entity in entities:
+            position = get_change_position(normalize_change_time(get_changed(entity)), get_id(entity))
+            if not is_after_watermark(position, self.start):
+                continue
+
+            if position is not None and (self.watermark is None or position > self.watermark):
+                self.watermark = position
+
+            if self.tombstone_field and get_tombstone(entity):
+                self.deleted.append(get_id(entity))
+                continue
+
+            yield entity
+
+    def annotate(self, response):
+        """Adds the watermark and deleted entities to a response"""
+
+        response['watermark'] = format_watermark(self.watermark)
+        if self.tombstone_field:
+            response['deleted'] = self.deleted
+
+        return response
+
+
+def normalize_change_time(changed):
+    """Returns the change timestamp of an entity as an aware datetime, or None if it has none"""
+    if isinstance(changed, str):
+        changed = parse_timestamp(changed)
+
+    if not isinstance(changed, datetime):
+        return None
+
+    return changed.replace(tzinfo=timezone.utc) if changed.tzinfo is None else changed
+
+
+def create_change_event(id, entity, changed, deleted):
+    """Returns an event of a change feed for a changed entity
+
+    :param id: The identifier of the entity
+    :type id: str | int
+    :param entity: The raw entity, also for a deleted entity so forced filters can be applied to it
+    :type entity: dict
+    :param changed: The change timestamp of the entity
+    :type changed: datetime | str | None
+    :param deleted: If the entity is deleted
+    :type deleted: bool
+
+    :rtype: dict
+    """
+
+    return {'id': id, 'entity': entity, 'changed': normalize_change_time(changed), 'deleted': deleted}
+
+
+def get_change_position(changed, id):
+    """Returns the position of a change within the order of changes, or None for an entity without change timestamp
+
+    :param changed: The change timestamp of the entity
+    :type changed: datetime | None
+    :param id: The identifier of the entity
+    :type id: str | int
+
+    :rtype: tuple | None
+    """
+
+    return (changed, str(id)) if changed is not None else None
+
+
+def is_after_watermark(position, watermark):
+    """Returns if a change lies after the watermark, entities without change timestamp always do"""
+    return watermark is None or position is None or position > watermark
+
+
+class ChangePoller:
+    """Polls for entities changed since the watermark in a background thread, for backends without listeners"""
+
+    def __init__(self, poll, publish, interval):
+        """
+        :param poll: Function returning the change events from a change timestamp on
+        :type poll: function
+        :param publish: Function publishing a list of change events
+        :type publish: function
+        :param interval: The number of seconds between polls
+        :type interval: float
+        """
+
+        self.poll = poll
+        self.publish = publish
+        self.interval = interval
+        self.watermark = (datetime.now(timezone.utc), '')
+        self.stopped = threading.Event()
+
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                events = self.poll(self.watermark[0])
+            except Exception as e:
+                logging.warning(f"An exception occurred when polling for changes: {str(e)}")
+                continue
+
+            # The poll reads from the timestamp of the watermark on, the changes up to its position were published
+            positions = [get_change_position(event['changed'], event['id']) for event in events]
+            events = [
+                event for event, position in zip(events, positions) if is_after_watermark(position, self.watermark)]
+            self.watermark = max([self.watermark] + [position for position in positions if position is not None])
+
+            if events:
+                self.publish(events)
+
+    def stop(self):
+        self.stopped.set()
+
+
+def get_change_set():
+    """Returns a change set for the current request if its path tracks changes, otherwise None
+
+    The watermark is the query parameter 'changed_since', or the resume token of a change feed.
+    """
+    if not g.get('changes'):
+        return None
+
+    changed_since = request.args.get('changed_since') or g.get('resume_token')
+    if not changed_since:
+        return ChangeSet(g.changes, None)
+
+    watermark = parse_watermark(changed_since)
+    if watermark is None:
+        raise ValueError(f"Value '{changed_since}' for query param 'changed_since' is not a valid watermark")
+
+    return ChangeSet(g.changes, watermark)
+
+
+def parse_timestamp(value):
+    for date_format in ["%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%SZ"]:
+        try:
+            return datetime.strptime(value, date_format).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+
+    return None
+
+
+def parse_watermark(value):
+    """Returns the position of a watermark, a plain timestamp is positioned before every change at that time
+
+    :param value: The change timestamp, optionally followed by '~' and the identifier of the entity
+    :type value: str | None
+
+    :rtype: tuple | None
+    """
+
+    if not value:
+        return None
+
+    timestamp, _, id = value.partition('~')
+    changed = parse_timestamp(timestamp)
+
+    return (changed, id) if changed else None
+
+
+def format_watermark(value):
+    """Returns the position of a watermark as its change timestamp, followed by '~' and the identifier of the entity"""
+    if value is None:
+        return None
+
+    changed, id = value
+    timestamp = changed.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+    return f"{timestamp}~{id}" if id else timestamp
+
+
+def get_active_filters(filters):
+    """Returns the forced filters and requested query filters that apply to the query"""
+    if not filters:
+        return []
+
+    args = request.args.to_dict()
+    return [filter for filter in filters if filter['name'] == '_FORCED_FILTER' or filter['name'] in args]
+
+
+def get_filter_value(filter, args):
+    """Returns the value of a forced filter for the current user, or the value of a requested query filter
+
+    :param filter: The forced filter or query filter
+    :type filter: dict
+    :param args: The query parameters of the request
+    :type args: dict
+
+    :rtype: any
+    """
+    if filter['name'] == '_FORCED_FILTER':
+        if filter['value'] == "_UPN":
+            return g.user
+        elif filter['value'] == "_IP":
+            return g.ip
+
+        return filter['value']
+
+    filter_datatype = filter['schema']['format'] if filter['schema'].get('format') else filter['schema']['type']
+    filter_value = data_type_validator(args[filter['name']], filter_datatype)
+
+    if not filter_value:
+        raise ValueError(f"Value '{args[filter['name']]}' for query param "
+                         f"'{filter['name']}' is not of type '{filter_datatype}'")
+
+    return filter_value
+
+
+def data_type_validator(value, type):
+    try:
+        if not type:
+            return value
+        if type == 'integer' or type == 'number':
+            value = int(value)
+        if type == 'boolean':
+            value = bool(value)
+        if type == 'date-time':
+            value = datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
+        if type == 'date':
+            value = datetime.strptime(value, "%Y-%m-%d")
+    except Exception:
+        return None
+    else:
+        return value
+
+
+def patch_entity(entity, path, value):
+    """Sets the value of a field path within an entity, or removes the field if the value is None"""
+    parent = entity
+    for key in path[:-1]:
+        if not isinstance(parent.get(key), dict):
+            if value is None:
+                return
+
+            parent[key] = {}
+
+        parent = parent[key]
+
+    if value is None:
+        parent.pop(path[-1], None)
+    else:
+        parent[path[-1]] = value
+
+
+def create_entity_response(keys, data, get_id):
+    """Returns the response fields of an entity, or of each entity within a list of entities
+
+    :param keys: The response keys
+    :type keys: dict
+    :param data: An entity, or a list or generator of entities
+    :type data: any
+    :param get_id: Function returning the identifier of an entity
+    :type get_id: function
+
+    :rtype: dict
+    """
+    if isinstance(data, types.GeneratorType) or isinstance(data, list):
+        return_object = {}
+        for key in keys:
+            if type(keys[key]) == dict:
+                return_object[key] = [EntityParser().parse(keys[key], entity, 'get', get_id(entity)) for entity in data]
+
+        return return_object
+
+    return EntityParser().parse(keys, data, 'get', get_id(data))
+
+
+def get_value(entity, field):
+    """Returns the value of a (nested) field of an entity, or None if it does not exist"""
+    if field in entity:
+        return entity[field]
+
+    try:
+        return get_from_dict(entity, field.split('.'))
+    except (KeyError, AttributeError, TypeError):
+        return None
+
+
+def reduce_aggregate(rows, aggregate, group_by):
+    """Returns the aggregate of a list of (value, group) rows, reduced over the whole column at once
+
+    :param rows: A list of tuples with the aggregated value and the group of an entity
+    :type rows: list
+    :param aggregate: The aggregation: 'count', 'sum' or 'avg'
+    :type aggregate: str
+    :param group_by: The field the entities are grouped by
+    :type group_by: str | None
+
+    :rtype: int | float | list | None
+    """
+
+    if aggregate == 'count' and not group_by:
+        return len(rows)
+
+    values, groups = zip(*rows) if rows else ((), ())
+    values = pd.Series(values, dtype='object')
+    reduction = {'count': 'size', 'sum': 'sum', 'avg': 'mean'}[aggregate]
+
+    if aggregate != 'count':
+        values = pd.to_numeric(values, errors='coerce')
+
+    if not group_by:
+        return to_python_value(getattr(values, reduction)())
+
+    try:
+        result = getattr(values.groupby(pd.Series(groups, dtype='object'), dropna=False), reduction)()
+    except TypeError:
+        raise ValueError(f"Field '{group_by}' can not be used to group entities")
+
+    return [{'group': to_python_value(group), 'value': to_python_value(value)} for group, value in result.items()]
+
+
+def to_python_value(value):
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return None
+
+    return value.item() if hasattr(value, 'item') else value
+
+
+def get_inequality_field(filters, change_set=None):
+    """Returns the field of the inequality filter of a query, which has to be the first sort order of the query"""
+    if change_set and change_set.changed_since:
+        return change_set.field
+
+    for filter in get_active_filters(filters):
+        if filter['comparison'] in ['<', '<=', '>', '>=']:
+            return filter['field']
+
+    return None
+
+
+def limit_page_bytes(docs, entities, max_bytes, reverse):
+    """Returns the documents of a page whose entities fit within a byte budget, and if the page was cut short
+
+    The size of an entity is the length of its JSON, a page always contains at least one document.
+
+    :param docs: The documents of the page
+    :type docs: list
+    :param entities: The data of each document
+    :type entities: list
+    :param max_bytes: The byte budget
+    :type max_bytes: int
+    :param reverse: Cut the page at its start instead of its end, for a previous page
+    :type reverse: bool
+
+    :rtype: tuple
+    """
+
+    size = 0
+    length = 0
+    for entity in (reversed(entities) if reverse else entities):
+        size += len(json.dumps(entity, default=str))
+        if length and size > max_bytes:
+            break
+
+        length += 1
+
+    if length == len(docs):
+        return docs, False
+
+    return (docs[-length:] if reverse else docs[:length]), True
+
+
+def has_active_filters(filters):
+    """Returns if any forced filter or requested query filter applies to the query"""
+    return bool(get_active_filters(filters))
+
+
+def iterate_chunks(results, size):
+    """Yields the results of an iterable as lists of at most the given size"""
+    iterator = iter(results)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class _PartitionDone:
+    """Marks the end of a partition within its queue, together with the error that ended it"""
+
+    def __init__(self, error=None):
+        self.error = error
+
+
+def read_partitions(partitions, reader, max_workers, ordered, queue_size=4):
+    """Yields the chunks of results of all partitions as they are read, concurrently within a bounded thread pool
+
+    The chunks are handed over through bounded queues, so the readers wait for a slow consumer instead of buffering
+    whole partitions. In partition order only the next partitions are read ahead, in completion order the chunks of all
+    partitions being read share a single queue. The readers stop when the consumer closes the generator.
+
+    :param partitions: A list of partitions to read
+    :type partitions: list
+    :param reader: Function yielding lists of results for a single partition
+    :type reader: function
+    :param max_workers: The maximum number of partitions read at the same time
+    :type max_workers: int
+    :param ordered: Yield results in partition order instead of completion order
+    :type ordered: bool
+    :param queue_size: The maximum number of chunks waiting per queue
+    :type queue_size: int
+    """
+
+    stopped = threading.Event()
+    queues = [queue.Queue(queue_size) for _ in partitions] if ordered else [queue.Queue(queue_size)] * len(partitions)
+
+    def put(index, item):
+        while not stopped.is_set():
+            try:
+                queues[index].put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def read(index):
+        try:
+            for chunk in reader(partitions[index]):
+                if stopped.is_set():
+                    return
+                put(index, chunk)
+        except Exception as e:
+            put(index, _PartitionDone(e))
+        else:
+            put(index, _PartitionDone())
+
+    # Partitions read in order are submitted as the previous ones are consumed, limiting how far they are read ahead
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    submitted = min(max_workers, len(partitions)) if ordered else len(partitions)
+    futures = [executor.submit(read, index) for index in range(submitted)]
+
+    try:
+        for index in range(len(partitions)):
+            while True:
+                item = queues[index].get()
+                if isinstance(item, _PartitionDone):
+                    break
+                yield item
+
+            if item.error:
+                raise item.error
+
+            if ordered and len(futures) < len(partitions):
+                futures.append(executor.submit(read, len(futures)))
+    finally:
+        stopped.set()
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
@@ -0,0 +1,174 @@
+import config
+import functools
+import math
+import threading
+import time
+
+from flask import g, make_response, request
+from openapi_server.controllers.content_controller import is_export_content_type
+
+ROUTE_CLASSES = ['export', 'list', 'single', 'write']
+
+
+class RouteClassLimiter:
+    """Limits the number of concurrent requests of a route class, with a bounded queue of waiting requests"""
+
+    def __init__(self, limit, queue_size, max_wait):
+        self.semaphore = threading.BoundedSemaphore(limit)
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.waiting = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.semaphore.acquire(blocking=False):
+            return True
+
+        with self.lock:
+            if self.waiting >= self.queue_size:
+                return False
+            self.waiting += 1
+
+        try:
+            return self.semaphore.acquire(timeout=self.max_wait)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+
+    def release(self):
+        self.semaphore.release()
+
+
+class TokenBucket:
+    """Limits the request rate per user"""
+
+    MAX_USERS = 10000
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, user):
+        """Takes a token for a user and returns the number of seconds to wait if there is none
+
+        :param user: The user
+        :type user: str
+
+        :rtype: int | None
+        """
+
+        now = time.monotonic()
+
+        with self.lock:
+            if user not in self.buckets and len(self.buckets) >= self.MAX_USERS:
+                self.remove_full_buckets(now)
+
+            tokens, updated = self.buckets.get(user, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+            if tokens < 1:
+                self.buckets[user] = (tokens, now)
+                return max(1, math.ceil((1 - tokens) / self.rate))
+
+            self.buckets[user] = (tokens - 1, now)
+            return None
+
+    def remove_full_buckets(self, now):
+        self.buckets = {
+            user: (tokens, updated) for user, (tokens, updated) in self.buckets.items() if
+            tokens + (now - updated) * self.rate < self.burst}
+
+
+class AdmissionControl:
+    """Sheds requests when a route class is at capacity or a user exceeds its rate"""
+
+    def __init__(self, settings):
+        limits = settings.get('limits', {})
+        queue_sizes = settings.get('queue_sizes', {})
+
+        self.retry_after = settings.get('retry_after', 1)
+        self.limiters = {
+            route_class: RouteClassLimiter(
+                limits[route_class], queue_sizes.get(route_class, limits[route_class]), settings.get('max_wait', 5))
+            for route_class in ROUTE_CLASSES if route_class in limits}
+        self.token_bucket = TokenBucket(settings['user_rate']['rate'], settings['user_rate']['burst']) if \
+            'user_rate' in settings else None
+
+    def run(self, route_class, func, *args, **kwargs):
+        """Runs a controller when the user is within its rate and its route class has capacity
+
+        :param route_class: The route class of the request
+        :type route_class: str
+        :param func: The controller
+        :type func: function
+
+        :return: The response of the controller, or the rejection of the request
+        :rtype: flask.Response | any
+        """
+
+        if self.token_bucket and g.get('user'):
+            retry_after = self.token_bucket.take(g.user)
+            if retry_after:
+                return create_rejection(
+                    429, "Too Many Requests", "The request rate of the user is exceeded", retry_after)
+
+        limiter = self.limiters.get(route_class)
+        if limiter is None:
+            return func(*args, **kwargs)
+
+        if not limiter.acquire():
+            return create_rejection(
+                503, "Service Unavailable", f"The capacity for '{route_class}' requests is exhausted", self.retry_after)
+
+        try:
+            response = func(*args, **kwargs)
+        except BaseException:
+            limiter.release()
+            raise
+
+        # The body of a streamed response is generated after the controller returned, so it keeps the slot until the
+        # response is closed
+        if getattr(response, 'is_streamed', False):
+            response.call_on_close(limiter.release)
+        else:
+            limiter.release()
+
+        return response
+
+
+def create_rejection(status, title, detail, retry_after):
+    response = make_response({"detail": detail, "status": status, "title": title, "type": "about:blank"}, status)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+admission_control = AdmissionControl(config.ADMISSION_CONTROL) if hasattr(config, 'ADMISSION_CONTROL') else None
+
+
+def admission_controlled(route_class):
+    """Runs a controller within the limits of its route class
+
+    The route class can be overridden per path's method with the extension 'x-route-class'. List requests for a
+    file export are classified as 'export'.
+
+    :param route_class: The default route class of the controller
+    :type route_class: str
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if admission_control is None:
+                return func(*args, **kwargs)
+
+            current_class = g.get('route_class') or route_class
+            if current_class == 'list' and is_export_content_type(request.content_type):
+                current_class = 'export'
+
+            return admission_control.run(current_class, func, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,206 @@
+import config
+import json
+import queue
+import threading
+import time
+
+from datetime import datetime, timezone
+from flask import current_app, g, request
+from openapi_server.abstractdatabase import EntityParser, ForcedFilters, format_watermark, get_change_position, \
+    is_after_watermark
+
+
+class Subscription:
+    """A client of a change feed, which receives the published changes through a bounded queue
+
+    A client that can not keep up overflows its queue, after which its stream is closed. The client reconnects with
+    the last event id and catches up by querying instead.
+    """
+
+    def __init__(self, key, queue_size):
+        self.key = key
+        self.queue = queue.Queue(queue_size)
+        self.overflowed = False
+
+    def put(self, events):
+        try:
+            self.queue.put_nowait(events)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        """Returns the next list of change events, or None when none was published within the timeout"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class ChangeFeedHub:
+    """Shares a single listener of the database per route and set of requested filters between all subscribers
+
+    The listener is started by the first subscriber and stopped when the last subscriber leaves. Forced filters are
+    left out of the listener and applied per subscriber.
+    """
+
+    def __init__(self, queue_size=100, max_subscribers=4):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.feeds = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, key, start):
+        """Subscribes to a change feed, starting its listener when it has none yet
+
+        :param key: The key of the change feed
+        :type key: tuple
+        :param start: Function starting a listener with a publish function as argument, returning a stop function
+        :type start: function
+
+        :return: The subscription, or None when the instance has no room for more subscribers
+        :rtype: Subscription | None
+        """
+
+        subscription = Subscription(key, self.queue_size)
+
+        with self.lock:
+            if sum(len(feed['subscriptions']) for feed in self.feeds.values()) >= self.max_subscribers:
+                return None
+
+            if key not in self.feeds:
+                stop = start(lambda events: self.publish(key, events))
+                self.feeds[key] = {'stop': stop, 'subscriptions': set()}
+
+            self.feeds[key]['subscriptions'].add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            feed = self.feeds.get(subscription.key)
+            if feed is None:
+                return
+
+            feed['subscriptions'].discard(subscription)
+            if feed['subscriptions']:
+                return
+
+            del self.feeds[subscription.key]
+
+        feed['stop']()
+
+    def publish(self, key, events):
+        with self.lock:
+            subscriptions = list(self.feeds[key]['subscriptions']) if key in self.feeds else []
+
+        for subscription in subscriptions:
+            subscription.put(events)
+
+
+change_feed_hub = ChangeFeedHub(
+    queue_size=config.CHANGE_FEED.get('queue_size', 100),
+    max_subscribers=config.CHANGE_FEED.get('max_subscribers', 4)) if hasattr(config, 'CHANGE_FEED') else None
+
+
+def get_feed_key():
+    """Returns the key of the change feed of the current request: its route and requested filters"""
+
+    args = sorted((name, value) for name, value in request.args.items(multi=True) if name != 'changed_since')
+    return str(request.url_rule), tuple(sorted((request.view_args or {}).items())), tuple(args)
+
+
+def filter_events(events, watermark):
+    """Returns the results and deleted identifiers of the change events the current subscriber may see
+
+    Changes up to the watermark were already sent, forced filters are applied with the user of the subscriber.
+
+    :param events: The change events published by the listener
+    :type events: list
+    :param watermark: The position of the last change sent, or None
+    :type watermark: tuple | None
+
+    :return: The results, deleted identifiers and the new watermark
+    :rtype: tuple
+    """
+
+    results, deleted = [], []
+    for event in events:
+        position = get_change_position(event['changed'], event['id'])
+        if not is_after_watermark(position, watermark):
+            continue
+
+        try:
+            ForcedFilters().validate(filters=g.forced_filters, entity=event['entity'])
+        except (PermissionError, ValueError):
+            continue
+
+        if position is not None and (watermark is None or position > watermark):
+            watermark = position
+
+        if event['deleted']:
+            deleted.append(event['id'])
+        else:
+            results.append(EntityParser().parse(g.response_keys['results'], event['entity'], 'get', event['id']))
+
+    return results, deleted, watermark
+
+
+def format_event(event, data, id=None):
+    """Returns a Server-Sent Event"""
+
+    lines = [f"event: {event}"]
+    if id:
+        lines.append(f"id: {id}")
+    lines.append(f"data: {json.dumps(data, cls=current_app.json_encoder)}")
+
+    return '\n'.join(lines) + '\n\n'
+
+
+def stream_changes(subscription, catch_up, watermark, settings):
+    """Yields the catch-up changes and then the live changes of a subscription as Server-Sent Events
+
+    The stream ends after the maximum duration or when the subscriber can not keep up, clients reconnect with the
+    header 'Last-Event-ID' to continue from the last change they received.
+
+    :param subscription: The subscription to the change feed
+    :type subscription: Subscription
+    :param catch_up: The changes since the resume token, or None without a resume token
+    :type catch_up: dict | None
+    :param watermark: The position of the last change sent, or None
+    :type watermark: tuple | None
+    :param settings: The CHANGE_FEED settings
+    :type settings: dict
+    """
+
+    heartbeat = settings.get('heartbeat', 15)
+    deadline = time.monotonic() + settings.get('max_duration', 120)
+
+    yield f"retry: {settings.get('retry', 3000)}\n\n"
+
+    if catch_up and (catch_up.get('results') or catch_up.get('deleted')):
+        yield format_event('changes', {
+            'results': catch_up.get('results', []),
+            'deleted': catch_up.get('deleted', []),
+            'watermark': format_watermark(watermark)
+        }, format_watermark(watermark))
+
+    yield format_event('ready', {'watermark': format_watermark(watermark)},
+                       format_watermark(watermark or (datetime.now(timezone.utc), '')))
+
+    while not subscription.overflowed:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        events = subscription.get(min(heartbeat, remaining))
+        if events is None:
+            yield ": heartbeat\n\n"
+            continue
+
+        results, deleted, watermark = filter_events(events, watermark)
+        if results or deleted:
+            yield format_event('changes', {
+                'results': results,
+                'deleted': deleted,
+                'watermark': format_watermark(watermark)
+            }, format_watermark(watermark))
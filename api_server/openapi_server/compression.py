@@ -0,0 +1,111 @@
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional, gzip is always available
+    brotli = None
+
+UNCOMPRESSIBLE_MIMETYPES = [
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'application/zip',
+    'application/gzip',
+    'application/octet-stream'
+]
+
+
+class ResponseCompression:
+    """Compresses responses based on the request's Accept-Encoding header"""
+
+    def __init__(self, app=None, level=6, brotli_quality=4, min_size=1024):
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.min_size = min_size
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self.compress_response)
+
+    def get_encoding(self, accept_encoding):
+        """Returns the preferred supported encoding from an Accept-Encoding header"""
+
+        supported = ['br', 'gzip'] if brotli is not None else ['gzip']
+        preferences = {}
+
+        for item in accept_encoding.split(','):
+            encoding, _, parameters = item.strip().partition(';')
+            try:
+                quality = float(parameters.strip()[2:]) if parameters.strip().startswith('q=') else 1.0
+            except ValueError:
+                continue
+
+            if encoding == '*':
+                for supported_encoding in supported:
+                    preferences.setdefault(supported_encoding, quality)
+            elif encoding in supported:
+                preferences[encoding] = quality
+
+        encodings = [encoding for encoding in supported if preferences.get(encoding, 0) > 0]
+        return max(encodings, key=lambda encoding: preferences[encoding]) if encodings else None
+
+    def create_compressor(self, encoding):
+        """Returns a compressor with a compress and flush function for an encoding"""
+
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            return compressor.process, lambda final: compressor.finish() if final else compressor.flush()
+
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        return compressor.compress, lambda final: compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+    def compress_stream(self, chunks, encoding):
+        """Yields compressed chunks, flushing after each chunk to keep the response streaming"""
+
+        compress, flush = self.create_compressor(encoding)
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+
+                data = compress(chunk) + flush(False)
+                if data:
+                    yield data
+
+            yield flush(True)
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    def compress_response(self, response):
+        if response.status_code < 200 or response.status_code in [204, 206, 304] or \
+                'Content-Encoding' in response.headers or response.mimetype in UNCOMPRESSIBLE_MIMETYPES:
+            return response
+
+        response.vary.add('Accept-Encoding')
+
+        encoding = self.get_encoding(request.headers.get('Accept-Encoding', ''))
+        if not encoding:
+            return response
+
+        if response.is_streamed:
+            response.response = self.compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+
+            compress, flush = self.create_compressor(encoding)
+            response.set_data(compress(data) + flush(True))
+
+        response.headers['Content-Encoding'] = encoding
+
+        # The encoded body differs from the identity body, so they can not share a strong validator
+        etag = response.headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            response.headers['ETag'] = f"W/{etag}"
+
+        return response
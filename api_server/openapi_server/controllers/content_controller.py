@@ -1,9 +1,20 @@
 import logging
 import io
+import json
 import pandas as pd
 
 from datetime import datetime
-from flask import g, make_response
+from flask import Response, current_app, g, make_response, stream_with_context
+
+EXPORT_TIMEZONE = 'Europe/Amsterdam'
+
+# The dtypes of the schema types, integers and booleans are nullable
+COLUMN_DTYPES = {
+    'integer': 'Int64',
+    'number': 'float64',
+    'boolean': 'boolean',
+    'string': 'object'
+}
 
 
 def response_csv(response):
@@ -13,7 +24,7 @@ def response_csv(response):
     try:
         output = io.StringIO()
 
-        df = create_dataframe(response)
+        df = create_dataframe(response, get_entity_keys(g.get('response_keys')))
         csv_response = df.to_csv(sep=";", index=False, decimal=",")
 
         output.write(csv_response)
@@ -35,7 +46,7 @@ def response_xlsx(response):
         output = io.BytesIO()
         writer = pd.ExcelWriter(output, engine='xlsxwriter')
 
-        df = create_dataframe(response)
+        df = create_dataframe(response, get_entity_keys(g.get('response_keys')))
         df.to_excel(writer, sheet_name=g.db_table_name, index=False)
 
         writer.save()
@@ -49,12 +60,104 @@ def response_xlsx(response):
         return make_response('Something went wrong during the generation of a XLSX file', 400)
 
 
-def create_dataframe(response):
-    df = pd.DataFrame(response)
-    for col in df.select_dtypes(include=['datetimetz']):
-        df[col] = df[col].apply(lambda a: a.tz_convert('Europe/Amsterdam').tz_localize(None))
+def create_dataframe(response, keys=None):
+    """Returns the entities as a dataframe with a column for each property of the schema
+
+    Nested objects are flattened to dotted columns and each column gets the dtype of its schema type. Without schema
+    properties the dtypes are inferred from the entities.
+
+    :param response: The entities
+    :type response: list | dict
+    :param keys: The schema properties of an entity
+    :type keys: dict | None
+
+    :rtype: pandas.DataFrame
+    """
+
+    entities = response if isinstance(response, list) else [response]
+    columns = get_export_columns(keys) if keys else None
+
+    if not columns:
+        df = pd.json_normalize(entities)
+        for col in df.select_dtypes(include=['datetimetz']):
+            df[col] = df[col].dt.tz_convert(EXPORT_TIMEZONE).dt.tz_localize(None)
+
+        return df
+
+    return pd.DataFrame({
+        name: create_column([get_entity_value(entity, path) for entity in entities], schema)
+        for name, path, schema in columns
+    })
+
+
+def get_entity_keys(response_keys):
+    """Returns the schema properties of an exported entity, which are those of the items of 'results' for a list"""
+
+    results = response_keys.get('results') if response_keys else None
+    if isinstance(results, dict):
+        # Items without a referenced schema are not compiled to properties
+        return None if results.get('type') == 'array' else results
 
-    return df
+    return response_keys
+
+
+def get_export_columns(keys, parent=()):
+    """Returns the dotted name, path and schema of each column from the schema properties of an entity"""
+
+    columns = []
+    for key, schema in keys.items():
+        if key.startswith('_') or not isinstance(schema, dict):
+            continue
+
+        if '_properties' in schema:
+            columns.extend(get_export_columns(schema['_properties'], parent + (key,)))
+        elif schema.get('type') == 'object' and 'properties' in schema:
+            columns.extend(get_export_columns(schema['properties'], parent + (key,)))
+        else:
+            columns.append(('.'.join(parent + (key,)), parent + (key,), schema))
+
+    return columns
+
+
+def get_entity_value(entity, path):
+    for key in path:
+        if not isinstance(entity, dict):
+            return None
+        entity = entity.get(key)
+
+    return entity
+
+
+def create_column(values, schema):
+    """Returns the values of a column as a series with the dtype of its schema type, converting date-times to the
+    export timezone over the whole column at once
+
+    Values not matching the schema type keep the column as objects.
+    """
+
+    schema_type = schema.get('type')
+    schema_format = schema.get('format')
+
+    try:
+        if schema_type == 'string' and schema_format in ['date-time', 'date']:
+            column = pd.to_datetime(pd.Series(values, dtype='object'), utc=True)
+            if schema_format == 'date-time':
+                column = column.dt.tz_convert(EXPORT_TIMEZONE)
+
+            return column.dt.tz_localize(None)
+
+        if schema_type in COLUMN_DTYPES:
+            return pd.Series(values, dtype=COLUMN_DTYPES[schema_type])
+    except (TypeError, ValueError, OverflowError):
+        pass
+
+    return pd.Series(values, dtype='object')
+
+
+def is_export_content_type(content_type):
+    """Returns if the request's content-type is a file export"""
+
+    return content_type in ['text/csv', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet']
 
 
 def create_content_response(response, content_type):
@@ -66,3 +169,42 @@ def create_content_response(response, content_type):
         return response_xlsx(response.get('results', response))
 
     return response  # JSON
+
+
+def stream_content_response(pages, content_type):
+    """Creates a streamed response based on the request's content-type, serializing one page of entities at a time
+
+    :param pages: The pages of entities
+    :type pages: iterable
+
+    :rtype: flask.Response
+    """
+
+    if content_type == 'text/csv':  # CSV
+        timestamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+        response = Response(stream_with_context(stream_csv(pages)), mimetype='text/csv')
+        response.headers['Content-Disposition'] = f"attachment; filename={g.db_table_name}_{timestamp}.csv"
+        return response
+
+    return Response(stream_with_context(stream_json(pages)), mimetype='application/json')
+
+
+def stream_csv(pages):
+    header = True
+    keys = get_entity_keys(g.get('response_keys'))
+
+    for page in pages:
+        if page:
+            yield create_dataframe(page, keys).to_csv(sep=";", index=False, decimal=",", header=header)
+            header = False
+
+
+def stream_json(pages):
+    separator = ''
+
+    yield '{"results": ['
+    for page in pages:
+        if page:
+            yield separator + ','.join(json.dumps(entity, cls=current_app.json_encoder) for entity in page)
+            separator = ','
+    yield ']}'
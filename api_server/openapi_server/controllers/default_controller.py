@@ -2,20 +2,36 @@ import config
 import os
 import re
 import base64
+import json
 import logging
 
-from openapi_server.controllers.content_controller import create_content_response
-from flask import request, current_app, g, jsonify, make_response
+from urllib.parse import urlencode
+from openapi_server.controllers.content_controller import create_content_response, is_export_content_type, \
+    stream_content_response
+from openapi_server.controllers.export_controller import get_export_status, get_export_store, get_preferences, \
+    prefers_async, start_export_job
+from flask import Response, request, current_app, g, jsonify, make_response, stream_with_context
 from google.cloud import kms
+from openapi_server.abstractdatabase import PreconditionFailed, UpdateConflict, parse_watermark
+from openapi_server.admission_control import admission_controlled, create_rejection
+from openapi_server.changefeed import change_feed_hub, get_feed_key, stream_changes
+from openapi_server.cursors import PAGE_PARAMETERS, decode_cursor, encode_cursor, is_signed
+from openapi_server.idempotency import idempotency_keyed
+from openapi_server.request_coalescing import SingleFlight, get_request_key
+from openapi_server.resilience import BackendUnavailable, call_backend, get_call_options, renew_deadline
+
+single_flight = SingleFlight(config.REQUEST_COALESCING.get('max_wait', 10)) if \
+    hasattr(config, 'REQUEST_COALESCING') else None
 
 
 def check_database_configuration(request_method):
     existing_config = {
         'db_client': False if current_app.db_client is None else True,
         'db_table_name': False if g.db_table_name is None else True,
-        'db_table_id': False if g.db_table_id is None else True,
+        'db_table_id': False if (request_method != 'aggregate' and g.db_table_id is None) else True,
         'response_keys': False if (request_method in ['get'] and g.response_keys is None) else True,
-        'db_keys': False if (request_method in ['post', 'put'] and g.db_keys is None) else True
+        'db_keys': False if (request_method in ['post', 'put', 'patch'] and g.db_keys is None) else True,
+        'aggregate': False if (request_method == 'aggregate' and not g.get('aggregate')) else True
     }
 
     for key in existing_config:
@@ -29,6 +45,11 @@ def check_identifier(kwargs):
         return make_response(jsonify("Identifier name not found"), 500)
 
 
+def get_host_url():
+    return config.BASE_URL.rstrip('/') if hasattr(config, 'BASE_URL') else \
+        request.host_url.replace('http://', 'https://')
+
+
 def kms_encrypt_decrypt_cursor(cursor, kms_type):
     if cursor and hasattr(config, 'KMS_KEY_INFO') and \
             'keyring' in config.KMS_KEY_INFO and \
@@ -41,14 +62,21 @@ def kms_encrypt_decrypt_cursor(cursor, kms_type):
 
         try:
             client = kms.KeyManagementServiceClient()
-            name = client.crypto_key_path_path(project_id, location_id, key_ring_id, crypto_key_id)
+            name = client.crypto_key_path(project_id, location_id, key_ring_id, crypto_key_id)
 
             if kms_type == 'encrypt':
-                encrypt_response = client.encrypt(name, cursor.encode() if isinstance(cursor, str) else cursor)
+                plaintext = cursor.encode() if isinstance(cursor, str) else cursor
+                encrypt_response = call_backend('kms', lambda timeout: client.encrypt(
+                    request={'name': name, 'plaintext': plaintext}, **get_call_options(timeout)), idempotent=True)
                 response = base64.urlsafe_b64encode(encrypt_response.ciphertext).decode()
             else:
-                encrypt_response = client.decrypt(name, base64.urlsafe_b64decode(cursor))
+                ciphertext = base64.urlsafe_b64decode(cursor)
+                encrypt_response = call_backend('kms', lambda timeout: client.decrypt(
+                    request={'name': name, 'ciphertext': ciphertext}, **get_call_options(timeout)), idempotent=True)
                 response = encrypt_response.plaintext
+        except BackendUnavailable:
+            # An unavailable KMS is not an invalid cursor
+            raise
         except Exception as e:
             logging.error(f"An exception occurred when {kms_type}-ing a cursor: {str(e)}")
             return None
@@ -58,6 +86,224 @@ def kms_encrypt_decrypt_cursor(cursor, kms_type):
     return response
 
 
+def encode_page_cursor(position):
+    cursor = encode_cursor(position)
+    return cursor if is_signed() else kms_encrypt_decrypt_cursor(cursor, 'encrypt')
+
+
+def decode_page_cursor(cursor):
+    if cursor and not is_signed():
+        cursor = kms_encrypt_decrypt_cursor(cursor, 'decrypt')
+        if cursor is None:
+            raise ValueError("Cursor is not valid")
+
+    return decode_cursor(cursor)
+
+
+def get_page_link(position, page_size, page_action):
+    """Returns the link to a page, keeping the query parameters the cursor is bound to"""
+
+    url_rule = re.sub(r'<.*?>', '', str(request.url_rule)).strip('/')
+    if not url_rule.endswith("/pages"):
+        url_rule = f"{url_rule}/pages"
+
+    args = [(key, value) for key, value in request.args.items(multi=True) if key not in PAGE_PARAMETERS]
+    args.extend([('page_size', page_size), ('page_action', page_action)])
+
+    return f"{get_host_url()}/{url_rule}/{encode_page_cursor(position)}?{urlencode(args)}"
+
+
+def add_etag(response):
+    """Adds the ETag of the entity read or written by the request"""
+
+    response = make_response(response)
+    if g.get('etag'):
+        response.headers['ETag'] = g.etag
+
+    return response
+
+
+def add_watermark(response, db_response):
+    """Adds the watermark of a path with change tracking as header, file exports can not contain it otherwise"""
+
+    if db_response.get('watermark'):
+        response = make_response(response)
+        response.headers['X-Watermark'] = db_response['watermark']
+
+    return response
+
+
+def is_partitioned_export():
+    """Returns if the current request is an export that is read in partitions"""
+
+    return hasattr(config, 'PARTITIONED_EXPORTS') and is_export_content_type(request.content_type) and \
+        not g.get('changes')
+
+
+def query_partitions():
+    """Returns the pages of entities of an export as its partitions are read, in key order only when preferred"""
+
+    return current_app.db_client.get_multiple_partitioned(
+        kind=g.db_table_name, db_keys=g.db_keys, res_keys=g.response_keys, filters=g.request_queries,
+        partition_count=config.PARTITIONED_EXPORTS.get('partition_count', 8),
+        max_workers=config.PARTITIONED_EXPORTS.get('max_workers', 4),
+        ordered='ordered' in get_preferences())
+
+
+def query_multiple():
+    """Returns all entities for the current request"""
+
+    if is_partitioned_export():
+        results = [entity for page in query_partitions() for entity in page]
+        return {'results': results} if results else None
+
+    return current_app.db_client.get_multiple(
+        kind=g.db_table_name, db_keys=g.db_keys, res_keys=g.response_keys, filters=g.request_queries)
+
+
+def query_export_pages():
+    """Returns the pages of entities of an export job as they are read, so the job holds one page at a time"""
+
+    if is_partitioned_export():
+        return query_partitions()
+
+    list_budget = {'max_rows': config.EXPORT_JOBS.get('page_size', 1000)}
+    return iterate_pages(query_page(list_budget), list_budget)
+
+
+def has_pages_route():
+    """Returns if the path of the current request is also defined extended with '/pages/{page_cursor}'"""
+
+    url_rule = str(request.url_rule).rstrip('/')
+    return any(rule.rule == f"{url_rule}/pages/<page_cursor>" for rule in current_app.url_map.iter_rules())
+
+
+def is_streamable():
+    """Returns if the list of the current request can be streamed
+
+    The watermark of a list is only known after its last page and XLSX files can not be written in parts.
+    """
+
+    return not g.get('changes') and \
+        request.content_type != 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def get_list_budget():
+    """Returns the row and byte budget of the current list, the budget of the route overrides the configured one
+
+    A list exceeding its budget is streamed or linked to its next page, so a list that can do neither has no budget.
+    """
+
+    list_budget = {**getattr(config, 'LIST_BUDGET', {}), **(g.get('list_budget') or {})}
+    if not list_budget.get('max_rows') or 'results' not in (g.response_keys or {}):
+        return None
+
+    return list_budget if is_streamable() or has_pages_route() else None
+
+
+def query_page(list_budget, page_cursor=None):
+    return current_app.db_client.get_multiple_page(
+        kind=g.db_table_name, db_keys=g.db_keys, res_keys=g.response_keys, filters=g.request_queries,
+        page_cursor=page_cursor, page_size=list_budget['max_rows'], page_action='next',
+        max_bytes=list_budget.get('max_bytes'))
+
+
+def iterate_pages(db_response, list_budget, statistics=None):
+    """Yields the entities of the first page, after which the next pages are read one at a time
+
+    The pages are streamed, so each page is read within a deadline of its own instead of that of the request.
+    """
+
+    while True:
+        yield db_response['results']
+
+        if not db_response.get('next_page'):
+            break
+
+        renew_deadline()
+        db_response = query_page(list_budget, db_response['next_page'])
+        if statistics is None:
+            continue
+
+        statistics['pages'] += 1
+        statistics['rows'] += len(db_response['results'])
+        statistics['peak_rows'] = max(statistics['peak_rows'], len(db_response['results']))
+
+
+def count_bytes(chunks, statistics):
+    """Yields the chunks of a streamed list, adding their size to the statistics of its budget"""
+
+    try:
+        for chunk in chunks:
+            statistics['bytes'] += len(chunk.encode() if isinstance(chunk, str) else chunk)
+            yield chunk
+    finally:
+        log_list_budget(statistics)
+
+
+def log_list_budget(statistics, response=None):
+    """Logs the rows read for a list with a budget and the size of its serialized response
+
+    :param statistics: The pages, rows and bytes of the list
+    :type statistics: dict
+    :param response: The response of a list that is not streamed, its body is measured
+    :type response: flask.Response | None
+    """
+
+    if response is not None:
+        statistics['bytes'] = len(response.get_data())
+
+    logging.info(json.dumps({'list_budget': statistics}))
+
+
+def get_multiple_within_budget(list_budget):
+    """Returns the entities of a list within its row and byte budget
+
+    The list is read as pages of the budget's size, so no more than one page is in memory at once. A list exceeding
+    the budget is either streamed page by page, or answered with its first page and a link to the next page when its
+    path is also defined extended with '/pages/{page_cursor}'.
+
+    :param list_budget: The row and byte budget
+    :type list_budget: dict
+
+    :rtype: flask.Response
+    """
+
+    db_response = query_page(list_budget)
+    rows = len(db_response['results'])
+    statistics = {'path': request.path, 'fallback': None, 'pages': 1, 'rows': rows, 'peak_rows': rows, 'bytes': 0}
+
+    if not db_response.get('next_page'):
+        db_response = {key: db_response[key] for key in ['results', 'watermark', 'deleted'] if key in db_response}
+        response = make_response(create_content_response(db_response, request.content_type))
+        log_list_budget(statistics, response)
+
+        return add_watermark(response, db_response)
+
+    # Without a path for the next pages the list is streamed as well
+    if is_streamable() and (list_budget.get('fallback', 'page') == 'stream' or not has_pages_route()):
+        statistics['fallback'] = 'stream'
+        response = stream_content_response(iterate_pages(db_response, list_budget, statistics), request.content_type)
+        response.response = count_bytes(response.response, statistics)
+        return response
+
+    statistics['fallback'] = 'page'
+
+    next_page = get_page_link(db_response['next_page'], list_budget['max_rows'], 'next')
+    if is_export_content_type(request.content_type):
+        response = make_response(create_content_response(db_response, request.content_type))
+        response.headers['Link'] = f'<{next_page}>; rel="next"'
+    else:
+        db_response['next_page'] = next_page
+        response = make_response(db_response)
+
+    response.headers['X-Response-Truncated'] = 'true'
+    log_list_budget(statistics, response)
+
+    return add_watermark(response, db_response)
+
+
+@admission_controlled('list')
 def generic_get_multiple():  # noqa: E501
     """Returns a array of entities
 
@@ -72,20 +318,48 @@ def generic_get_multiple():  # noqa: E501
     if db_existence:
         return db_existence
 
+    # Start a background export job when an asynchronous response is preferred
+    if prefers_async():
+        # A list with change tracking is read at once, as its watermark is only known after its last page
+        status = start_export_job(
+            query_multiple, request.content_type or 'application/json',
+            query_export_pages if not g.get('changes') and 'results' in g.response_keys else None)
+        export_path = config.EXPORT_JOBS.get('path', 'exports').strip('/')
+
+        response = make_response(jsonify(status), 202)
+        response.headers['Location'] = f"{get_host_url()}/{export_path}/{status['id']}"
+        response.headers['Preference-Applied'] = 'respond-async'
+        return response
+
+    list_budget = get_list_budget()
+
     try:
-        db_response = current_app.db_client.get_multiple(
-            kind=g.db_table_name, db_keys=g.db_keys, res_keys=g.response_keys, filters=g.request_queries)
+        if list_budget:
+            return get_multiple_within_budget(list_budget)
+
+        # A CSV export is written while its partitions are read, XLSX files can not be written in parts
+        if is_partitioned_export() and request.content_type == 'text/csv':
+            response = stream_content_response(query_partitions(), request.content_type)
+            if 'ordered' in get_preferences():
+                response.headers['Preference-Applied'] = 'ordered'
+            return response
+
+        if single_flight:
+            db_response, _ = single_flight.do(get_request_key(), query_multiple)
+        else:
+            db_response = query_multiple()
     except ValueError as e:
         return make_response({"detail": str(e), "status": 400, "title": "Bad Request", "type": "about:blank"}, 400)
     except PermissionError as e:
         return make_response({"detail": str(e), "status": 401, "title": "Unauthorized", "type": "about:blank"}, 401)
 
     if db_response:
-        return create_content_response(db_response, request.content_type)
+        return add_watermark(create_content_response(db_response, request.content_type), db_response)
 
     return make_response(jsonify([]), 204)
 
 
+@admission_controlled('list')
 def generic_get_multiple_page(**kwargs):  # noqa: E501
     """Returns a dict containing entities and pagination information
 
@@ -100,11 +374,11 @@ def generic_get_multiple_page(**kwargs):  # noqa: E501
     if db_existence:
         return db_existence
 
-    page_cursor = kms_encrypt_decrypt_cursor(kwargs.get('page_cursor', None), 'decrypt')
     page_size = kwargs.get('page_size', 50)
     page_action = kwargs.get('page_action', 'next')
 
     try:
+        page_cursor = decode_page_cursor(kwargs.get('page_cursor', None))
         db_response = current_app.db_client.get_multiple_page(
             kind=g.db_table_name, db_keys=g.db_keys, res_keys=g.response_keys, filters=g.request_queries,
             page_cursor=page_cursor, page_size=page_size, page_action=page_action)
@@ -114,31 +388,16 @@ def generic_get_multiple_page(**kwargs):  # noqa: E501
         return make_response({"detail": str(e), "status": 401, "title": "Unauthorized", "type": "about:blank"}, 401)
 
     if db_response:
-        url_rule = re.sub(r'<.*?>', '', str(request.url_rule)).strip('/')
-        host_url = config.BASE_URL.rstrip('/') if hasattr(config, 'BASE_URL') else \
-            request.host_url.replace('http://', 'https://')
+        for action in ['next', 'prev']:
+            position = db_response.get(f"{action}_page")
+            db_response[f"{action}_page"] = get_page_link(position, page_size, action) if position else None
 
-        if db_response.get('next_page'):
-            next_cursor = kms_encrypt_decrypt_cursor(db_response.get('next_page'), 'encrypt')
-
-            if not url_rule.endswith("/pages"):
-                url_rule = f"{url_rule}/pages"
-
-            db_response['next_page'] = f"{host_url}/{url_rule}/{next_cursor}?page_size={page_size}&page_action=next"
-        else:
-            db_response['next_page'] = None
-
-        if page_cursor:
-            prev_cursor = kms_encrypt_decrypt_cursor(page_cursor, 'encrypt')
-            db_response['prev_page'] = f"{host_url}/{url_rule}/{prev_cursor}?page_size={page_size}&page_action=prev"
-        else:
-            db_response['prev_page'] = None
-
-        return create_content_response(db_response, request.content_type)
+        return add_watermark(create_content_response(db_response, request.content_type), db_response)
 
     return make_response(jsonify([]), 204)
 
 
+@admission_controlled('single')
 def generic_get_single(**kwargs):  # noqa: E501
     """Returns an entity
 
@@ -168,11 +427,13 @@ def generic_get_single(**kwargs):  # noqa: E501
         return make_response({"detail": str(e), "status": 401, "title": "Unauthorized", "type": "about:blank"}, 401)
 
     if db_response:
-        return create_content_response(db_response, request.content_type)
+        return add_etag(create_content_response(db_response, request.content_type))
 
     return make_response('Not found', 404)
 
 
+@idempotency_keyed
+@admission_controlled('write')
 def generic_post_single(**kwargs):  # noqa: E501
     """Creates an entity
 
@@ -197,11 +458,12 @@ def generic_post_single(**kwargs):  # noqa: E501
         return make_response({"detail": str(e), "status": 401, "title": "Unauthorized", "type": "about:blank"}, 401)
 
     if db_response:
-        return make_response(jsonify(db_response), 201)
+        return add_etag(make_response(jsonify(db_response), 201))
 
     return make_response('Something went wrong', 400)
 
 
+@admission_controlled('write')
 def generic_put_single(**kwargs):  # noqa: E501
     """Updates an entity
 
@@ -230,68 +492,205 @@ def generic_put_single(**kwargs):  # noqa: E501
         return make_response({"detail": str(e), "status": 400, "title": "Bad Request", "type": "about:blank"}, 400)
     except PermissionError as e:
         return make_response({"detail": str(e), "status": 401, "title": "Unauthorized", "type": "about:blank"}, 401)
+    except PreconditionFailed as e:
+        return make_response(
+            {"detail": str(e), "status": 412, "title": "Precondition Failed", "type": "about:blank"}, 412)
+    except UpdateConflict as e:
+        return make_response({"detail": str(e), "status": 409, "title": "Conflict", "type": "about:blank"}, 409)
 
     if db_response:
-        return make_response(jsonify(db_response), 201)
+        return add_etag(make_response(jsonify(db_response), 201))
 
     return make_response('Not found', 404)
 
 
-def generic_get_multiple2():  # noqa: E501
-    return generic_get_multiple()
+@admission_controlled('write')
+def generic_patch_single(**kwargs):  # noqa: E501
+    """Updates the fields of an entity within a JSON merge-patch
 
+    :param kwargs: Keyword argument list
+    :type kwargs: dict
 
-def generic_get_multiple3():  # noqa: E501
-    return generic_get_multiple()
+    :rtype: dict
+    """
 
+    # Check for Database configuration
+    db_existence = check_database_configuration('patch')
+    if db_existence:
+        return db_existence
 
-def generic_get_multiple4():  # noqa: E501
-    return generic_get_multiple()
+    # Check if identifier exists and in kwargs
+    id_existence = check_identifier(kwargs)
+    if id_existence:
+        return id_existence
 
+    # Call DB func
+    try:
+        db_response = current_app.db_client.patch_single(
+            id=kwargs.get(g.request_id), body=kwargs.get('body', {}), kind=g.db_table_name,
+            db_keys=g.db_keys, res_keys=g.response_keys)
+    except ValueError as e:
+        return make_response({"detail": str(e), "status": 400, "title": "Bad Request", "type": "about:blank"}, 400)
+    except PermissionError as e:
+        return make_response({"detail": str(e), "status": 401, "title": "Unauthorized", "type": "about:blank"}, 401)
+    except PreconditionFailed as e:
+        return make_response(
+            {"detail": str(e), "status": 412, "title": "Precondition Failed", "type": "about:blank"}, 412)
+    except UpdateConflict as e:
+        return make_response({"detail": str(e), "status": 409, "title": "Conflict", "type": "about:blank"}, 409)
 
-def generic_get_multiple_page2(**kwargs):  # noqa: E501
-    return generic_get_multiple_page(**kwargs)
+    if db_response:
+        return add_etag(make_response(jsonify(db_response), 200))
 
+    return make_response('Not found', 404)
 
-def generic_get_multiple_page3(**kwargs):  # noqa: E501
-    return generic_get_multiple_page(**kwargs)
 
+@admission_controlled('list')
+def generic_get_aggregate(**kwargs):  # noqa: E501
+    """Returns the count, sum or average of the entities, optionally per group
 
-def generic_get_multiple_page4(**kwargs):  # noqa: E501
-    return generic_get_multiple_page(**kwargs)
+    :param kwargs: Keyword argument list
+    :type kwargs: dict
 
+    :rtype: dict
+    """
 
-def generic_get_single2(**kwargs):  # noqa: E501
-    return generic_get_single(**kwargs)
+    # Check for Database configuration
+    db_existence = check_database_configuration('aggregate')
+    if db_existence:
+        return db_existence
 
+    def query_aggregate():
+        return current_app.db_client.get_aggregate(
+            kind=g.db_table_name, filters=g.request_queries, aggregate=g.aggregate['aggregate'],
+            field=g.aggregate['field'], group_by=g.aggregate['group_by'])
 
-def generic_get_single3(**kwargs):  # noqa: E501
-    return generic_get_single(**kwargs)
+    try:
+        if single_flight:
+            db_response, _ = single_flight.do(get_request_key(), query_aggregate)
+        else:
+            db_response = query_aggregate()
+    except ValueError as e:
+        return make_response({"detail": str(e), "status": 400, "title": "Bad Request", "type": "about:blank"}, 400)
+    except PermissionError as e:
+        return make_response({"detail": str(e), "status": 401, "title": "Unauthorized", "type": "about:blank"}, 401)
 
+    response = {key: value for key, value in g.aggregate.items() if value is not None}
+    response['results' if g.aggregate['group_by'] else 'value'] = db_response
 
-def generic_get_single4(**kwargs):  # noqa: E501
-    return generic_get_single(**kwargs)
+    return make_response(jsonify(response), 200)
 
 
-def generic_post_single2(**kwargs):  # noqa: E501
-    return generic_post_single(**kwargs)
+@admission_controlled('list')
+def generic_get_changes(**kwargs):  # noqa: E501
+    """Streams the changes of the entities as Server-Sent Events
 
+    A client resuming with the header 'Last-Event-ID', or the query param 'changed_since', first receives the changes
+    it missed. Subscribers of the same route and filters share a single listener of the database.
 
-def generic_post_single3(**kwargs):  # noqa: E501
-    return generic_post_single(**kwargs)
+    :param kwargs: Keyword argument list
+    :type kwargs: dict
 
+    :rtype: text/event-stream
+    """
 
-def generic_post_single4(**kwargs):  # noqa: E501
-    return generic_post_single(**kwargs)
+    if change_feed_hub is None:
+        return make_response(jsonify("Change feeds are not configured"), 500)
 
+    # Check for Database configuration
+    db_existence = check_database_configuration('get')
+    if db_existence:
+        return db_existence
+
+    if not g.get('changes') or 'results' not in g.response_keys:
+        return make_response(jsonify("Change feeds need the extension 'x-changed-since-field'"), 500)
+
+    g.resume_token = request.headers.get('Last-Event-ID') or request.args.get('changed_since')
+
+    db_client = current_app.db_client
+    kind, filters = g.db_table_name, g.request_queries
+
+    try:
+        # Subscribing before catching up ensures no change is missed in between, duplicates are skipped
+        subscription = change_feed_hub.subscribe(
+            get_feed_key(), lambda publish: db_client.watch_changes(kind=kind, filters=filters, publish=publish))
+        if subscription is None:
+            return create_rejection(503, "Service Unavailable", "Too many change feed subscribers", 1)
+
+        try:
+            catch_up = db_client.get_multiple(
+                kind=kind, db_keys=g.db_keys, res_keys=g.response_keys, filters=filters) if g.resume_token else None
+        except Exception:
+            change_feed_hub.unsubscribe(subscription)
+            raise
+    except ValueError as e:
+        return make_response({"detail": str(e), "status": 400, "title": "Bad Request", "type": "about:blank"}, 400)
+    except PermissionError as e:
+        return make_response({"detail": str(e), "status": 401, "title": "Unauthorized", "type": "about:blank"}, 401)
+
+    watermark = parse_watermark((catch_up or {}).get('watermark') or g.resume_token)
+
+    response = Response(stream_with_context(stream_changes(subscription, catch_up, watermark, config.CHANGE_FEED)),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(lambda: change_feed_hub.unsubscribe(subscription))
+    return response
+
+
+@admission_controlled('single')
+def generic_get_export(**kwargs):  # noqa: E501
+    """Returns the status of an export job
+
+    :param kwargs: Keyword argument list
+    :type kwargs: dict
+
+    :rtype: dict
+    """
+
+    if not hasattr(config, 'EXPORT_JOBS'):
+        return make_response(jsonify("Export jobs are not configured"), 500)
+
+    # Check if identifier exists and in kwargs
+    id_existence = check_identifier(kwargs)
+    if id_existence:
+        return id_existence
+
+    status = get_export_status(kwargs.get(g.request_id))
+    if not status:
+        return make_response('Not found', 404)
+
+    if status['status'] == 'finished' and status.get('file_name'):
+        status['download_url'] = get_export_store().get_download_url(status['id']) or \
+            f"{get_host_url()}/{request.path.strip('/')}/file"
+
+    return make_response(jsonify(status), 200)
 
-def generic_put_single2(**kwargs):  # noqa: E501
-    return generic_put_single(**kwargs)
 
+@admission_controlled('export')
+def generic_get_export_file(**kwargs):  # noqa: E501
+    """Returns the file of a finished export job
 
-def generic_put_single3(**kwargs):  # noqa: E501
-    return generic_put_single(**kwargs)
+    :param kwargs: Keyword argument list
+    :type kwargs: dict
+
+    :rtype: file
+    """
 
+    if not hasattr(config, 'EXPORT_JOBS'):
+        return make_response(jsonify("Export jobs are not configured"), 500)
 
-def generic_put_single4(**kwargs):  # noqa: E501
-    return generic_put_single(**kwargs)
+    # Check if identifier exists and in kwargs
+    id_existence = check_identifier(kwargs)
+    if id_existence:
+        return id_existence
+
+    status = get_export_status(kwargs.get(g.request_id))
+    content = get_export_store().get_file(status['id']) if status and status['status'] == 'finished' else None
+    if content is None:
+        return make_response('Not found', 404)
+
+    response = make_response(content)
+    response.headers['Content-Type'] = status['content_type']
+    response.headers['Content-Disposition'] = f"attachment; filename={status['file_name']}"
+    return response
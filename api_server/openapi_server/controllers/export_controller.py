@@ -0,0 +1,204 @@
+import config
+import logging
+import re
+import threading
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from flask import copy_current_request_context, g, jsonify, request
+from openapi_server.controllers.content_controller import create_content_response, stream_csv, stream_json
+from openapi_server.exportstore import CloudStorageExportStore, LocalExportStore
+
+export_store = None
+export_executor = None
+export_lock = threading.Lock()
+
+# The content-types of exports that can be written in parts
+STREAMED_CONTENT_TYPES = ['application/json', 'text/csv']
+
+
+def get_export_store():
+    """Returns the store for export jobs based on the configuration"""
+    global export_store
+
+    with export_lock:
+        if export_store is None:
+            if config.EXPORT_JOBS.get('store', 'local') == 'gcs':
+                export_store = CloudStorageExportStore(
+                    config.EXPORT_JOBS['bucket'], url_expiration=config.EXPORT_JOBS.get('url_expiration', 3600))
+            else:
+                export_store = LocalExportStore(config.EXPORT_JOBS.get('directory', '/tmp/exports'))
+
+    return export_store
+
+
+def get_export_executor():
+    """Returns the thread pool running the export jobs"""
+    global export_executor
+
+    with export_lock:
+        if export_executor is None:
+            export_executor = ThreadPoolExecutor(max_workers=config.EXPORT_JOBS.get('max_workers', 2))
+
+    return export_executor
+
+
+def get_preferences():
+    """Returns the names of the preferences within the header 'Prefer' of the request"""
+
+    return [preference.split('=')[0].strip() for preference in request.headers.get('Prefer', '').split(',')]
+
+
+def prefers_async():
+    """Returns if the request asks for an asynchronous response"""
+
+    if not hasattr(config, 'EXPORT_JOBS'):
+        return False
+
+    return 'respond-async' in get_preferences()
+
+
+def get_timestamp():
+    return datetime.utcnow().isoformat(timespec="seconds") + 'Z'
+
+
+def start_export_job(query_func, content_type, query_pages=None):
+    """Starts an export job in the background and returns its status
+
+    :param query_func: Function returning the database response for the current request
+    :type query_func: function
+    :param content_type: The content-type of the export
+    :type content_type: str
+    :param query_pages: Function returning the pages of entities for the current request as they are read, without
+        it the whole database response is read at once
+    :type query_pages: function | None
+
+    :rtype: dict
+    """
+
+    status = {
+        'id': uuid.uuid4().hex,
+        'status': 'pending',
+        'rows': 0,
+        'table_name': g.db_table_name,
+        'content_type': content_type,
+        'user': g.get('user'),
+        'created': get_timestamp(),
+        'updated': get_timestamp()
+    }
+    get_export_store().save_status(status['id'], status)
+
+    # The job runs on a copy of the request, the request's globals are restored within the job. The job outlives the
+    # request, so it is not bound to the request's deadline.
+    request_globals = {key: g.get(key) for key in g if key != 'request_deadline'}
+    job = copy_current_request_context(run_export_job)
+    get_export_executor().submit(job, query_func, query_pages, dict(status), request_globals)
+
+    return status
+
+
+def run_export_job(query_func, query_pages, status, request_globals):
+    """Runs the query of an export job and saves the result within the export store
+
+    When the entities are read in pages, the number of rows is updated after each page and CSV and JSON files are
+    written to the store page by page. XLSX files can not be written in parts, so these are collected in full.
+    """
+
+    for key, value in request_globals.items():
+        setattr(g, key, value)
+
+    store = get_export_store()
+    update_export_status(store, status, status='running')
+
+    try:
+        if query_pages is None:
+            file_name = write_export_response(store, status, query_func())
+        elif status['content_type'] in STREAMED_CONTENT_TYPES:
+            file_name = write_export_pages(store, status, count_export_rows(store, status, query_pages()))
+        else:
+            results = [entity for page in count_export_rows(store, status, query_pages()) for entity in page]
+            file_name = write_export_response(store, status, {'results': results} if results else None)
+
+        update_export_status(store, status, status='finished', file_name=file_name)
+    except Exception as e:
+        logging.error(f"An exception occurred when running export job '{status['id']}': {str(e)}")
+        update_export_status(store, status, status='failed', error='The export could not be created')
+
+
+def count_export_rows(store, status, pages):
+    """Yields the pages of an export job, updating its number of rows after each page"""
+
+    for page in pages:
+        update_export_status(store, status, rows=status['rows'] + len(page))
+        yield page
+
+
+def write_export_pages(store, status, pages):
+    """Writes the pages of an export job to its file as they are read and returns the file name
+
+    :rtype: str
+    """
+
+    if status['content_type'] == 'text/csv':
+        chunks = stream_csv(pages)
+        file_name = f"{status['table_name']}_{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}.csv"
+    else:
+        chunks = stream_json(pages)
+        file_name = f"{status['table_name']}_{status['id']}"
+
+    with store.open_file(status['id'], status['content_type']) as export_file:
+        for chunk in chunks:
+            export_file.write(chunk.encode())
+
+    return file_name
+
+
+def write_export_response(store, status, db_response):
+    """Writes the database response of an export job to its file at once and returns the file name
+
+    :rtype: str | None
+    """
+
+    if not db_response:
+        return None
+
+    update_export_status(store, status, rows=sum(
+        len(value) for value in db_response.values() if isinstance(value, list)))
+
+    response = create_content_response(db_response, status['content_type'])
+    if isinstance(response, dict):
+        response = jsonify(response)
+
+    if response.status_code >= 400:
+        raise ValueError(response.get_data(as_text=True))
+
+    store.save_file(status['id'], response.get_data(), response.headers['Content-Type'])
+
+    file_name = re.search(r'filename=(.+)$', response.headers.get('Content-Disposition', ''))
+    return file_name.group(1) if file_name else f"{status['table_name']}_{status['id']}"
+
+
+def update_export_status(store, export_status, **kwargs):
+    """Updates the fields of the status of an export job, which include the field 'status' itself"""
+
+    export_status.update(kwargs)
+    export_status['updated'] = get_timestamp()
+
+    store.save_status(export_status['id'], export_status)
+
+
+def get_export_status(export_id):
+    """Returns the status of an export job when it is owned by the current user
+
+    :param export_id: A unique identifier
+    :type export_id: str
+
+    :rtype: dict | None
+    """
+
+    status = get_export_store().get_status(export_id)
+    if not status or status.get('user') != g.get('user'):
+        return None
+
+    return status
@@ -1,10 +1,20 @@
 import config
+import datetime
+import hashlib
+import json
+import jwt
 import logging
+import requests
+import threading
+import time
 
 from jwkaas import JWKaas
+from jwkaas.algorithms import RSAAlgorithm
 from flask import request, g
+from openapi_server.lru_cache import LRUCache
 
 my_jwkaas = None
+my_e2e_jwkaas = None
 
 if hasattr(config, 'OAUTH_JWKS_URL'):
     my_jwkaas = JWKaas(config.OAUTH_EXPECTED_AUDIENCE,
@@ -17,6 +27,102 @@ if hasattr(config, 'OAUTH_E2E_JWKS_URL'):
                            jwks_url=config.OAUTH_E2E_JWKS_URL)
 
 
+class JWKSRefresher:
+    """Refreshes the public keys of verifiers in the background, so no request waits for fetching them"""
+
+    MIN_REFRESH_INTERVAL = 60
+
+    def __init__(self, verifiers, interval):
+        self.verifiers = [verifier for verifier in verifiers if verifier is not None and verifier.jwks_url]
+        self.interval = interval
+        self.last_refresh = time.monotonic()
+        self.event = threading.Event()
+
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while True:
+            self.event.wait(self.interval)
+            self.event.clear()
+            self.last_refresh = time.monotonic()
+
+            for verifier in self.verifiers:
+                self.refresh(verifier)
+
+    @staticmethod
+    def refresh(verifier):
+        try:
+            jwks = requests.get(verifier.jwks_url, timeout=10).json()
+            pubkeys = {key['kid']: RSAAlgorithm.from_jwk(json.dumps(key)) for key in jwks.get('keys', [])}
+        except Exception as e:
+            logging.error(f"An exception occurred when refreshing the JWKS of '{verifier.jwks_url}': {str(e)}")
+            return
+
+        # Swap all keys at once, JWKaas itself clears its keys before fetching the new ones
+        verifier.pubkeys = pubkeys
+        verifier.last_pubkeys_refresh = datetime.datetime.utcnow()
+
+    def request_refresh(self):
+        """Requests an early refresh for an unknown key, at most once per minimum refresh interval"""
+
+        if time.monotonic() - self.last_refresh > self.MIN_REFRESH_INTERVAL:
+            self.event.set()
+
+
+token_cache = None
+jwks_refresher = None
+
+if hasattr(config, 'TOKEN_CACHE'):
+    token_cache = LRUCache(config.TOKEN_CACHE.get('max_size', 10000))
+    jwks_refresher = JWKSRefresher(
+        [my_jwkaas, my_e2e_jwkaas], config.TOKEN_CACHE.get('jwks_refresh_interval', 3600))
+
+
+def is_e2e_token(claims):
+    """Returns if the unverified claims of a token are meant for the e2e verifier"""
+
+    audience = claims.get('aud')
+    audiences = audience if isinstance(audience, list) else [audience]
+
+    return claims.get('iss') == config.OAUTH_E2E_EXPECTED_ISSUER and config.OAUTH_E2E_EXPECTED_AUDIENCE in audiences
+
+
+def verify_token(verifier, token):
+    """Returns the token info if a verifier validates the token, without fetching keys during the request"""
+
+    if jwks_refresher is not None:
+        try:
+            kid = jwt.get_unverified_header(token).get('kid')
+        except jwt.PyJWTError:
+            return None
+
+        if kid not in verifier.pubkeys:
+            logging.info(f"Received token but no matching pubkey found for [{kid}], refreshing keys")
+            jwks_refresher.request_refresh()
+            return None
+
+    return verifier.get_connexion_token_info(token)
+
+
+def verify_e2e_token(token):
+    token_info = verify_token(my_e2e_jwkaas, token)
+    if token_info is not None and 'appid' in token_info and token_info['appid'] == config.OAUTH_E2E_APPID:
+        logging.warning('Approved e2e access token for appid [%s]', token_info['appid'])
+        return {'scopes': config.OAUTH_E2E_SCOPES, 'sub': 'e2e', 'upn': 'e2e-technical-user'}
+
+    return None
+
+
+def cache_token_info(token_key, token_info, claims):
+    """Caches the info of a validated token until it expires, within the maximum time to live"""
+
+    now = time.time()
+    if 'exp' not in claims or claims.get('nbf', 0) > now:
+        return
+
+    token_cache.set(token_key, token_info, min(claims['exp'], now + config.TOKEN_CACHE.get('max_ttl', 600)))
+
+
 def info_from_oAuth2(token):
     """
     Validate and decode token.
@@ -29,15 +135,27 @@ def info_from_oAuth2(token):
     :return: Decoded token information or None if token is invalid
     :rtype: dict | None
     """
-    result = my_jwkaas.get_connexion_token_info(token)
     g.ip = request.remote_addr
 
-    # Check if e2e test token is configured
-    if result is None and my_e2e_jwkaas is not None:
-        token_info = my_e2e_jwkaas.get_connexion_token_info(token)
-        if token_info is not None and 'appid' in token_info and token_info['appid'] == config.OAUTH_E2E_APPID:
-            logging.warning('Approved e2e access token for appid [%s]', token_info['appid'])
-            result = {'scopes': config.OAUTH_E2E_SCOPES, 'sub': 'e2e', 'upn': 'e2e-technical-user'}
+    token_key = hashlib.sha256(token.encode()).hexdigest()
+    result = token_cache.get(token_key) if token_cache is not None else None
+
+    if result is None:
+        try:
+            claims = jwt.decode(token, options={'verify_signature': False})
+        except jwt.PyJWTError:
+            logging.warning("Token decode error")
+            return None
+
+        # Only try the e2e verifier, and try it first, when the token is meant for it
+        if my_e2e_jwkaas is not None and is_e2e_token(claims):
+            result = verify_e2e_token(token)
+
+        if result is None:
+            result = verify_token(my_jwkaas, token)
+
+        if result is not None and token_cache is not None:
+            cache_token_info(token_key, result, claims)
 
     if result is not None:
         g.user = result.get('upn')
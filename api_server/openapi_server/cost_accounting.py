@@ -0,0 +1,135 @@
+import json
+import logging
+import time
+
+from flask import current_app, g, has_app_context, has_request_context, request
+
+# The backend costs counted for each request
+COSTS = ['reads', 'writes', 'index_entries', 'rpcs']
+
+
+class CostAccounting:
+    """Counts the documents read and written, index entries scanned and RPCs issued by the backend for each request
+
+    The counts are returned in the header X-Backend-Cost and logged as a structured log line.
+    """
+
+    def __init__(self, app=None, header=True, log=True, slow_query_ms=None):
+        self.header = header
+        self.log = log
+        self.slow_query_ms = slow_query_ms
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['cost_accounting'] = self
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+
+    @staticmethod
+    def start_request():
+        g.request_costs = dict.fromkeys(COSTS, 0)
+        g.request_costs_start = time.perf_counter()
+
+    def finish_request(self, response):
+        costs = g.get('request_costs')
+        if costs is None:
+            return response
+
+        entry = {
+            'method': request.method,
+            'path': request.path,
+            'route': str(request.url_rule) if request.url_rule else None,
+            'user': g.get('user'),
+            'status': response.status_code
+        }
+        start = g.request_costs_start
+
+        # The body of a streamed response is read after the request has finished, so its costs are logged on close
+        if response.is_streamed:
+            if self.log:
+                response.call_on_close(lambda: log_request_costs(entry, costs, start))
+            return response
+
+        if self.header:
+            response.headers['X-Backend-Cost'] = ', '.join(f"{name.replace('_', '-')}={costs[name]}" for name in COSTS)
+        if self.log:
+            log_request_costs(entry, costs, start)
+
+        return response
+
+
+def log_request_costs(entry, costs, start):
+    logging.info(json.dumps({'request_costs': {
+        **entry, **costs, 'duration_ms': round((time.perf_counter() - start) * 1000, 3)}}))
+
+
+def record_costs(**costs):
+    """Adds backend costs to the counts of the current request, if costs are counted"""
+
+    if not has_app_context():
+        return
+
+    request_costs = g.get('request_costs')
+    if request_costs is None:
+        return
+
+    for name, value in costs.items():
+        request_costs[name] += value
+
+
+def track_query(results, kind, filters, unit='reads', rpcs=1, min_reads=0, **details):
+    """Yields the results of a query, counting their costs and logging the query when it exceeds the slow query
+    threshold
+
+    :param results: The results of the query
+    :type results: iterable
+    :param kind: Database kind of entity
+    :type kind: str
+    :param filters: List of query filters
+    :type filters: list
+    :param unit: The cost of a result, 'reads' for entities or 'index_entries' for keys and projections
+    :type unit: str
+    :param rpcs: The number of RPCs, or a function returning it after all results are read
+    :type rpcs: int | function
+    :param min_reads: The minimum number of reads charged for the query
+    :type min_reads: int
+    :param details: Details of the query to log, such as its ordering
+    :type details: dict
+    """
+
+    start = time.perf_counter()
+    count = 0
+
+    try:
+        for result in results:
+            count += 1
+            yield result
+    finally:
+        record_costs(**{unit: count}, rpcs=rpcs() if callable(rpcs) else rpcs)
+        if unit == 'reads' and count < min_reads:
+            record_costs(reads=min_reads - count)
+
+        log_slow_query(kind, filters, count, time.perf_counter() - start, details)
+
+
+def log_slow_query(kind, filters, result_count, duration, details=None):
+    """Logs a query taking longer than the slow query threshold, with its compiled filters but not their values"""
+
+    cost_accounting = current_app.extensions.get('cost_accounting') if has_app_context() else None
+    if cost_accounting is None or cost_accounting.slow_query_ms is None or \
+            duration * 1000 < cost_accounting.slow_query_ms:
+        return
+
+    args = request.args.to_dict() if has_request_context() else {}
+    logging.warning(json.dumps({'slow_query': {
+        'kind': kind,
+        'filters': [{key: filter[key] for key in ['name', 'field', 'comparison']} for filter in filters or []
+                    if filter['name'] == '_FORCED_FILTER' or filter['name'] in args],
+        'changed_since': 'changed_since' in args,
+        **(details or {}),
+        'results': result_count,
+        'duration_ms': round(duration * 1000, 3),
+        'path': request.path if has_request_context() else None
+    }}, default=str))
@@ -0,0 +1,189 @@
+import base64
+import config
+import hashlib
+import hmac
+import json
+import re
+import struct
+import time
+
+from collections import namedtuple
+from datetime import datetime, timezone
+from flask import g, request
+from openapi_server.request_coalescing import get_forced_filter_values
+
+CURSOR_VERSION = 1
+MAC_SIZE = 16
+FINGERPRINT_SIZE = 8
+HEADER = struct.Struct('>BI8s')
+PAGE_PARAMETERS = ['page_cursor', 'page_size', 'page_action']
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# The key of a Datastore entity within a position, as the flat path of kinds and identifiers
+CursorKey = namedtuple('CursorKey', ['flat_path'])
+
+
+def get_settings():
+    return config.CURSORS if hasattr(config, 'CURSORS') else {}
+
+
+def get_signing_keys():
+    return [key for key in get_settings().get('signing_keys', []) if key]
+
+
+def is_signed():
+    """Returns if cursors are signed, which makes encrypting them with KMS unnecessary"""
+    return bool(get_signing_keys())
+
+
+def get_fingerprint():
+    """Returns the fingerprint of the route, query filters and forced filter values of the current request
+
+    The initial request of a list and the requests for its pages share a fingerprint, the page parameters are left out.
+    """
+
+    route = re.sub(r'<.*?>', '', str(request.url_rule)).strip('/')
+    route = route[:-len('/pages')] if route.endswith('/pages') else route
+    args = sorted((key, value) for key, value in request.args.items(multi=True) if key not in PAGE_PARAMETERS)
+
+    identity = json.dumps([route, g.db_table_name, args, get_forced_filter_values()], default=str)
+    return hashlib.sha256(identity.encode()).digest()[:FINGERPRINT_SIZE]
+
+
+def encode_cursor(position):
+    """Returns a compact cursor for a position within the ordering of a query
+
+    The cursor contains the position, the fingerprint of the request and an expiry, signed with the first of the
+    configured signing keys. Sort values that can not be packed, like maps or integers beyond 64 bits, are left out,
+    the database then reads them from the entity at the position instead.
+
+    :param position: The sort values of an entity, the last value being its key
+    :type position: list
+
+    :rtype: str
+    """
+
+    expires = int(time.time()) + get_settings().get('ttl', 86400)
+    try:
+        values = pack_values(position)
+    except (TypeError, OverflowError, struct.error):
+        values = pack_values(position[-1:])
+
+    payload = HEADER.pack(CURSOR_VERSION, expires, get_fingerprint()) + values
+
+    signing_keys = get_signing_keys()
+    if signing_keys:
+        payload += create_mac(signing_keys[0], payload)
+
+    return base64.urlsafe_b64encode(payload).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor):
+    """Returns the position within a cursor, after validating its signature, fingerprint and expiry
+
+    :param cursor: The cursor
+    :type cursor: str | bytes | None
+
+    :rtype: list | None
+    """
+
+    if not cursor:
+        return None
+
+    try:
+        cursor = cursor if isinstance(cursor, bytes) else cursor.encode()
+        payload = base64.urlsafe_b64decode(cursor + b'=' * (-len(cursor) % 4))
+    except (ValueError, TypeError):
+        raise ValueError("Cursor is not valid")
+
+    signing_keys = get_signing_keys()
+    if signing_keys:
+        payload, mac = payload[:-MAC_SIZE], payload[-MAC_SIZE:]
+        if not any(hmac.compare_digest(create_mac(key, payload), mac) for key in signing_keys):
+            raise ValueError("Cursor is not valid")
+
+    try:
+        version, expires, fingerprint = HEADER.unpack_from(payload)
+        position = unpack_values(payload, HEADER.size)
+    except (struct.error, IndexError, UnicodeDecodeError):
+        raise ValueError("Cursor is not valid")
+
+    if version != CURSOR_VERSION or not hmac.compare_digest(fingerprint, get_fingerprint()):
+        raise ValueError("Cursor is not valid")
+
+    if expires < time.time():
+        raise ValueError("Cursor is expired")
+
+    return position
+
+
+def create_mac(key, payload):
+    return hmac.new(key.encode(), payload, hashlib.sha256).digest()[:MAC_SIZE]
+
+
+def pack_values(values):
+    """Packs a list of values with a type tag for each value"""
+
+    packed = [struct.pack('>B', len(values))]
+    for value in values:
+        if value is None:
+            packed.append(b'N')
+        elif isinstance(value, bool):
+            packed.append(b'T' if value else b'F')
+        elif isinstance(value, int):
+            packed.append(b'i' + struct.pack('>q', value))
+        elif isinstance(value, float):
+            packed.append(b'd' + struct.pack('>d', value))
+        elif isinstance(value, str):
+            data = value.encode()
+            packed.append(b's' + struct.pack('>H', len(data)) + data)
+        elif isinstance(value, bytes):
+            packed.append(b'b' + struct.pack('>H', len(value)) + value)
+        elif isinstance(value, datetime):
+            value = value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+            packed.append(b't' + struct.pack('>q', (value - EPOCH) // (datetime.resolution)))
+        elif hasattr(value, 'flat_path'):
+            packed.append(b'k' + pack_values(list(value.flat_path)))
+        else:
+            raise TypeError(f"Value of type '{type(value).__name__}' can not be part of a cursor")
+
+    return b''.join(packed)
+
+
+def unpack_values(payload, offset):
+    values, _ = unpack_values_from(payload, offset)
+    return values
+
+
+def unpack_values_from(payload, offset):
+    """Returns the values packed from an offset within a payload, and the offset after them"""
+
+    count, = struct.unpack_from('>B', payload, offset)
+    offset += 1
+
+    values = []
+    for _ in range(count):
+        tag = payload[offset:offset + 1]
+        offset += 1
+
+        if tag in [b'N', b'T', b'F']:
+            values.append({b'N': None, b'T': True, b'F': False}[tag])
+        elif tag in [b'i', b't']:
+            value, = struct.unpack_from('>q', payload, offset)
+            values.append(value if tag == b'i' else EPOCH + value * datetime.resolution)
+            offset += 8
+        elif tag == b'd':
+            values.append(struct.unpack_from('>d', payload, offset)[0])
+            offset += 8
+        elif tag in [b's', b'b']:
+            size, = struct.unpack_from('>H', payload, offset)
+            data = payload[offset + 2:offset + 2 + size]
+            values.append(data.decode() if tag == b's' else data)
+            offset += 2 + size
+        elif tag == b'k':
+            path, offset = unpack_values_from(payload, offset)
+            values.append(CursorKey(tuple(path)))
+        else:
+            raise struct.error("Unknown tag")
+
+    return values, offset
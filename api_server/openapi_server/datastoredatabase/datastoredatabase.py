@@ -1,41 +1,47 @@
 import config
-import copy
 import datetime
+import functools
+import hashlib
+import json
+import math
 
 from flask import g, request
+from google.api_core.exceptions import Conflict
 from google.cloud import datastore
-from openapi_server.abstractdatabase import DatabaseInterface, EntityParser, ForcedFilters
+from openapi_server.abstractdatabase import DatabaseInterface, EntityParser, AuditDiff, ChangePoller, ForcedFilters, \
+    create_change_event, create_entity_response, create_etag, get_active_filters, get_change_set, get_filter_value, \
+    get_inequality_field, get_value, limit_page_bytes, patch_entity, read_partitions, reduce_aggregate, \
+    run_with_retries, validate_if_match
+from openapi_server.cost_accounting import record_costs, track_query
+from openapi_server.cursors import CursorKey
+from openapi_server.entitycache import create_entity_cache
+from openapi_server.resilience import call_backend, get_call_options, get_timeout
+
+MAX_LOOKUP_KEYS = 1000
+READ_BATCH_SIZE = 1000
 
 
 class DatastoreDatabase(DatabaseInterface):
 
     def __init__(self):
         self.db_client = datastore.Client()
-
-    def process_audit_logging(self, old_data, new_data):
-        if hasattr(config, 'AUDIT_LOGS_NAME') and config.AUDIT_LOGS_NAME != "":
-            changed = {}
-            for attribute in list(set(old_data) | set(new_data)):
-                if attribute not in old_data:
-                    changed[attribute] = {"new": new_data[attribute]}
-                elif attribute not in new_data:
-                    changed[attribute] = {"old": old_data[attribute], "new": None}
-                elif old_data[attribute] != new_data[attribute]:
-                    changed[attribute] = {"old": old_data[attribute], "new": new_data[attribute]}
-
-            if changed:
-                key = self.db_client.key(config.AUDIT_LOGS_NAME)
-                entity = datastore.Entity(key=key)
-                entity.update(
-                    {
-                        "attributes_changed": changed,
-                        "table_id": new_data.key.id_or_name,
-                        "table_name": g.db_table_name,
-                        "timestamp": datetime.datetime.utcnow().isoformat(timespec="seconds") + 'Z',
-                        "user": g.user if g.user is not None else request.remote_addr,
-                    }
-                )
-                self.db_client.put(entity)
+        self.entity_cache = create_entity_cache(config.ENTITY_CACHE) if hasattr(config, 'ENTITY_CACHE') else None
+
+    def process_audit_logging(self, changes, entity_id):
+        if hasattr(config, 'AUDIT_LOGS_NAME') and config.AUDIT_LOGS_NAME != "" and changes:
+            key = self.db_client.key(config.AUDIT_LOGS_NAME)
+            entity = datastore.Entity(key=key)
+            entity.update(
+                {
+                    "attributes_changed": changes,
+                    "table_id": entity_id,
+                    "table_name": g.db_table_name,
+                    "timestamp": datetime.datetime.utcnow().isoformat(timespec="seconds") + 'Z',
+                    "user": g.user if g.user is not None else request.remote_addr,
+                }
+            )
+            call_backend('audit', lambda timeout: self.db_client.put(entity, **get_call_options(timeout)))
+            record_costs(writes=1, rpcs=1)
 
     def get_single(self, id, kind, db_keys, res_keys):
         """Returns an entity as a dict
@@ -52,15 +58,27 @@ class DatastoreDatabase(DatabaseInterface):
         :rtype: dict
         """
 
-        entity_key = self.db_client.key(kind, id)
-        entity = self.db_client.get(entity_key)
+        # The raw entity is cached, so forced filters and the response keys are applied on each request
+        cached = self.entity_cache.get(kind, id) if self.entity_cache else None
 
-        if entity is not None:
-            ForcedFilters().validate(filters=g.forced_filters, entity=entity)
+        if cached is None:
+            entity_key = self.db_client.key(kind, id)
+            entity = call_backend(
+                'datastore', lambda timeout: self.db_client.get(entity_key, **get_call_options(timeout)),
+                idempotent=True)
+            record_costs(reads=1, rpcs=1)
+            if entity is None:
+                return None
 
-            return create_response(res_keys, entity)
+            cached = (entity, get_entity_version(entity))
+            if self.entity_cache:
+                self.entity_cache.set(kind, id, *cached)
 
-        return None
+        entity, version = cached
+        ForcedFilters().validate(filters=g.forced_filters, entity=entity)
+
+        g.etag = create_etag(version)
+        return EntityParser().parse(res_keys, entity, 'get', id)
 
     def put_single(self, id, body, kind, db_keys, res_keys):
         """Updates an entity
@@ -79,20 +97,14 @@ class DatastoreDatabase(DatabaseInterface):
         :rtype: str
         """
 
-        entity_key = self.db_client.key(kind, id)
-        entity = self.db_client.get(entity_key)
+        new_entity = EntityParser().parse(db_keys, body, 'put', id)
 
-        if entity is not None:
-            ForcedFilters().validate(filters=g.forced_filters, entity=entity)
+        def update(entity):
+            changes = AuditDiff().compare(entity, new_entity)
+            entity.update(new_entity)
+            return changes
 
-            old_entity = copy.deepcopy(entity)
-            entity.update(EntityParser().parse(db_keys, body, 'put', id))
-            self.db_client.put(entity)
-
-            self.process_audit_logging(old_data=old_entity, new_data=entity)
-            return create_response(res_keys, entity)
-
-        return None
+        return self.update_entity(self.db_client.key(kind, id), res_keys, update)
 
     def post_single(self, body, kind, db_keys, res_keys):
         """Creates an entity
@@ -112,13 +124,118 @@ class DatastoreDatabase(DatabaseInterface):
         entity_key = self.db_client.key(kind)
         entity = datastore.Entity(key=entity_key)
 
-        entity.update(EntityParser().parse(db_keys, body, 'post', entity.key.id_or_name))
-        self.db_client.put(entity)
+        new_entity = EntityParser().parse(db_keys, body, 'post', entity.key.id_or_name)
+
+        entity.update({**new_entity, **get_change_stamp()})
+        call_backend('datastore', lambda timeout: self.db_client.put(entity, **get_call_options(timeout)))
+        record_costs(writes=1, rpcs=1)
+
+        g.etag = create_etag(get_entity_version(entity))
+        self.cache_entity(entity)
+
+        self.process_audit_logging(changes=AuditDiff().compare({}, new_entity), entity_id=entity.key.id_or_name)
+
+        return create_response(res_keys, entity)
+
+    def patch_single(self, id, body, kind, db_keys, res_keys):
+        """Updates the fields of an entity within a JSON merge-patch
+
+        :param id: A unique identifier
+        :type id: str | int
+        :param body: The JSON merge-patch
+        :type body: dict
+        :param kind: Database kind of entity
+        :type kind: str
+        :param db_keys: List of keys for database entity
+        :type kind: list
+        :param res_keys: List of keys for response entity
+        :type kind: list
+
+        :rtype: dict
+        """
+
+        field_paths = EntityParser().parse_patch(db_keys, body)
+
+        def update(entity):
+            changes = AuditDiff().compare_paths(entity, field_paths)
+
+            # Merge the field paths within the patch into the existing entity
+            for path, value in field_paths.items():
+                patch_entity(entity, path.split('.'), value)
+
+            return changes
+
+        return self.update_entity(self.db_client.key(kind, id), res_keys, update, bool(field_paths))
+
+    def update_entity(self, entity_key, res_keys, update, write=True):
+        """Updates an entity within a transaction
+
+        The transaction is retried with jitter when the entity is changed concurrently, unless the request contains an
+        If-Match header, which is checked against the ETag of the entity.
+
+        :param entity_key: The key of the entity to update
+        :type entity_key: google.cloud.datastore.Key
+        :param res_keys: List of keys for response entity
+        :type res_keys: list
+        :param update: Function updating the existing entity and returning the audit changes
+        :type update: function
+        :param write: If the entity has to be written
+        :type write: bool
+
+        :rtype: dict | None
+        """
+
+        def update_in_transaction(timeout):
+            # A transaction begins, looks up the entity and commits, the write is sent with the commit. The
+            # transaction is begun and committed explicitly, as a with statement can not pass a timeout.
+            record_costs(rpcs=3)
+            transaction = self.db_client.transaction()
+            transaction.begin(**get_call_options(timeout))
+            try:
+                result = read_and_update(transaction, timeout)
+            except Exception:
+                transaction.rollback(**get_call_options(timeout))
+                raise
+
+            transaction.commit(**get_call_options(timeout))
+            return result
+
+        def read_and_update(transaction, timeout):
+            entity = self.db_client.get(entity_key, transaction=transaction, **get_call_options(timeout))
+            record_costs(reads=1)
+            if entity is None:
+                return None, None
+
+            validate_if_match(create_etag(get_entity_version(entity)))
+            ForcedFilters().validate(filters=g.forced_filters, entity=entity)
+
+            if not write:
+                return entity, {}
+
+            changes = update(entity)
+            entity.update(get_change_stamp())
+            transaction.put(entity)
+            record_costs(writes=1)
+
+            return entity, changes
+
+        entity, changes = run_with_retries(
+            lambda: call_backend('datastore', update_in_transaction), (Conflict,),
+            **getattr(config, 'UPDATE_RETRIES', {}))
+        if entity is None:
+            return None
 
-        self.process_audit_logging(old_data={}, new_data=entity)
+        g.etag = create_etag(get_entity_version(entity))
+        self.cache_entity(entity)
 
+        self.process_audit_logging(changes=changes, entity_id=entity.key.id_or_name)
         return create_response(res_keys, entity)
 
+    def cache_entity(self, entity):
+        """Writes an entity through to the entity cache"""
+        if self.entity_cache:
+            self.entity_cache.set(entity.key.kind, entity.key.id_or_name, entity, get_entity_version(entity))
+
     def get_multiple(self, kind, db_keys, res_keys, filters):
         """Returns all entities as a list of dicts
 
@@ -134,15 +251,25 @@ class DatastoreDatabase(DatabaseInterface):
         :rtype: array
         """
 
-        query = self.create_db_query(kind, filters)
-        entities = list(query.fetch())
+        change_set = get_change_set()
+        query = self.create_db_query(kind, filters, change_set)
 
-        if entities:
-            return create_response(res_keys, entities)
+        # Each batch is parsed before the next one is read, so the entities are not held next to the whole response
+        response = {}
+        found = False
+        for entities in fetch_batches(query, kind, filters, min_reads=1):
+            found = found or bool(entities)
+            for key, values in create_response(
+                    res_keys, list(self.filter_changes(change_set, entities)) if change_set else entities).items():
+                response.setdefault(key, []).extend(values)
 
-        return None
+        if change_set:
+            return change_set.annotate(response)
 
-    def get_multiple_page(self, kind, db_keys, res_keys, filters, page_cursor, page_size, page_action):
+        return response if found else None
+
+    def get_multiple_page(self, kind, db_keys, res_keys, filters, page_cursor, page_size, page_action,
+                          max_bytes=None):
         """Returns all entities
 
         :param kind: Database kind of entity
@@ -153,12 +280,14 @@ class DatastoreDatabase(DatabaseInterface):
         :type kind: list
         :param filters: List of query filters
         :type kind: list
-        :param page_cursor: The cursor for retrieve a specific page
-        :type page_cursor: str
+        :param page_cursor: The position within the ordering to retrieve a specific page from
+        :type page_cursor: list
         :param page_size: The numbers of items within a page
         :type page_size: int
         :param page_action: Selector to get next or previous page based on the cursor
         :type page_action: str
+        :param max_bytes: The maximum size of the entities within the page
+        :type max_bytes: int | None
 
         :rtype: dict
         """
@@ -166,111 +295,350 @@ class DatastoreDatabase(DatabaseInterface):
         if 'results' not in res_keys or len(res_keys['results']) <= 0:
             raise ValueError("Key 'results' is not within response schema")
 
-        query_params = {
-            'limit': page_size
-        }
-
-        if page_cursor:
-            query_params['start_cursor'] = page_cursor
-
-        query = self.create_db_query(kind, filters)
-
-        # When the previous page is requested and the latest cursor from the original query is used
-        # to get results in reverse.
-        if page_action == 'prev':
-            query.order = ['__key__']
-        else:
-            query.order = ['-__key__']
+        change_set = get_change_set()
+        query = self.create_db_query(kind, filters, change_set)
 
-        query_iter = query.fetch(**query_params)  # Execute query
-        current_page = next(query_iter.pages)  # Setting current iterator page
-        db_data = list(current_page)  # Set page results list
+        # Cursors need a total order: the inequality field, which has to be ordered first, and the key. Without an
+        # inequality field the entities are ordered by descending key.
+        inequality_field = get_inequality_field(filters, change_set)
+        reverse = bool(page_cursor) and page_action == 'prev'
+        ascending = bool(inequality_field) != reverse
 
-        response = {
-            'results': res_keys['results']
-        }
+        order = [inequality_field, '__key__'] if inequality_field else ['__key__']
+        query.order = order if ascending else [f"-{field}" for field in order]
 
-        # Return results
-        if db_data:
-            response = create_response(response, db_data)
+        # The cursor holds the values of the ordering, so the entity it points to does not have to be read, unless its
+        # inequality field value could not be packed
+        cursor_position = None
+        if page_cursor:
+            cursor_key = self.get_cursor_key(page_cursor, kind, 2 if inequality_field else 1)
 
-            if page_action == 'prev':
-                if g.db_table_id:
-                    response['results'] = sorted(
-                        response['results'], key=lambda i: i[g.db_table_id], reverse=True)
-                next_cursor = page_cursor  # Grab current cursor for next page
+            if inequality_field:
+                cursor_value = page_cursor[0] if len(page_cursor) == 2 else self.get_cursor_value(
+                    cursor_key, inequality_field)
+                cursor_position = (cursor_value, get_key_position(cursor_key))
+                query.add_filter(inequality_field, '>=' if ascending else '<=', cursor_value)
             else:
-                next_cursor = query_iter.next_page_token.decode() if \
-                    query_iter.next_page_token else None  # Grab new cursor for next page
+                query.add_filter('__key__', '>' if ascending else '<', cursor_key)
+
+        # One entity more than the page size is read to know if there is a page beyond this page. Entities skipped
+        # next to the cursor are read as well.
+        def read_page(timeout):
+            iterator = query.fetch(limit=None if cursor_position else page_size + 1, **get_call_options(timeout))
+            results = track_query(
+                iterator, kind, filters, rpcs=lambda: iterator.page_number, min_reads=1,
+                inequality_field=inequality_field, page_size=page_size, page_action=page_action)
+
+            page = []
+            for entity in results:
+                # Entities with the same inequality field value as the cursor can be on either side of it
+                if cursor_position:
+                    position = (get_value(entity, inequality_field), get_key_position(entity.key))
+                    if (position <= cursor_position) if ascending else (position >= cursor_position):
+                        continue
+
+                page.append(entity)
+                if len(page) > page_size:
+                    break
+
+            results.close()
+            return page
+
+        entities = call_backend('datastore', read_page, idempotent=True)
+
+        has_more = len(entities) > page_size
+        entities = entities[:page_size]
+
+        if reverse:
+            entities.reverse()
+            has_prev, has_next = has_more, True
         else:
-            response['results'] = []
-            next_cursor = None
+            has_prev, has_next = bool(page_cursor), has_more
+
+        # A page is cut short when its entities exceed the byte budget, the rest of them are on the adjacent page
+        if max_bytes:
+            entities, cut = limit_page_bytes(entities, entities, max_bytes, reverse)
+            has_prev, has_next = has_prev or (cut and reverse), has_next or (cut and not reverse)
+
+        response = create_response(
+            {'results': res_keys['results']}, self.filter_changes(change_set, entities) if change_set else entities)
 
         # Create response object
         response['status'] = 'success'
         response['page_size'] = page_size
-        response['next_page'] = next_cursor
+        response['next_page'] = get_position(entities[-1], inequality_field) if entities and has_next else None
+        response['prev_page'] = get_position(entities[0], inequality_field) if entities and has_prev else None
+
+        return change_set.annotate(response) if change_set else response
+
+    def get_cursor_key(self, position, kind, length):
+        """Returns the key of the entity at a position, which is the last value of the position"""
+
+        if len(position) not in [1, length] or not isinstance(position[-1], CursorKey):
+            raise ValueError("Cursor is not valid")
+
+        try:
+            key = self.db_client.key(*position[-1].flat_path)
+        except ValueError:
+            raise ValueError("Cursor is not valid")
+
+        if key.kind != kind:
+            raise ValueError("Cursor is not valid")
 
-        return response
+        return key
 
-    def create_db_query(self, kind, filters):
+    def get_cursor_value(self, key, inequality_field):
+        """Returns the inequality field value of the entity a cursor without this value points to"""
+
+        entity = call_backend(
+            'datastore', lambda timeout: self.db_client.get(key, **get_call_options(timeout)), idempotent=True)
+        record_costs(reads=1, rpcs=1)
+        if entity is None:
+            raise ValueError("Cursor is not valid")
+
+        return get_value(entity, inequality_field)
+
+    def get_multiple_partitioned(self, kind, db_keys, res_keys, filters, partition_count, max_workers, ordered):
+        """Returns the entities as pages of dicts, looking up key ranges of the query concurrently
+
+        :param kind: Database kind of entity
+        :type kind: str
+        :param db_keys: List of keys for database entity
+        :type kind: list
+        :param res_keys: List of keys for response entity
+        :type kind: list
+        :param filters: List of query filters
+        :type kind: list
+        :param partition_count: The desired number of partitions
+        :type partition_count: int
+        :param max_workers: The maximum number of partitions read at the same time
+        :type max_workers: int
+        :param ordered: Return the entities in key order
+        :type ordered: bool
+
+        :rtype: iterator
+        """
+
+        # A keys-only query applies all filters, after which the key ranges are looked up in parallel
+        query = self.create_db_query(kind, filters)
+        query.keys_only()
+
+        # A keys-only query reads index entries
+        keys = [entity.key for entity in call_backend('datastore', lambda timeout: fetch_all(
+            query, kind, filters, timeout, unit='index_entries'), idempotent=True)]
+
+        partition_size = min(max(math.ceil(len(keys) / partition_count), 1), MAX_LOOKUP_KEYS)
+        partitions = [keys[i:i + partition_size] for i in range(0, len(keys), partition_size)]
+
+        # The worker threads have no request context, so the timeout of the lookups is determined beforehand. Each
+        # partition is a single lookup, which is counted once it is returned.
+        timeout = get_timeout('datastore')
+        chunks = read_partitions(
+            partitions, lambda partition: [self.lookup_entities(partition, timeout)], max_workers, ordered)
+
+        def iterate_pages():
+            for entities in chunks:
+                record_costs(reads=len(entities), rpcs=1)
+                yield create_response(res_keys, entities).get('results', [])
+
+        return iterate_pages()
+
+    def lookup_entities(self, keys, timeout=None):
+        """Returns the entities for a list of keys, in the order of the keys"""
+        entities = {entity.key: entity for entity in self.db_client.get_multi(keys, **get_call_options(timeout))}
+
+        return [entities[key] for key in keys if key in entities]
+
+    def get_aggregate(self, kind, filters, aggregate, field, group_by):
+        """Returns the count, sum or average of the entities matching the filters
+
+        :param kind: Database kind of entity
+        :type kind: str
+        :param filters: List of query filters
+        :type filters: list
+        :param aggregate: The aggregation: 'count', 'sum' or 'avg'
+        :type aggregate: str
+        :param field: The field to sum or average
+        :type field: str | None
+        :param group_by: The field to group the entities by
+        :type group_by: str | None
+
+        :rtype: int | float | list | None
+        """
+
+        query = self.create_db_query(kind, filters)
+
+        if aggregate == 'count' and not group_by:
+            # Aggregation queries are available in newer client versions and run entirely on the server
+            if hasattr(self.db_client, 'aggregation_query'):
+                aggregation_query = self.db_client.aggregation_query(query).count()
+                value = call_backend('datastore', lambda timeout: list(
+                    aggregation_query.fetch(**get_call_options(timeout)))[0][0].value, idempotent=True)
+
+                # A count is charged a read per batch of up to 1000 index entries
+                record_costs(index_entries=value, reads=max(math.ceil(value / 1000), 1), rpcs=1)
+                return value
+
+            query.keys_only()
+            return len(call_backend('datastore', lambda timeout: fetch_all(
+                query, kind, filters, timeout, unit='index_entries'), idempotent=True))
+
+        # Projections skip entities without an indexed value, which only matters for counts, and can not contain
+        # properties with an equality filter
+        fields = [name for name in [field, group_by] if name]
+        equality_fields = [
+            filter['field'] for filter in get_active_filters(filters) if filter['comparison'] in ['=', '==']]
+
+        if aggregate != 'count' and not set(fields) & set(equality_fields):
+            query.projection = fields
+
+        # Projections are read from the index
+        entities = call_backend('datastore', lambda timeout: fetch_all(
+            query, kind, filters, timeout, unit='index_entries' if query.projection else 'reads'), idempotent=True)
+
+        rows = [(get_value(entity, field) if field else 1, get_value(entity, group_by) if group_by else None)
+                for entity in entities]
+        return reduce_aggregate(rows, aggregate, group_by)
+
+    def watch_changes(self, kind, filters, publish):
+        """Starts polling for the changes of the entities matching the requested filters, by their change timestamp
+
+        Forced filters are left out of the poller, as it is shared by all subscribers, and applied per subscriber.
+
+        :param kind: Database kind of entity
+        :type kind: str
+        :param filters: List of query filters
+        :type filters: list
+        :param publish: Function publishing a list of change events
+        :type publish: function
+
+        :return: Function stopping the poller
+        :rtype: function
+        """
+
+        settings = g.changes
+
+        # The filters are compiled within the request, the poller runs outside of it
+        query_filters = list(self.create_db_query(
+            kind, [filter for filter in filters or [] if filter['name'] != '_FORCED_FILTER']).filters)
+        timeout = get_timeout('datastore')
+
+        def poll(changed_since):
+            query = self.db_client.query(kind=kind, filters=query_filters + [(settings['field'], '>=', changed_since)])
+            return [create_change_event(
+                entity.key.id_or_name, entity, get_value(entity, settings['field']),
+                bool(settings.get('tombstone_field') and get_value(entity, settings['tombstone_field'])))
+                for entity in query.fetch(**get_call_options(timeout))]
+
+        return ChangePoller(poll, publish, getattr(config, 'CHANGE_FEED', {}).get('poll_interval', 2)).stop
+
+    def filter_changes(self, change_set, entities):
+        """Returns the entities filtered on a change set"""
+        return list(change_set.filter(
+            entities, lambda entity: entity.key.id_or_name, lambda entity: get_value(entity, change_set.field),
+            lambda entity: get_value(entity, change_set.tombstone_field)))
+
+    def create_db_query(self, kind, filters, change_set=None):
         query = self.db_client.query(kind=kind)
 
         if filters:
             args = request.args.to_dict()
 
             for filter in filters:
-                if filter['name'] == '_FORCED_FILTER':
-                    if filter['value'] == "_UPN":
-                        filter_value = g.user
-                    elif filter['value'] == "_IP":
-                        filter_value = g.ip
-                    else:
-                        filter_value = filter['value']
-
-                    query = query.add_filter(filter['field'], filter['comparison'], filter_value)
-                elif filter['name'] in args:
-                    filter_datatype = filter['schema']['format'] if \
-                        filter['schema'].get('format') else filter['schema']['type']
-                    filter_value = data_type_validator(args[filter['name']], filter_datatype)
-
-                    if not filter_value:
-                        raise ValueError(
-                            f"Value '{args[filter['name']]}' for query param '{filter['name']}' is "
-                            f"not of type '{filter_datatype}'")
-
-                    query = query.add_filter(filter['field'], filter['comparison'], filter_value)
+                if filter['name'] == '_FORCED_FILTER' or filter['name'] in args:
+                    query = query.add_filter(
+                        filter['field'], get_operator(filter['comparison']), get_filter_value(filter, args))
+
+        # Changes within the same tick as the watermark are read again, the change set skips those already read
+        if change_set and change_set.changed_since:
+            query = query.add_filter(change_set.field, '>=', change_set.changed_since)
 
         return query
 
 
-def data_type_validator(value, type):
-    try:
-        if not type:
-            return value
-        if type == 'integer' or type == 'number':
-            value = int(value)
-        if type == 'boolean':
-            value = bool(value)
-        if type == 'date-time':
-            value = datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
-        if type == 'date':
-            value = datetime.strptime(value, "%Y-%m-%d")
-    except Exception:
-        pass
-        return None
-    else:
-        return value
+def fetch_all(query, kind, filters, timeout, **details):
+    """Returns all results of a query, counting a RPC for each batch of results
 
+    :param query: The query
+    :type query: google.cloud.datastore.query.Query
+    :param kind: Database kind of entity
+    :type kind: str
+    :param filters: List of query filters
+    :type filters: list
+    :param timeout: The timeout in seconds of each batch, or None
+    :type timeout: float | None
+    :param details: The unit and minimum reads of the query's costs
+    :type details: dict
 
-def create_response(keys, data):
-    if type(data) == list:
-        return_object = {}
-        for key in keys:
-            if type(keys[key]) == dict:
-                return_object[key] = [
-                    EntityParser().parse(keys[key], entity, 'get', entity.key.id_or_name) for entity in data]
+    :rtype: list
+    """
+
+    iterator = query.fetch(**get_call_options(timeout))
+    return list(track_query(iterator, kind, filters, rpcs=lambda: iterator.page_number, **details))
+
+
+def fetch_batches(query, kind, filters, **details):
+    """Yields the results of a query in batches, each read by a backend call of its own
+
+    A batch gets its own timeout and is retried by itself, continuing from the cursor of the previous batch.
+
+    :param query: The query
+    :type query: google.cloud.datastore.query.Query
+    :param kind: Database kind of entity
+    :type kind: str
+    :param filters: List of query filters
+    :type filters: list
+    :param details: The unit and minimum reads of the query's costs
+    :type details: dict
+
+    :rtype: generator
+    """
 
-        return return_object
+    def fetch_batch(cursor, timeout):
+        iterator = query.fetch(limit=READ_BATCH_SIZE, start_cursor=cursor, **get_call_options(timeout))
+        results = list(track_query(iterator, kind, filters, rpcs=lambda: iterator.page_number, **details))
+        return results, iterator.next_page_token
 
-    return EntityParser().parse(keys, data, 'get', data.key.id_or_name)
+    cursor = None
+    while True:
+        entities, cursor = call_backend('datastore', functools.partial(fetch_batch, cursor), idempotent=True)
+        yield entities
+
+        if len(entities) < READ_BATCH_SIZE or cursor is None:
+            return
+
+
+def get_operator(comparison):
+    """Returns the Datastore operator of a comparison, Datastore uses '=' for equality"""
+    return '=' if comparison == '==' else comparison
+
+
+def get_position(entity, inequality_field):
+    """Returns the position of an entity within the ordering of a page query"""
+
+    return [get_value(entity, inequality_field), entity.key] if inequality_field else [entity.key]
+
+
+def get_key_position(key):
+    """Returns the position of a key within the key order, which orders numeric ids before names"""
+    path = key.flat_path
+    return tuple(
+        (path[index], (0, path[index + 1]) if isinstance(path[index + 1], int) else (1, path[index + 1]))
+        for index in range(0, len(path), 2))
+
+
+def get_entity_version(entity):
+    """Returns the version of an entity based on its content, Datastore does not expose entity versions"""
+    return hashlib.sha1(json.dumps(entity, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_change_stamp():
+    """Returns the change timestamp to write when any path of the table tracks changes"""
+    if not g.get('change_stamp'):
+        return {}
+
+    return {g.change_stamp['field']: datetime.datetime.now(datetime.timezone.utc)}
+
+
+def create_response(keys, data):
+    return create_entity_response(keys, data, lambda entity: entity.key.id_or_name)
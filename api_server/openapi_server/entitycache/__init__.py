@@ -0,0 +1,3 @@
+from .entitycache import EntityCache, LocalEntityCache, RedisEntityCache, create_entity_cache
+
+__all__ = ['EntityCache', 'LocalEntityCache', 'RedisEntityCache', 'create_entity_cache']
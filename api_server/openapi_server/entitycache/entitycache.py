@@ -0,0 +1,177 @@
+import json
+import logging
+import time
+
+from abc import ABC, abstractmethod
+from datetime import datetime
+from openapi_server.encoder import JSONEncoder
+from openapi_server.lru_cache import LRUCache
+
+
+class EntityJSONEncoder(JSONEncoder):
+    """Encodes cached entities like responses, except for timestamps which are read back as timestamps"""
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return {'__datetime__': o.isoformat()}
+
+        return super().default(o)
+
+
+def decode_entity_value(value):
+    if set(value) == {'__datetime__'}:
+        return datetime.fromisoformat(value['__datetime__'])
+
+    return value
+
+
+class EntityCache(ABC):
+
+    def __init__(self, ttl, kinds=None):
+        self.ttl = ttl
+        self.kinds = kinds
+
+    def is_cached_kind(self, kind):
+        return self.kinds is None or kind in self.kinds
+
+    def get_key(self, kind, id):
+        """Returns the key of an entity, identifiers from a path are strings while those of entities can be numbers"""
+        return kind, str(id)
+
+    @abstractmethod
+    def get(self, kind, id):
+        pass
+
+    @abstractmethod
+    def set(self, kind, id, entity, version):
+        pass
+
+    @abstractmethod
+    def delete(self, kind, id):
+        pass
+
+
+class LocalEntityCache(EntityCache):
+    """Caches entities within the memory of the instance
+
+    Writes only update the cache of the instance handling them, other instances keep their cached version until the
+    ttl expires. Only the Redis cache is coherent between instances.
+    """
+
+    def __init__(self, max_size=10000, ttl=60, kinds=None):
+        super().__init__(ttl, kinds)
+        self.cache = LRUCache(max_size)
+
+    def get(self, kind, id):
+        """Returns the raw entity and its version
+
+        :param kind: Database kind of entity
+        :type kind: str
+        :param id: A unique identifier
+        :type id: str | int
+
+        :rtype: tuple | None
+        """
+
+        return self.cache.get(self.get_key(kind, id)) if self.is_cached_kind(kind) else None
+
+    def set(self, kind, id, entity, version):
+        """Caches the raw entity and its version
+
+        :param kind: Database kind of entity
+        :type kind: str
+        :param id: A unique identifier
+        :type id: str | int
+        :param entity: The raw entity
+        :type entity: dict
+        :param version: The version of the entity
+        :type version: str
+        """
+
+        if self.is_cached_kind(kind):
+            self.cache.set(self.get_key(kind, id), (entity, version), time.time() + self.ttl)
+
+    def delete(self, kind, id):
+        self.cache.delete(self.get_key(kind, id))
+
+
+class RedisEntityCache(EntityCache):
+    """Caches entities within a server speaking the Redis protocol, shared by all instances
+
+    The entities are stored as JSON, so the cache server can not make the API run code. The cache is an optimization,
+    so a failing server and entities that can not be stored as JSON are logged and handled as a cache miss.
+    """
+
+    def __init__(self, url, ttl=60, kinds=None, prefix='entities'):
+        import redis
+
+        super().__init__(ttl, kinds)
+        self.client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        self.prefix = prefix
+
+    def get_key(self, kind, id):
+        return f"{self.prefix}:{kind}:{str(id)}"
+
+    def get(self, kind, id):
+        """Returns the raw entity and its version
+
+        :param kind: Database kind of entity
+        :type kind: str
+        :param id: A unique identifier
+        :type id: str | int
+
+        :rtype: tuple | None
+        """
+
+        if not self.is_cached_kind(kind):
+            return None
+
+        try:
+            value = self.client.get(self.get_key(kind, id))
+            if value is None:
+                return None
+
+            entity, version = json.loads(value, object_hook=decode_entity_value)
+            return entity, version
+        except Exception as e:
+            logging.warning(f"An exception occurred when reading '{kind}:{id}' from the entity cache: {str(e)}")
+            return None
+
+    def set(self, kind, id, entity, version):
+        """Caches the raw entity and its version
+
+        :param kind: Database kind of entity
+        :type kind: str
+        :param id: A unique identifier
+        :type id: str | int
+        :param entity: The raw entity
+        :type entity: dict
+        :param version: The version of the entity
+        :type version: str
+        """
+
+        if not self.is_cached_kind(kind):
+            return
+
+        try:
+            self.client.setex(self.get_key(kind, id), self.ttl, json.dumps([entity, version], cls=EntityJSONEncoder))
+        except Exception as e:
+            logging.warning(f"An exception occurred when writing '{kind}:{id}' to the entity cache: {str(e)}")
+
+    def delete(self, kind, id):
+        try:
+            self.client.delete(self.get_key(kind, id))
+        except Exception as e:
+            logging.warning(f"An exception occurred when deleting '{kind}:{id}' from the entity cache: {str(e)}")
+
+
+def create_entity_cache(settings):
+    """Returns the entity cache for the ENTITY_CACHE settings"""
+
+    if settings.get('backend', 'local') == 'redis':
+        return RedisEntityCache(
+            settings['url'], ttl=settings.get('ttl', 60), kinds=settings.get('kinds'),
+            prefix=settings.get('prefix', 'entities'))
+
+    return LocalEntityCache(
+        max_size=settings.get('max_size', 10000), ttl=settings.get('ttl', 60), kinds=settings.get('kinds'))
@@ -0,0 +1,3 @@
+from .exportstore import ExportStore, LocalExportStore, CloudStorageExportStore
+
+__all__ = ['ExportStore', 'LocalExportStore', 'CloudStorageExportStore']
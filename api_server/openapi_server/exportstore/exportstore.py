@@ -0,0 +1,208 @@
+import datetime
+import json
+import os
+
+from abc import ABC, abstractmethod
+
+
+class ExportStore(ABC):
+
+    @abstractmethod
+    def save_status(self, export_id, status):
+        pass
+
+    @abstractmethod
+    def get_status(self, export_id):
+        pass
+
+    @abstractmethod
+    def save_file(self, export_id, content, content_type):
+        pass
+
+    @abstractmethod
+    def open_file(self, export_id, content_type):
+        pass
+
+    @abstractmethod
+    def get_file(self, export_id):
+        pass
+
+    @abstractmethod
+    def get_download_url(self, export_id):
+        pass
+
+
+class LocalExportStore(ExportStore):
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def save_status(self, export_id, status):
+        """Saves the status of an export job
+
+        :param export_id: A unique identifier
+        :type export_id: str
+        :param status: The status of the export job
+        :type status: dict
+        """
+
+        temporary_path = os.path.join(self.directory, f"{export_id}.json.tmp")
+        with open(temporary_path, 'w') as status_file:
+            json.dump(status, status_file)
+
+        os.replace(temporary_path, os.path.join(self.directory, f"{export_id}.json"))
+
+    def get_status(self, export_id):
+        """Returns the status of an export job
+
+        :param export_id: A unique identifier
+        :type export_id: str
+
+        :rtype: dict | None
+        """
+
+        try:
+            with open(os.path.join(self.directory, f"{export_id}.json"), 'r') as status_file:
+                return json.load(status_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save_file(self, export_id, content, content_type):
+        """Saves the file of an export job
+
+        :param export_id: A unique identifier
+        :type export_id: str
+        :param content: The content of the file
+        :type content: bytes
+        :param content_type: The media type of the file
+        :type content_type: str
+        """
+
+        with open(os.path.join(self.directory, export_id), 'wb') as export_file:
+            export_file.write(content)
+
+    def open_file(self, export_id, content_type):
+        """Opens the file of an export job for writing it in parts
+
+        :param export_id: A unique identifier
+        :type export_id: str
+        :param content_type: The media type of the file
+        :type content_type: str
+
+        :rtype: typing.BinaryIO
+        """
+
+        return open(os.path.join(self.directory, export_id), 'wb')
+
+    def get_file(self, export_id):
+        """Returns the file of an export job
+
+        :param export_id: A unique identifier
+        :type export_id: str
+
+        :rtype: bytes | None
+        """
+
+        try:
+            with open(os.path.join(self.directory, export_id), 'rb') as export_file:
+                return export_file.read()
+        except FileNotFoundError:
+            return None
+
+    def get_download_url(self, export_id):
+        """Files within a local store are downloaded through the API"""
+        return None
+
+
+class CloudStorageExportStore(ExportStore):
+
+    def __init__(self, bucket_name, prefix='exports', url_expiration=3600):
+        from google.cloud import storage
+
+        self.bucket = storage.Client().bucket(bucket_name)
+        self.prefix = prefix.strip('/')
+        self.url_expiration = url_expiration
+
+    def save_status(self, export_id, status):
+        """Saves the status of an export job
+
+        :param export_id: A unique identifier
+        :type export_id: str
+        :param status: The status of the export job
+        :type status: dict
+        """
+
+        blob = self.bucket.blob(f"{self.prefix}/{export_id}.json")
+        blob.upload_from_string(json.dumps(status), content_type='application/json')
+
+    def get_status(self, export_id):
+        """Returns the status of an export job
+
+        :param export_id: A unique identifier
+        :type export_id: str
+
+        :rtype: dict | None
+        """
+
+        blob = self.bucket.get_blob(f"{self.prefix}/{export_id}.json")
+        if blob is None:
+            return None
+
+        return json.loads(blob.download_as_bytes())
+
+    def save_file(self, export_id, content, content_type):
+        """Saves the file of an export job
+
+        :param export_id: A unique identifier
+        :type export_id: str
+        :param content: The content of the file
+        :type content: bytes
+        :param content_type: The media type of the file
+        :type content_type: str
+        """
+
+        blob = self.bucket.blob(f"{self.prefix}/{export_id}")
+        blob.upload_from_string(content, content_type=content_type)
+
+    def open_file(self, export_id, content_type):
+        """Opens the file of an export job for writing it in parts, which are uploaded in chunks
+
+        :param export_id: A unique identifier
+        :type export_id: str
+        :param content_type: The media type of the file
+        :type content_type: str
+
+        :rtype: typing.BinaryIO
+        """
+
+        blob = self.bucket.blob(f"{self.prefix}/{export_id}")
+        return blob.open('wb', content_type=content_type)
+
+    def get_file(self, export_id):
+        """Returns the file of an export job
+
+        :param export_id: A unique identifier
+        :type export_id: str
+
+        :rtype: bytes | None
+        """
+
+        blob = self.bucket.get_blob(f"{self.prefix}/{export_id}")
+        if blob is None:
+            return None
+
+        return blob.download_as_bytes()
+
+    def get_download_url(self, export_id):
+        """Returns a signed URL to download the file of an export job
+
+        :param export_id: A unique identifier
+        :type export_id: str
+
+        :rtype: str
+        """
+
+        blob = self.bucket.blob(f"{self.prefix}/{export_id}")
+        return blob.generate_signed_url(
+            expiration=datetime.timedelta(seconds=self.url_expiration), version='v4')
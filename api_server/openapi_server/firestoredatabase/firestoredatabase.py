@@ -1,42 +1,47 @@
 import config
+import itertools
 import logging
-import types
+import math
 
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from flask import g, request
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.api_core.exceptions import FailedPrecondition, NotFound
 from google.cloud import firestore
-from openapi_server.abstractdatabase import DatabaseInterface, EntityParser, ForcedFilters
+from google.cloud.firestore_v1.field_path import FieldPath
+from openapi_server.abstractdatabase import DatabaseInterface, EntityParser, AuditDiff, ForcedFilters, \
+    PreconditionFailed, create_change_event, create_entity_response, create_etag, get_change_set, get_filter_value, \
+    get_if_match_version, get_inequality_field, has_active_filters, iterate_chunks, limit_page_bytes, read_partitions, \
+    reduce_aggregate, run_with_retries, validate_if_match
+from openapi_server.cost_accounting import record_costs, track_query
+from openapi_server.entitycache import create_entity_cache
+from openapi_server.resilience import call_backend, get_call_options, get_timeout
+
+PARTITION_CHUNK_SIZE = 500
+READ_BATCH_SIZE = 1000
+LISTENER_MARGIN = timedelta(seconds=60)
 
 
 class FirestoreDatabase(DatabaseInterface):
 
     def __init__(self):
         self.db_client = firestore.Client()
+        self.entity_cache = create_entity_cache(config.ENTITY_CACHE) if hasattr(config, 'ENTITY_CACHE') else None
 
-    def process_audit_logging(self, old_data, new_data, entity_id):
-        if hasattr(config, 'AUDIT_LOGS_NAME') and config.AUDIT_LOGS_NAME != "":
+    def process_audit_logging(self, changes, entity_id):
+        if hasattr(config, 'AUDIT_LOGS_NAME') and config.AUDIT_LOGS_NAME != "" and changes:
             try:
-                old_data = old_data.to_dict() if type(old_data) != dict else old_data
-                new_data = new_data.to_dict() if type(new_data) != dict else new_data
-
-                changed = {}
-                for attribute in list(set(old_data) | set(new_data)):
-                    if attribute not in old_data:
-                        changed[attribute] = {"new": new_data[attribute]}
-                    elif attribute not in new_data:
-                        changed[attribute] = {"old": old_data[attribute], "new": None}
-                    elif old_data[attribute] != new_data[attribute]:
-                        changed[attribute] = {"old": old_data[attribute], "new": new_data[attribute]}
-
-                if changed:
-                    doc_ref = self.db_client.collection(config.AUDIT_LOGS_NAME).document()
-                    doc_ref.set({
-                        "attributes_changed": changed,
-                        "table_id": entity_id,
-                        "table_name": g.db_table_name,
-                        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + 'Z',
-                        "user": g.user if g.user is not None else request.remote_addr
-                    })
+                doc_ref = self.db_client.collection(config.AUDIT_LOGS_NAME).document()
+                audit_log = {
+                    "attributes_changed": changes,
+                    "table_id": entity_id,
+                    "table_name": g.db_table_name,
+                    "timestamp": datetime.utcnow().isoformat(timespec="seconds") + 'Z',
+                    "user": g.user if g.user is not None else request.remote_addr
+                }
+                call_backend(
+                    'audit', lambda timeout: doc_ref.set(audit_log, **get_call_options(timeout)), idempotent=True)
+                record_costs(writes=1, rpcs=1)
             except Exception as e:
                 logging.error(f"An exception occurred when audit logging changes for entity '{entity_id}': {str(e)}")
                 pass
@@ -56,15 +61,26 @@ class FirestoreDatabase(DatabaseInterface):
         :rtype: dict
         """
 
-        doc_ref = self.db_client.collection(kind).document(id)
-        doc = doc_ref.get()
+        # The raw document is cached, so forced filters and the response keys are applied on each request
+        cached = self.entity_cache.get(kind, id) if self.entity_cache else None
 
-        if doc.exists:
-            ForcedFilters().validate(filters=g.forced_filters, entity=doc.to_dict())
+        if cached is None:
+            doc_ref = self.db_client.collection(kind).document(id)
+            doc = call_backend(
+                'firestore', lambda timeout: doc_ref.get(**get_call_options(timeout)), idempotent=True)
+            record_costs(reads=1, rpcs=1)
+            if not doc.exists:
+                return None
 
-            return create_response(res_keys, doc)
+            cached = (doc.to_dict(), get_document_version(doc))
+            if self.entity_cache:
+                self.entity_cache.set(kind, id, *cached)
 
-        return None
+        entity, version = cached
+        ForcedFilters().validate(filters=g.forced_filters, entity=entity)
+
+        g.etag = create_etag(version)
+        return EntityParser().parse(res_keys, entity, 'get', id)
 
     def put_single(self, id, body, kind, db_keys, res_keys):
         """Updates an entity
@@ -84,20 +100,10 @@ class FirestoreDatabase(DatabaseInterface):
         """
 
         doc_ref = self.db_client.collection(kind).document(id)
-        doc = doc_ref.get()
-
-        if doc.exists:
-            ForcedFilters().validate(filters=g.forced_filters, entity=doc.to_dict())
+        new_doc = EntityParser().parse(db_keys, body, 'put', id)
 
-            new_doc = EntityParser().parse(db_keys, body, 'put', id)
-            doc_ref.update(new_doc)
-
-            updated_doc = doc_ref.get()
-
-            self.process_audit_logging(old_data=doc, new_data=updated_doc, entity_id=doc_ref.id)
-            return create_response(res_keys, updated_doc)
-
-        return None
+        return self.update_document(
+            doc_ref, res_keys, new_doc, lambda old_doc: AuditDiff().compare(old_doc, new_doc))
 
     def post_single(self, body, kind, db_keys, res_keys):
         """Creates an entity
@@ -115,14 +121,133 @@ class FirestoreDatabase(DatabaseInterface):
         """
 
         doc_ref = self.db_client.collection(kind).document()
-        doc_ref.set(EntityParser().parse(db_keys, body, 'post', doc_ref.id))
+        new_doc = EntityParser().parse(db_keys, body, 'post', doc_ref.id)
+        # The document name is generated by the client, so writing it again is idempotent
+        call_backend(
+            'firestore', lambda timeout: doc_ref.set({**new_doc, **get_change_stamp()}, **get_call_options(timeout)),
+            idempotent=True)
 
-        updated_doc = doc_ref.get()
+        # The created document is read back for its update time
+        updated_doc = call_backend(
+            'firestore', lambda timeout: doc_ref.get(**get_call_options(timeout)), idempotent=True)
+        record_costs(writes=1, reads=1, rpcs=2)
+        g.etag = create_etag(get_document_version(updated_doc))
+        self.cache_document(updated_doc)
 
-        self.process_audit_logging(old_data={}, new_data=updated_doc, entity_id=doc_ref.id)
+        self.process_audit_logging(changes=AuditDiff().compare({}, new_doc), entity_id=doc_ref.id)
 
         return create_response(res_keys, updated_doc)
 
+    def patch_single(self, id, body, kind, db_keys, res_keys):
+        """Updates the fields of an entity within a JSON merge-patch
+
+        :param id: A unique identifier
+        :type id: str | int
+        :param body: The JSON merge-patch
+        :type body: dict
+        :param kind: Database kind of entity
+        :type kind: str
+        :param db_keys: List of keys for database entity
+        :type kind: list
+        :param res_keys: List of keys for response entity
+        :type kind: list
+
+        :rtype: dict
+        """
+
+        doc_ref = self.db_client.collection(kind).document(id)
+        field_paths = EntityParser().parse_patch(db_keys, body)
+
+        # Only the field paths within the patch are written
+        update_object = {
+            path: firestore.DELETE_FIELD if value is None else value for path, value in field_paths.items()}
+
+        return self.update_document(
+            doc_ref, res_keys, update_object, lambda old_doc: AuditDiff().compare_paths(old_doc, field_paths))
+
+    def update_document(self, doc_ref, res_keys, update_object, compare):
+        """Updates a document on the condition that it did not change since it was read
+
+        The update is retried with jitter when the document is changed concurrently. The ETag within an If-Match header
+        contains the update time of the version the client read, which is the precondition of the write itself. The
+        document is then only read first when the entity cache does not hold that version, while forced filters or the
+        audit log need the existing document.
+
+        :param doc_ref: The document to update
+        :type doc_ref: google.cloud.firestore.DocumentReference
+        :param res_keys: List of keys for response entity
+        :type res_keys: list
+        :param update_object: The field paths and values to update
+        :type update_object: dict
+        :param compare: Function returning the audit changes for the existing document
+        :type compare: function
+
+        :rtype: dict | None
+        """
+
+        version = get_if_match_version()
+        if_match_time = parse_document_version(version)
+        cached_doc = self.get_cached_version(doc_ref, version) if if_match_time else None
+        read_first = not update_object or if_match_time is None or (cached_doc is None and needs_existing_document())
+
+        def update():
+            if read_first:
+                doc = call_backend(
+                    'firestore', lambda timeout: doc_ref.get(**get_call_options(timeout)), idempotent=True)
+                record_costs(reads=1, rpcs=1)
+                if not doc.exists:
+                    return None
+
+                validate_if_match(create_etag(get_document_version(doc)))
+                old_doc, update_time = doc.to_dict(), doc.update_time
+            else:
+                old_doc, update_time = cached_doc or {}, if_match_time
+
+            ForcedFilters().validate(filters=g.forced_filters, entity=old_doc)
+
+            if update_object:
+                try:
+                    call_backend('firestore', lambda timeout: doc_ref.update(
+                        {**update_object, **get_change_stamp()},
+                        option=self.db_client.write_option(last_update_time=update_time),
+                        **get_call_options(timeout)))
+                except (FailedPrecondition, NotFound):
+                    if read_first:
+                        raise
+
+                    # The version of the If-Match header is no longer the current version of the document
+                    if self.entity_cache:
+                        self.entity_cache.delete(doc_ref.parent.id, doc_ref.id)
+                    raise PreconditionFailed("The entity has been changed since it was read")
+
+                record_costs(writes=1, rpcs=1)
+
+            return compare(old_doc)
+
+        changes = run_with_retries(update, (FailedPrecondition,), **getattr(config, 'UPDATE_RETRIES', {}))
+        if changes is None:
+            return None
+
+        # The updated document is read back for its update time
+        updated_doc = call_backend(
+            'firestore', lambda timeout: doc_ref.get(**get_call_options(timeout)), idempotent=True)
+        record_costs(reads=1, rpcs=1)
+        g.etag = create_etag(get_document_version(updated_doc))
+        self.cache_document(updated_doc)
+
+        self.process_audit_logging(changes=changes, entity_id=doc_ref.id)
+        return create_response(res_keys, updated_doc)
+
+    def cache_document(self, doc):
+        """Writes a document through to the entity cache"""
+        if self.entity_cache:
+            self.entity_cache.set(doc.reference.parent.id, doc.id, doc.to_dict(), get_document_version(doc))
+
+    def get_cached_version(self, doc_ref, version):
+        """Returns the cached document if the entity cache holds the version, otherwise None"""
+        cached = self.entity_cache.get(doc_ref.parent.id, doc_ref.id) if self.entity_cache else None
+        return cached[0] if cached and cached[1] == version else None
+
     def get_multiple(self, kind, db_keys, res_keys, filters):
         """Returns all entities as a list of dicts
 
@@ -138,15 +263,65 @@ class FirestoreDatabase(DatabaseInterface):
         :rtype: array
         """
 
-        docs_ref = self.create_db_query(kind, filters)
-        docs = docs_ref.stream()
+        change_set = get_change_set()
+        query = self.create_db_query(kind, filters, change_set)
 
-        if docs:
-            return create_response(res_keys, docs)
+        # Each batch is parsed before the next one is read, so the snapshots are not held next to the whole response
+        response = {}
+        for docs in self.read_batches(query, kind, filters):
+            for key, values in create_response(
+                    res_keys, list(self.filter_changes(change_set, docs)) if change_set else docs).items():
+                response.setdefault(key, []).extend(values)
 
-        return None
+        return change_set.annotate(response) if change_set else response
 
-    def get_multiple_page(self, kind, db_keys, res_keys, filters, page_cursor, page_size, page_action):
+    def read_batches(self, query, kind, filters):
+        """Yields the documents of a query in batches, each read by a backend call of its own
+
+        A batch gets its own timeout and is retried by itself, instead of a single call for the whole query.
+
+        :param query: The query
+        :type query: google.cloud.firestore_v1.query.Query
+        :param kind: Database kind of entity
+        :type kind: str
+        :param filters: List of query filters
+        :type filters: list
+
+        :rtype: generator
+        """
+
+        last_doc = None
+        while True:
+            # The client orders a query starting after a snapshot by its inequality fields and the document name
+            batch_query = query.limit(READ_BATCH_SIZE) if last_doc is None else \
+                query.start_after(last_doc).limit(READ_BATCH_SIZE)
+
+            # Each query is charged at least one read, also when no documents match
+            docs = call_backend('firestore', lambda timeout: list(track_query(
+                batch_query.stream(**get_call_options(timeout)), kind, filters, min_reads=1)), idempotent=True)
+            yield docs
+
+            if len(docs) < READ_BATCH_SIZE:
+                return
+
+            last_doc = docs[-1]
+
+    def get_cursor_position(self, kind, id, inequality_field):
+        """Returns the position of the document a cursor without its inequality field value points to"""
+
+        if not isinstance(id, str) or not id:
+            raise ValueError("Cursor is not valid")
+
+        doc = call_backend('firestore', lambda timeout: self.db_client.collection(kind).document(id).get(
+            **get_call_options(timeout)), idempotent=True)
+        record_costs(reads=1, rpcs=1)
+        if not doc.exists:
+            raise ValueError("Cursor is not valid")
+
+        return get_position(doc, inequality_field)
+
+    def get_multiple_page(self, kind, db_keys, res_keys, filters, page_cursor, page_size, page_action,
+                          max_bytes=None):
         """Returns all entities as a list of dicts
 
         :param kind: Database kind of entity
@@ -157,116 +332,268 @@ class FirestoreDatabase(DatabaseInterface):
         :type kind: list
         :param filters: List of query filters
         :type kind: list
-        :param page_cursor: The cursor for retrieve a specific page
-        :type page_cursor: str
+        :param page_cursor: The position within the ordering to retrieve a specific page from
+        :type page_cursor: list
         :param page_size: The numbers of items within a page
         :type page_size: int
         :param page_action: Selector to get next or previous page based on the cursor
         :type page_action: str
+        :param max_bytes: The maximum size of the entities within the page
+        :type max_bytes: int | None
 
         :rtype: dict
         """
 
-        docs_ref = self.create_db_query(kind, filters)
-        docs_ref = docs_ref.limit(page_size)
-
-        if page_cursor:
-            snapshot = self.db_client.collection(kind).document(page_cursor).get()
-            if snapshot:
-                docs_ref = docs_ref.end_at(snapshot) if page_action == 'prev' else docs_ref.start_after(snapshot)
-            else:
-                raise ValueError("Cursor is not valid")
-
-        docs = [{'id': doc.id, **doc.to_dict()} for doc in docs_ref.stream()]
+        change_set = get_change_set()
+        query = self.create_db_query(kind, filters, change_set)
+
+        # Cursors need a total order: the inequality field, which has to be ordered first, and the document name
+        inequality_field = get_inequality_field(filters, change_set)
+        if inequality_field:
+            query = query.order_by(inequality_field)
+        query = query.order_by(FieldPath.document_id())
+
+        # The cursor holds the values of the ordering, so the document it points to does not have to be read, unless
+        # its inequality field value could not be packed
+        if page_cursor and inequality_field and len(page_cursor) == 1:
+            page_cursor = self.get_cursor_position(kind, page_cursor[0], inequality_field)
+        if page_cursor and len(page_cursor) != (2 if inequality_field else 1):
+            raise ValueError("Cursor is not valid")
+
+        # One document more than the page size is read to know if there is a page beyond this page
+        reverse = bool(page_cursor) and page_action == 'prev'
+        details = {'inequality_field': inequality_field, 'page_size': page_size, 'page_action': page_action}
+        if reverse:
+            # The server reverses the ordering for limit_to_last, the documents are returned in the original order
+            docs = call_backend('firestore', lambda timeout: list(track_query(
+                query.end_before(page_cursor).limit_to_last(page_size + 1).get(**get_call_options(timeout)), kind,
+                filters, min_reads=1, **details)), idempotent=True)
+            has_prev, has_next = len(docs) > page_size, True
+            docs = docs[-page_size:]
+        else:
+            if page_cursor:
+                query = query.start_after(page_cursor)
 
-        response = {
-            'results': res_keys['results']
-        }
+            docs = call_backend('firestore', lambda timeout: list(track_query(
+                query.limit(page_size + 1).stream(**get_call_options(timeout)), kind, filters, min_reads=1,
+                **details)), idempotent=True)
+            has_prev, has_next = bool(page_cursor), len(docs) > page_size
+            docs = docs[:page_size]
 
-        # Return results
-        if docs:
-            response = create_response(response, docs)
+        # A page is cut short when its entities exceed the byte budget, the rest of them are on the adjacent page
+        if max_bytes:
+            docs, cut = limit_page_bytes(docs, [doc.to_dict() for doc in docs], max_bytes, reverse)
+            has_prev, has_next = has_prev or (cut and reverse), has_next or (cut and not reverse)
 
-            if page_action == 'prev':
-                if g.db_table_id:
-                    response['results'] = sorted(
-                        response['results'], key=lambda i: i[g.db_table_id], reverse=True)
-                next_cursor = page_cursor  # Grab current cursor for next page
-            else:
-                next_cursor = docs[-1]['id'] if self.check_for_next_document(docs[-1]['id'], kind) else None
-        else:
-            response['results'] = []
-            next_cursor = None
+        response = create_response(
+            {'results': res_keys['results']}, list(self.filter_changes(change_set, docs)) if change_set else docs)
 
         # Create response object
         response['status'] = 'success'
         response['page_size'] = page_size
-        response['next_page'] = next_cursor
+        response['next_page'] = get_position(docs[-1], inequality_field) if docs and has_next else None
+        response['prev_page'] = get_position(docs[0], inequality_field) if docs and has_prev else None
+
+        return change_set.annotate(response) if change_set else response
+
+    def get_multiple_partitioned(self, kind, db_keys, res_keys, filters, partition_count, max_workers, ordered):
+        """Returns the entities as pages of dicts, reading partitions of the collection concurrently
+
+        :param kind: Database kind of entity
+        :type kind: str
+        :param db_keys: List of keys for database entity
+        :type kind: list
+        :param res_keys: List of keys for response entity
+        :type kind: list
+        :param filters: List of query filters
+        :type kind: list
+        :param partition_count: The desired number of partitions
+        :type partition_count: int
+        :param max_workers: The maximum number of partitions read at the same time
+        :type max_workers: int
+        :param ordered: Return the entities in document order
+        :type ordered: bool
+
+        :rtype: iterator
+        """
+
+        # Partition queries do not support filters, fall back on a single stream
+        if has_active_filters(filters):
+            return iter([self.get_multiple(kind, db_keys, res_keys, filters).get('results', [])])
+
+        partitions = call_backend('firestore', lambda timeout: [
+            partition.query() for partition in
+            self.db_client.collection_group(kind).get_partitions(partition_count, **get_call_options(timeout))],
+            idempotent=True)
+
+        # The partitions are read in worker threads, their documents are counted as they are returned. The worker
+        # threads have no request context, so their timeout is determined beforehand.
+        options = get_call_options(get_timeout('firestore'))
+        chunks = read_partitions(
+            partitions, lambda query: iterate_chunks(query.stream(**options), PARTITION_CHUNK_SIZE), max_workers,
+            ordered)
+        docs = track_query(itertools.chain.from_iterable(chunks), kind, filters, rpcs=len(partitions) + 1)
 
-        return response
+        # A collection group also contains sub-collections with the same name
+        docs = (doc for doc in docs if doc.reference.parent.parent is None)
 
-    def check_for_next_document(self, document_id, kind):
-        snapshot = self.db_client.collection(kind).document(document_id).get()
-        docs = self.db_client.collection(kind).limit(1).start_after(snapshot).stream()
+        return (create_response(res_keys, page).get('results', [])
+                for page in iterate_chunks(docs, PARTITION_CHUNK_SIZE))
 
-        return True if len(list(docs)) > 0 else False
+    def get_aggregate(self, kind, filters, aggregate, field, group_by):
+        """Returns the count, sum or average of the entities matching the filters
 
-    def create_db_query(self, kind, filters):
+        :param kind: Database kind of entity
+        :type kind: str
+        :param filters: List of query filters
+        :type filters: list
+        :param aggregate: The aggregation: 'count', 'sum' or 'avg'
+        :type aggregate: str
+        :param field: The field to sum or average
+        :type field: str | None
+        :param group_by: The field to group the entities by
+        :type group_by: str | None
+
+        :rtype: int | float | list | None
+        """
+
+        query = self.create_db_query(kind, filters)
+
+        # Aggregation queries are available in newer client versions and run entirely on the server
+        if not group_by and hasattr(query, aggregate):
+            aggregation_query = query.count() if aggregate == 'count' else getattr(query, aggregate)(field)
+            value = call_backend(
+                'firestore', lambda timeout: aggregation_query.get(**get_call_options(timeout))[0][0].value,
+                idempotent=True)
+
+            # An aggregation is charged a read per batch of up to 1000 index entries, which are known for counts only
+            if aggregate == 'count':
+                record_costs(index_entries=value, reads=max(math.ceil(value / 1000), 1), rpcs=1)
+            else:
+                record_costs(reads=1, rpcs=1)
+
+            return value
+
+        # Only read the fields needed, a projection on the document name alone returns no data at all
+        fields = [name for name in [field, group_by] if name]
+        query = query.select(fields if fields else ['__name__'])
+        docs = call_backend('firestore', lambda timeout: list(track_query(
+            query.stream(**get_call_options(timeout)), kind, filters, min_reads=1)), idempotent=True)
+
+        rows = [(get_document_value(doc, field) if field else 1, get_document_value(doc, group_by)) for doc in docs]
+        return reduce_aggregate(rows, aggregate, group_by)
+
+    def watch_changes(self, kind, filters, publish):
+        """Starts a listener publishing the changes of the documents matching the requested filters
+
+        Forced filters are left out of the listener, as it is shared by all subscribers, and applied per subscriber.
+        The listener only queries the documents changed since it started, so its first snapshot does not read the
+        whole collection.
+
+        :param kind: Database kind of entity
+        :type kind: str
+        :param filters: List of query filters
+        :type filters: list
+        :param publish: Function publishing a list of change events
+        :type publish: function
+
+        :return: Function stopping the listener
+        :rtype: function
+        """
+
+        settings = g.changes
+        query = self.create_db_query(kind, [filter for filter in filters or [] if filter['name'] != '_FORCED_FILTER'])
+
+        # The change timestamps are written by the server, a margin keeps changes within clock skew from being missed
+        query = query.where(settings['field'], '>=', datetime.now(timezone.utc) - LISTENER_MARGIN)
+        snapshots = []
+
+        def on_snapshot(docs, changes, read_time):
+            # The first snapshot contains all current documents, subscribers catch up on those themselves
+            snapshots.append(read_time)
+            if len(snapshots) == 1:
+                return
+
+            publish([create_document_event(
+                change.document, settings, change.type.name == 'REMOVED') for change in changes])
+
+        return query.on_snapshot(on_snapshot).unsubscribe
+
+    def filter_changes(self, change_set, docs):
+        """Filters documents on a change set"""
+        return change_set.filter(
+            docs, lambda doc: doc.id, lambda doc: get_document_value(doc, change_set.field),
+            lambda doc: get_document_value(doc, change_set.tombstone_field))
+
+    def create_db_query(self, kind, filters, change_set=None):
         query = self.db_client.collection(kind)
 
         if filters:
             args = request.args.to_dict()
 
             for filter in filters:
-                if filter['name'] == '_FORCED_FILTER':
-                    if filter['value'] == "_UPN":
-                        filter_value = g.user
-                    elif filter['value'] == "_IP":
-                        filter_value = g.ip
-                    else:
-                        filter_value = filter['value']
-
-                    query = query.where(filter['field'], filter['comparison'], filter_value)
-                elif filter['name'] in args:
-                    filter_datatype = filter['schema']['format'] if \
-                        filter['schema'].get('format') else filter['schema']['type']
-                    filter_value = data_type_validator(args[filter['name']], filter_datatype)
-
-                    if not filter_value:
-                        raise ValueError(f"Value '{args[filter['name']]}' for query param "
-                                         f"'{filter['name']}' is not of type '{filter_datatype}'")
-
-                    query = query.where(filter['field'], filter['comparison'], filter_value)
+                if filter['name'] == '_FORCED_FILTER' or filter['name'] in args:
+                    query = query.where(filter['field'], filter['comparison'], get_filter_value(filter, args))
+
+        # Changes within the same tick as the watermark are read again, the change set skips those already read
+        if change_set and change_set.changed_since:
+            query = query.where(change_set.field, '>=', change_set.changed_since)
 
         return query
 
 
-def data_type_validator(value, type):
+def get_change_stamp():
+    """Returns the change timestamp to write when any path of the table tracks changes"""
+    if not g.get('change_stamp'):
+        return {}
+
+    return {g.change_stamp['field']: firestore.SERVER_TIMESTAMP}
+
+
+def get_document_version(doc):
+    """Returns the version of a document, its update time with nanoseconds"""
+    return doc.update_time.rfc3339()
+
+
+def parse_document_version(version):
+    """Returns the update time within the version of a document, or None if it is not a version of a document"""
+    if not version:
+        return None
+
     try:
-        if not type:
-            return value
-        if type == 'integer' or type == 'number':
-            value = int(value)
-        if type == 'boolean':
-            value = bool(value)
-        if type == 'date-time':
-            value = datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
-        if type == 'date':
-            value = datetime.strptime(value, "%Y-%m-%d")
-    except Exception:
-        pass
+        return DatetimeWithNanoseconds.from_rfc3339(version)
+    except ValueError:
         return None
-    else:
-        return value
 
 
-def create_response(keys, data):
-    if isinstance(data, types.GeneratorType) or isinstance(data, list):
-        return_object = {}
-        for key in keys:
-            if type(keys[key]) == dict:
-                return_object[key] = [EntityParser().parse(keys[key], entity, 'get', entity.id) for entity in data]
+def needs_existing_document():
+    """Returns if forced filters or the audit log need the existing document of an update"""
+    return bool(g.forced_filters) or bool(getattr(config, 'AUDIT_LOGS_NAME', ''))
+
+
+def get_document_value(doc, field):
+    if not field:
+        return None
+
+    try:
+        return doc.get(field)
+    except KeyError:
+        return None
+
+
+def create_document_event(doc, settings, removed):
+    """Returns the change event of a document, which is deleted when it is removed from the query or tombstoned"""
+    changed = get_document_value(doc, settings['field'])
+    deleted = removed or bool(settings.get('tombstone_field') and get_document_value(doc, settings['tombstone_field']))
+
+    return create_change_event(doc.id, doc.to_dict() or {}, changed, deleted)
 
-        return return_object
 
-    return EntityParser().parse(keys, data, 'get', data.id)
+def get_position(doc, inequality_field):
+    """Returns the position of a document within the ordering of a page query"""
+
+    return [get_document_value(doc, inequality_field), doc.id] if inequality_field else [doc.id]
+
+
+def create_response(keys, data):
+    return create_entity_response(keys, data, lambda doc: doc.id)
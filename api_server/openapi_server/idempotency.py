@@ -0,0 +1,116 @@
+import config
+import functools
+import hashlib
+import json
+import time
+
+from flask import g, make_response, request
+from openapi_server.idempotencystore import create_idempotency_store
+
+# The headers of a response that are replayed, other headers are added again by the after request functions
+REPLAYED_HEADERS = ['Content-Type', 'ETag', 'Location']
+
+MAX_KEY_LENGTH = 255
+
+
+class IdempotentRequests:
+    """Replays the first successful response of a request with an Idempotency-Key header on retries of the request
+
+    The key is scoped to the user and the route. A retry with the same key but another body is rejected, and a retry
+    while the request is in flight waits for its response.
+    """
+
+    def __init__(self, settings):
+        self.store = create_idempotency_store(settings)
+        self.max_wait = settings.get('max_wait', 10)
+        self.required = settings.get('required', False)
+
+    def run(self, func, *args, **kwargs):
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if not idempotency_key:
+            if self.required:
+                return create_problem(400, "Bad Request", "The header 'Idempotency-Key' is required")
+
+            return func(*args, **kwargs)
+
+        if len(idempotency_key) > MAX_KEY_LENGTH:
+            return create_problem(
+                400, "Bad Request", f"The header 'Idempotency-Key' is longer than {MAX_KEY_LENGTH} characters")
+
+        key = get_store_key(idempotency_key)
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+
+        # A released request, which failed, can be claimed by a waiting retry
+        deadline = time.monotonic() + self.max_wait
+        while not self.store.claim(key, fingerprint):
+            record = self.store.wait(key, max(deadline - time.monotonic(), 0))
+            if record is None:
+                if time.monotonic() >= deadline:
+                    return create_problem(
+                        409, "Conflict", "A request with this Idempotency-Key is being processed, please try again")
+                continue
+
+            if record['fingerprint'] != fingerprint:
+                return create_problem(
+                    422, "Unprocessable Entity", "The Idempotency-Key is already used for another request")
+
+            if record['state'] == 'in_flight':
+                return create_problem(
+                    409, "Conflict", "A request with this Idempotency-Key is being processed, please try again")
+
+            return replay_response(record['response'])
+
+        try:
+            response = make_response(func(*args, **kwargs))
+        except Exception:
+            self.store.release(key)
+            raise
+
+        # Only successful responses are kept, a failed request can be retried with the same key
+        if 200 <= response.status_code < 300 and not response.is_streamed:
+            self.store.complete(key, fingerprint, {
+                'status': response.status_code,
+                'headers': [(name, response.headers[name]) for name in REPLAYED_HEADERS if name in response.headers],
+                'body': response.get_data()
+            })
+        else:
+            self.store.release(key)
+
+        return response
+
+
+def get_store_key(idempotency_key):
+    """Returns the key of a request within the store, the Idempotency-Key scoped to the user and route"""
+
+    scope = [g.get('user'), str(request.url_rule), request.method, sorted((request.view_args or {}).items()),
+             idempotency_key]
+    return hashlib.sha256(json.dumps(scope, default=str).encode()).hexdigest()
+
+
+def replay_response(stored_response):
+    response = make_response(stored_response['body'], stored_response['status'])
+    for name, value in stored_response['headers']:
+        response.headers[name] = value
+
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def create_problem(status, title, detail):
+    return make_response({"detail": detail, "status": status, "title": title, "type": "about:blank"}, status)
+
+
+idempotent_requests = IdempotentRequests(config.IDEMPOTENCY) if hasattr(config, 'IDEMPOTENCY') else None
+
+
+def idempotency_keyed(func):
+    """Runs a controller at most once per Idempotency-Key header, replaying its response on retries"""
+
+    if idempotent_requests is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return idempotent_requests.run(func, *args, **kwargs)
+
+    return wrapper
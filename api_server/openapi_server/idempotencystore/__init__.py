@@ -0,0 +1,4 @@
+from .idempotencystore import IdempotencyStore, LocalIdempotencyStore, RedisIdempotencyStore, \
+    create_idempotency_store
+
+__all__ = ['IdempotencyStore', 'LocalIdempotencyStore', 'RedisIdempotencyStore', 'create_idempotency_store']
@@ -0,0 +1,214 @@
+import base64
+import json
+import logging
+import threading
+import time
+
+from abc import ABC, abstractmethod
+from openapi_server.lru_cache import LRUCache
+
+
+class IdempotencyStore(ABC):
+    """Keeps the requests with an idempotency key, first while they are in flight and then with their response
+
+    A record is a dict with the state 'in_flight' or 'completed', the fingerprint of the request and, once completed,
+    the response.
+    """
+
+    def __init__(self, ttl, lock_ttl):
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+
+    @abstractmethod
+    def claim(self, key, fingerprint):
+        pass
+
+    @abstractmethod
+    def get(self, key):
+        pass
+
+    @abstractmethod
+    def wait(self, key, timeout):
+        pass
+
+    @abstractmethod
+    def complete(self, key, fingerprint, response):
+        pass
+
+    @abstractmethod
+    def release(self, key):
+        pass
+
+
+class LocalIdempotencyStore(IdempotencyStore):
+    """Keeps the requests within the memory of the instance"""
+
+    def __init__(self, max_size=10000, ttl=86400, lock_ttl=300):
+        super().__init__(ttl, lock_ttl)
+        self.records = LRUCache(max_size)
+        self.condition = threading.Condition()
+
+    def claim(self, key, fingerprint):
+        """Marks a request as in flight, unless there already is a record for its key
+
+        :param key: The idempotency key of the request
+        :type key: str
+        :param fingerprint: The fingerprint of the request
+        :type fingerprint: str
+
+        :return: If the request was claimed
+        :rtype: bool
+        """
+
+        with self.condition:
+            if self.records.get(key) is not None:
+                return False
+
+            self.records.set(key, {'state': 'in_flight', 'fingerprint': fingerprint}, time.time() + self.lock_ttl)
+            return True
+
+    def get(self, key):
+        return self.records.get(key)
+
+    def wait(self, key, timeout):
+        """Waits until a request is no longer in flight and returns its record
+
+        :param key: The idempotency key of the request
+        :type key: str
+        :param timeout: The maximum number of seconds to wait
+        :type timeout: float
+
+        :return: The record, which is still in flight when the wait timed out, or None if it was released
+        :rtype: dict | None
+        """
+
+        with self.condition:
+            self.condition.wait_for(lambda: not is_in_flight(self.records.get(key)), timeout)
+            return self.records.get(key)
+
+    def complete(self, key, fingerprint, response):
+        with self.condition:
+            self.records.set(
+                key, {'state': 'completed', 'fingerprint': fingerprint, 'response': response}, time.time() + self.ttl)
+            self.condition.notify_all()
+
+    def release(self, key):
+        with self.condition:
+            self.records.delete(key)
+            self.condition.notify_all()
+
+
+class RedisIdempotencyStore(IdempotencyStore):
+    """Keeps the requests within a server speaking the Redis protocol, shared by all instances
+
+    The records are stored as JSON with the body of the response in base64, so the server can not make the API run
+    code. A failing server is logged, after which the request is handled as if it had no idempotency key.
+    """
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, url, ttl=86400, lock_ttl=300, prefix='idempotency'):
+        import redis
+
+        super().__init__(ttl, lock_ttl)
+        self.client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        self.prefix = prefix
+
+    def get_key(self, key):
+        return f"{self.prefix}:{key}"
+
+    def claim(self, key, fingerprint):
+        """Marks a request as in flight, unless there already is a record for its key
+
+        :param key: The idempotency key of the request
+        :type key: str
+        :param fingerprint: The fingerprint of the request
+        :type fingerprint: str
+
+        :return: If the request was claimed
+        :rtype: bool
+        """
+
+        try:
+            return bool(self.client.set(
+                self.get_key(key), encode_record({'state': 'in_flight', 'fingerprint': fingerprint}), nx=True,
+                ex=self.lock_ttl))
+        except Exception as e:
+            logging.warning(f"An exception occurred when claiming '{key}' within the idempotency store: {str(e)}")
+            return True
+
+    def get(self, key):
+        try:
+            value = self.client.get(self.get_key(key))
+            return decode_record(value) if value is not None else None
+        except Exception as e:
+            logging.warning(f"An exception occurred when reading '{key}' from the idempotency store: {str(e)}")
+            return None
+
+    def wait(self, key, timeout):
+        """Polls until a request is no longer in flight and returns its record
+
+        :param key: The idempotency key of the request
+        :type key: str
+        :param timeout: The maximum number of seconds to wait
+        :type timeout: float
+
+        :return: The record, which is still in flight when the wait timed out, or None if it was released
+        :rtype: dict | None
+        """
+
+        deadline = time.monotonic() + timeout
+        record = self.get(key)
+        while is_in_flight(record) and time.monotonic() < deadline:
+            time.sleep(min(self.POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+            record = self.get(key)
+
+        return record
+
+    def complete(self, key, fingerprint, response):
+        try:
+            self.client.setex(self.get_key(key), self.ttl, encode_record(
+                {'state': 'completed', 'fingerprint': fingerprint, 'response': response}))
+        except Exception as e:
+            logging.warning(f"An exception occurred when writing '{key}' to the idempotency store: {str(e)}")
+
+    def release(self, key):
+        try:
+            self.client.delete(self.get_key(key))
+        except Exception as e:
+            logging.warning(f"An exception occurred when deleting '{key}' from the idempotency store: {str(e)}")
+
+
+def is_in_flight(record):
+    return record is not None and record['state'] == 'in_flight'
+
+
+def encode_record(record):
+    """Returns a record as JSON, the body of its response is encoded in base64"""
+
+    if 'response' in record:
+        record = {**record, 'response': {
+            **record['response'], 'body': base64.b64encode(record['response']['body']).decode()}}
+
+    return json.dumps(record)
+
+
+def decode_record(value):
+    record = json.loads(value)
+    if 'response' in record:
+        record['response']['body'] = base64.b64decode(record['response']['body'])
+
+    return record
+
+
+def create_idempotency_store(settings):
+    """Returns the idempotency store for the IDEMPOTENCY settings"""
+
+    if settings.get('backend', 'local') == 'redis':
+        return RedisIdempotencyStore(
+            settings['url'], ttl=settings.get('ttl', 86400), lock_ttl=settings.get('lock_ttl', 300),
+            prefix=settings.get('prefix', 'idempotency'))
+
+    return LocalIdempotencyStore(
+        max_size=settings.get('max_size', 10000), ttl=settings.get('ttl', 86400),
+        lock_ttl=settings.get('lock_ttl', 300))
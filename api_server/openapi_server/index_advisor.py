@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+
+import argparse
+import config
+import itertools
+import json
+import os
+import sys
+import yaml
+
+from collections import namedtuple
+from openapi_server import openapi_spec
+from openapi_server.resolver import DEFAULT_CONTROLLER, get_operation_name
+
+BACKENDS = ['datastore', 'firestore']
+KEY_FIELDS = {'datastore': '__key__', 'firestore': '__name__'}
+RANGE_COMPARISONS = ['<', '<=', '>', '>=']
+LIST_OPERATIONS = ['generic_get_multiple', 'generic_get_multiple_page', 'generic_get_aggregate', 'generic_get_changes']
+
+# The maximum number of composite indexes of a project, for both Datastore and Firestore
+MAX_INDEXES = 200
+
+Query = namedtuple('Query', ['filters', 'equality_fields', 'inequality_field', 'order', 'projection'])
+Finding = namedtuple('Finding', ['severity', 'backend', 'message'])
+
+
+class RouteAdvice:
+    """The queries, composite indexes and findings of a route reading a table"""
+
+    def __init__(self, path, request_method, operation, kind):
+        self.path = path
+        self.request_method = request_method
+        self.operation = operation
+        self.kind = kind
+        self.queries = {backend: [] for backend in BACKENDS}
+        self.indexes = {backend: [] for backend in BACKENDS}
+        self.findings = []
+
+    def add_finding(self, severity, backend, message):
+        finding = Finding(severity, backend, message)
+        if finding not in self.findings:
+            self.findings.append(finding)
+
+    def add_query(self, backend, query):
+        fields = get_composite_index(backend, query)
+        self.queries[backend].append((query, fields))
+
+        if fields is not None and (self.kind, fields) not in self.indexes[backend]:
+            self.indexes[backend].append((self.kind, fields))
+
+
+def get_routes(spec):
+    """Yields the path, method, generic operation and path object of each route querying a table"""
+
+    for path, path_object in spec.get('paths', {}).items():
+        if 'x-db-table-name' not in path_object:
+            continue
+
+        for request_method, method_object in path_object.items():
+            if request_method not in openapi_spec.HTTP_METHODS:
+                continue
+
+            router_controller = method_object.get(
+                'x-openapi-router-controller', path_object.get('x-openapi-router-controller'))
+            operation = get_operation_name(method_object.get('operationId'))
+
+            if router_controller in [None, DEFAULT_CONTROLLER] and operation in LIST_OPERATIONS:
+                yield path, request_method, operation, path_object
+
+
+def get_filter_combinations(filters):
+    """Yields each combination of filters a request can activate, forced and required filters always apply"""
+
+    fixed_filters = [filter for filter in filters if filter['name'] == '_FORCED_FILTER' or filter['required']]
+    optional_filters = [filter for filter in filters if filter not in fixed_filters]
+
+    for size in range(len(optional_filters) + 1):
+        for combination in itertools.combinations(optional_filters, size):
+            yield fixed_filters + list(combination)
+
+
+def get_composite_index(backend, query):
+    """Returns the fields of the composite index a query needs as (field, descending) tuples, or None when the
+    built-in single-field indexes serve the query
+
+    :param backend: The database type
+    :type backend: str
+    :param query: The query
+    :type query: Query
+
+    :rtype: tuple | None
+    """
+
+    key_field = KEY_FIELDS[backend]
+    key_descending = any(field == key_field and descending for field, descending in query.order)
+
+    ordered = [(field, descending) for field, descending in query.order if field != key_field]
+    if query.inequality_field and not ordered:
+        ordered = [(query.inequality_field, False)]
+
+    ordered_fields = [field for field, _ in ordered]
+    fields = [(field, False) for field in query.equality_fields if field not in ordered_fields] + ordered
+
+    # Firestore does not need an index to project fields
+    if backend == 'datastore':
+        fields += [(field, False) for field in query.projection if field not in query.equality_fields + ordered_fields]
+
+    # Equality filters are merged from the single-field indexes, which are ordered by ascending key
+    if not ordered and len(fields) == len(query.equality_fields) and not key_descending:
+        return None
+
+    if backend == 'firestore':
+        # Single-field indexes exist in both directions, with the document name ordered in the same direction
+        if len(fields) <= 1:
+            return None
+
+        return tuple(fields + ([(key_field, True)] if key_descending and not ordered else []))
+
+    # Built-in Datastore indexes hold a single property in either direction, followed by the ascending key
+    if len(fields) <= 1 and not key_descending:
+        return None
+
+    return tuple(fields + ([(key_field, True)] if key_descending else []))
+
+
+def get_page_orders(backend, inequality_field):
+    """Returns the orderings of the queries reading the next and the previous page, as (field, descending) tuples"""
+
+    key_field = KEY_FIELDS[backend]
+    order = [inequality_field, key_field] if inequality_field else [key_field]
+
+    if backend == 'datastore':
+        # Without an inequality field the entities are ordered by descending key
+        return [[(field, not (bool(inequality_field) != reverse)) for field in order] for reverse in [False, True]]
+
+    # The previous page is read in reverse order with limit_to_last
+    return [[(field, reverse) for field in order] for reverse in [False, True]]
+
+
+def advise_route(spec, path, request_method, operation, path_object, backends, list_budget):
+    """Returns the queries, composite indexes and findings of a route
+
+    :param spec: The OpenAPI specification
+    :type spec: dict
+    :param path: The path within the specification
+    :type path: str
+    :param request_method: The HTTP method
+    :type request_method: str
+    :param operation: The generic operation of the route
+    :type operation: str
+    :param path_object: The path object within the specification
+    :type path_object: dict
+    :param backends: The database types to advise
+    :type backends: list
+    :param list_budget: The default list budget
+    :type list_budget: dict | None
+
+    :rtype: RouteAdvice
+    """
+
+    method_object = path_object[request_method]
+    advice = RouteAdvice(path, request_method, operation, path_object['x-db-table-name'])
+
+    try:
+        filters = openapi_spec.get_request_query_filters(
+            spec, method_object, method_object.get('x-forced-filters', []))
+    except ValueError as e:
+        advice.add_finding('error', None, f"The query filters can not be compiled: {str(e)}")
+        return advice
+
+    changes = openapi_spec.get_change_settings(path_object)
+    aggregate = openapi_spec.get_aggregate_settings(method_object) if operation == 'generic_get_aggregate' else None
+
+    if operation == 'generic_get_aggregate' and aggregate is None:
+        advice.add_finding('error', None, "The aggregation is missing or not supported")
+        return advice
+
+    if operation == 'generic_get_changes' and changes is None:
+        advice.add_finding('error', None, "Change feeds need the extension 'x-changed-since-field'")
+        return advice
+
+    # Lists within a budget are read as pages
+    route_budget = {**(list_budget or {}), **(openapi_spec.get_list_budget(method_object) or {})}
+    paged = operation == 'generic_get_multiple_page' or \
+        (operation == 'generic_get_multiple' and bool(route_budget.get('max_rows')))
+
+    # A change feed only queries to catch up since a resume token
+    change_fields = [] if operation == 'generic_get_changes' else [None]
+    if changes and operation != 'generic_get_aggregate':
+        change_fields.append(changes['field'])
+
+    if aggregate and (aggregate['group_by'] or aggregate['aggregate'] != 'count'):
+        advice.add_finding('warning', 'datastore', "The aggregation is reduced after reading every matching entity")
+    if aggregate and aggregate['group_by']:
+        advice.add_finding('warning', 'firestore', "Groups are reduced after reading every matching document")
+
+    for combination in get_filter_combinations(filters):
+        for change_field in change_fields:
+            for backend in backends:
+                for query in plan_queries(advice, backend, combination, change_field, paged, aggregate):
+                    advice.add_query(backend, query)
+
+        if operation == 'generic_get_changes':
+            # The listener shared by all subscribers leaves out the forced filters. Firestore listens to the changes
+            # since it started, Datastore polls on the change field.
+            listener_filters = [filter for filter in combination if filter['name'] != '_FORCED_FILTER']
+            for backend in backends:
+                for query in plan_queries(advice, backend, listener_filters, changes['field'], False, None):
+                    advice.add_query(backend, query)
+
+    return advice
+
+
+def plan_queries(advice, backend, filters, change_field, paged, aggregate):
+    """Returns the queries a backend runs for a combination of active filters, reporting the ones it can not serve"""
+
+    description = describe_filters(filters, change_field)
+
+    equality_fields = sorted({filter['field'] for filter in filters if filter['comparison'] == '=='})
+    range_fields = unique([filter['field'] for filter in filters if filter['comparison'] in RANGE_COMPARISONS])
+    not_equal_fields = unique([filter['field'] for filter in filters if filter['comparison'] == '!='])
+
+    if change_field:
+        range_fields = unique([change_field] + range_fields)
+
+    inequality_fields = unique(range_fields + not_equal_fields)
+    if len(inequality_fields) > 1:
+        advice.add_finding('error', None, f"Inequality filters on more than one field can not be combined: "
+                                          f"{', '.join(inequality_fields)}")
+        return []
+
+    inequality_field = range_fields[0] if range_fields else None
+    if paged and not_equal_fields and not inequality_field:
+        advice.add_finding('error', None, f"A '!=' filter on '{not_equal_fields[0]}' requires ordering on that "
+                                          f"field first, but pages without an inequality filter are ordered by key")
+        return []
+
+    if paged:
+        return [Query(description, equality_fields, inequality_field, order, [])
+                for order in get_page_orders(backend, inequality_field)]
+
+    projection = []
+    if aggregate and aggregate['aggregate'] != 'count':
+        fields = [name for name in [aggregate['field'], aggregate['group_by']] if name]
+        projection = fields if not set(fields) & set(equality_fields) else []
+
+    return [Query(description, equality_fields, inequality_field or (inequality_fields or [None])[0], [], projection)]
+
+
+def describe_filters(filters, change_field):
+    descriptions = [f"{filter['field']} {filter['comparison']}" for filter in filters]
+    if change_field:
+        descriptions.append(f"{change_field} >= changed_since")
+
+    return ', '.join(descriptions) if descriptions else 'no filters'
+
+
+def describe_index(kind, fields):
+    return f"{kind}({', '.join(f'{field} desc' if descending else field for field, descending in fields)})"
+
+
+def unique(fields):
+    return list(dict.fromkeys(fields))
+
+
+def write_datastore_indexes(indexes, file_name):
+    """Writes the composite indexes as a Datastore index.yaml"""
+
+    with open(file_name, 'w') as index_file:
+        yaml.safe_dump({'indexes': [{
+            'kind': kind,
+            'properties': [{'name': field, 'direction': 'desc' if descending else 'asc'}
+                           for field, descending in fields]
+        } for kind, fields in indexes]}, index_file, sort_keys=False)
+
+
+def write_firestore_indexes(indexes, file_name):
+    """Writes the composite indexes as a Firestore firestore.indexes.json"""
+
+    with open(file_name, 'w') as index_file:
+        json.dump({'indexes': [{
+            'collectionGroup': kind,
+            'queryScope': 'COLLECTION',
+            'fields': [{'fieldPath': field, 'order': 'DESCENDING' if descending else 'ASCENDING'}
+                       for field, descending in fields]
+        } for kind, fields in indexes], 'fieldOverrides': []}, index_file, indent=2)
+
+
+def print_report(advices, backends, verbose):
+    for advice in advices:
+        print(f"{advice.request_method.upper()} {advice.path} ({advice.operation} on {advice.kind})")
+
+        for backend in backends:
+            if verbose:
+                for query, fields in advice.queries[backend]:
+                    order = ', '.join(f"{field} desc" if descending else field for field, descending in query.order)
+                    index = describe_index(advice.kind, fields) if fields else 'built-in indexes'
+                    print(f"  {backend}: {query.filters}{f' ordered by {order}' if order else ''} -> {index}")
+
+            for kind, fields in advice.indexes[backend]:
+                print(f"  {backend} index: {describe_index(kind, fields)}")
+
+        for finding in advice.findings:
+            print(f"  {finding.severity}{f' ({finding.backend})' if finding.backend else ''}: {finding.message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Lists the queries of each route within the OpenAPI specification and writes the composite "
+                    "indexes they need")
+    parser.add_argument('--spec', default=openapi_spec.OPENAPI_PATH, help='path of the OpenAPI specification')
+    parser.add_argument('--output-dir', default='.', help='directory to write index.yaml and firestore.indexes.json')
+    parser.add_argument('--database', choices=BACKENDS, action='append',
+                        help='database type to advise, defaults to DATABASE_TYPE or both')
+    parser.add_argument('--verbose', action='store_true', help='list every query of each route')
+    args = parser.parse_args()
+
+    backends = args.database or ([config.DATABASE_TYPE] if getattr(config, 'DATABASE_TYPE', None) in BACKENDS else
+                                 BACKENDS)
+
+    with open(args.spec, 'r') as openapi:
+        spec = yaml.safe_load(openapi.read())
+
+    list_budget = getattr(config, 'LIST_BUDGET', None)
+    advices = [advise_route(spec, path, request_method, operation, path_object, backends, list_budget)
+               for path, request_method, operation, path_object in get_routes(spec)]
+
+    print_report(advices, backends, args.verbose)
+
+    for backend in backends:
+        indexes = unique(index for advice in advices for index in advice.indexes[backend])
+        if len(indexes) > MAX_INDEXES:
+            print(f"warning ({backend}): {len(indexes)} composite indexes exceed the limit of {MAX_INDEXES}, "
+                  f"make optional filters required or forced to reduce the combinations")
+
+        if backend == 'datastore':
+            file_name = os.path.join(args.output_dir, 'index.yaml')
+            write_datastore_indexes(indexes, file_name)
+        else:
+            file_name = os.path.join(args.output_dir, 'firestore.indexes.json')
+            write_firestore_indexes(indexes, file_name)
+
+        print(f"Wrote {len(indexes)} {backend} indexes to {file_name}")
+
+    # Queries that fail at runtime fail the advice, so it can guard a deployment
+    if any(finding.severity == 'error' for advice in advices for finding in advice.findings):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
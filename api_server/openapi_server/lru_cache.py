@@ -0,0 +1,51 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A thread-safe, bounded cache evicting the least recently used items, with an optional expiry per item"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value of a key, or None if it is not cached or expired"""
+
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+
+            value, expires = item
+            if expires is not None and expires <= time.time():
+                del self.items[key]
+                return None
+
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires=None):
+        """Caches the value of a key
+
+        :param key: The key
+        :type key: str | tuple
+        :param value: The value
+        :type value: object
+        :param expires: The epoch time at which the value expires
+        :type expires: float | None
+        """
+
+        with self.lock:
+            self.items[key] = (value, expires)
+            self.items.move_to_end(key)
+
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
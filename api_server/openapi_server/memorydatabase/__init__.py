@@ -0,0 +1,3 @@
+from .memorydatabase import MemoryDatabase
+
+__all__ = ['MemoryDatabase']
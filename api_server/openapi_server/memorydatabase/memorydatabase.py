@@ -0,0 +1,483 @@
+import config
+import copy
+import itertools
+import json
+import math
+import operator
+import random
+import threading
+import time
+import uuid
+
+from datetime import datetime, timezone
+from flask import g, request
+from google.api_core import exceptions
+from openapi_server.abstractdatabase import DatabaseInterface, EntityParser, AuditDiff, ChangePoller, ForcedFilters, \
+    create_change_event, create_entity_response, create_etag, get_active_filters, get_change_set, get_filter_value, \
+    get_inequality_field, get_value, limit_page_bytes, patch_entity, read_partitions, reduce_aggregate, \
+    validate_if_match
+from openapi_server.resilience import call_backend
+
+COMPARISONS = {
+    '==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+
+class MemoryDocument:
+    """A stored entity, which is replaced instead of changed on each write so readers never see partial updates"""
+
+    def __init__(self, id, data, version):
+        self.id = id
+        self.data = data
+        self.version = version
+
+    def to_dict(self):
+        return self.data
+
+
+class MemoryDatabase(DatabaseInterface):
+    """Keeps the entities within the memory of the process, for local development and load testing
+
+    Each process has its own entities, which are lost when the process stops. Latency and faults can be injected into
+    each call, to see how the API behaves when its backend is slow or failing.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.versions = itertools.count(1)
+        self.kinds = {}
+
+        settings = config.MEMORY_DATABASE if hasattr(config, 'MEMORY_DATABASE') else {}
+        if settings.get('seed'):
+            self.load(settings['seed'])
+
+        latency = settings.get('latency', 0)
+        latency = list(latency) if isinstance(latency, (list, tuple)) else [latency]
+        self.latency = (min(latency), max(latency))
+        self.error_rate = settings.get('error_rate', 0)
+
+    def load(self, path):
+        """Loads entities from a JSON file containing an object of entities by identifier for each kind"""
+
+        with open(path, 'r') as seed:
+            for kind, entities in json.load(seed).items():
+                self.kinds[kind] = {
+                    str(id): MemoryDocument(str(id), entity, next(self.versions)) for id, entity in entities.items()}
+
+    def call(self, func, backend='memory', idempotent=False):
+        """Calls a function like a call to a remote backend, with the configured latency and faults"""
+
+        def call_with_faults(timeout):
+            latency = random.uniform(*self.latency)
+            if timeout is not None and latency > timeout:
+                time.sleep(timeout)
+                raise exceptions.DeadlineExceeded("The injected latency exceeds the timeout")
+
+            if latency:
+                time.sleep(latency)
+            if random.random() < self.error_rate:
+                raise exceptions.ServiceUnavailable("An injected fault")
+
+            return func()
+
+        return call_backend(backend, call_with_faults, idempotent)
+
+    def process_audit_logging(self, changes, entity_id):
+        if hasattr(config, 'AUDIT_LOGS_NAME') and config.AUDIT_LOGS_NAME != "" and changes:
+            audit_log = {
+                "attributes_changed": changes,
+                "table_id": entity_id,
+                "table_name": g.db_table_name,
+                "timestamp": datetime.utcnow().isoformat(timespec="seconds") + 'Z',
+                "user": g.user if g.user is not None else request.remote_addr
+            }
+
+            def write_audit_log():
+                with self.lock:
+                    self.write(config.AUDIT_LOGS_NAME, str(uuid.uuid4()), audit_log)
+
+            self.call(write_audit_log, backend='audit')
+
+    def get_single(self, id, kind, db_keys, res_keys):
+        """Returns an entity as a dict
+
+        :param id: A unique identifier
+        :type id: str | int
+        :param kind: Database kind of entity
+        :type kind: str
+        :param db_keys: List of keys for database entity
+        :type kind: list
+        :param res_keys: List of keys for response entity
+        :type kind: list
+
+        :rtype: dict
+        """
+
+        doc = self.call(lambda: self.kinds.get(kind, {}).get(str(id)), idempotent=True)
+        if doc is None:
+            return None
+
+        ForcedFilters().validate(filters=g.forced_filters, entity=doc.data)
+
+        g.etag = create_etag(str(doc.version))
+        return EntityParser().parse(res_keys, doc, 'get', doc.id)
+
+    def put_single(self, id, body, kind, db_keys, res_keys):
+        """Updates an entity
+
+        :param id: A unique identifier
+        :type id: str | int
+        :param body:
+        :type body: dict
+        :param kind: Database kind of entity
+        :type kind: str
+        :param db_keys: List of keys for database entity
+        :type kind: list
+        :param res_keys: List of keys for response entity
+        :type kind: list
+
+        :rtype: str
+        """
+
+        new_doc = EntityParser().parse(db_keys, body, 'put', id)
+
+        def update(entity):
+            entity.update(new_doc)
+
+        return self.update_document(
+            kind, str(id), res_keys, update, lambda old_doc: AuditDiff().compare(old_doc, new_doc))
+
+    def post_single(self, body, kind, db_keys, res_keys):
+        """Creates an entity
+
+        :param body:
+        :type body: dict
+        :param kind: Database kind of entity
+        :type kind: str
+        :param db_keys: List of keys for database entity
+        :type kind: list
+        :param res_keys: List of keys for response entity
+        :type kind: list
+
+        :rtype: str
+        """
+
+        id = str(uuid.uuid4())
+        new_doc = EntityParser().parse(db_keys, body, 'post', id)
+
+        def write():
+            with self.lock:
+                return self.write(kind, id, {**new_doc, **get_change_stamp()})
+
+        doc = self.call(write)
+
+        g.etag = create_etag(str(doc.version))
+        self.process_audit_logging(changes=AuditDiff().compare({}, new_doc), entity_id=id)
+
+        return create_response(res_keys, doc)
+
+    def patch_single(self, id, body, kind, db_keys, res_keys):
+        """Updates the fields of an entity within a JSON merge-patch
+
+        :param id: A unique identifier
+        :type id: str | int
+        :param body: The JSON merge-patch
+        :type body: dict
+        :param kind: Database kind of entity
+        :type kind: str
+        :param db_keys: List of keys for database entity
+        :type kind: list
+        :param res_keys: List of keys for response entity
+        :type kind: list
+
+        :rtype: dict
+        """
+
+        field_paths = EntityParser().parse_patch(db_keys, body)
+
+        def update(entity):
+            for path, value in field_paths.items():
+                patch_entity(entity, path.split('.'), value)
+
+        return self.update_document(
+            kind, str(id), res_keys, update, lambda old_doc: AuditDiff().compare_paths(old_doc, field_paths))
+
+    def update_document(self, kind, id, res_keys, update, compare):
+        """Updates a copy of a document and replaces the document with it, unless the If-Match header does not match
+
+        :param kind: Database kind of entity
+        :type kind: str
+        :param id: A unique identifier
+        :type id: str
+        :param res_keys: List of keys for response entity
+        :type res_keys: list
+        :param update: Function updating the copy of the document
+        :type update: function
+        :param compare: Function returning the audit changes for the existing document
+        :type compare: function
+
+        :rtype: dict | None
+        """
+
+        def update_locked():
+            with self.lock:
+                doc = self.kinds.get(kind, {}).get(id)
+                if doc is None:
+                    return None, None
+
+                validate_if_match(create_etag(str(doc.version)))
+                ForcedFilters().validate(filters=g.forced_filters, entity=doc.data)
+
+                entity = copy.deepcopy(doc.data)
+                update(entity)
+                return doc, self.write(kind, id, {**entity, **get_change_stamp()})
+
+        doc, updated_doc = self.call(update_locked)
+        if doc is None:
+            return None
+
+        g.etag = create_etag(str(updated_doc.version))
+        self.process_audit_logging(changes=compare(doc.data), entity_id=id)
+
+        return create_response(res_keys, updated_doc)
+
+    def write(self, kind, id, entity):
+        doc = MemoryDocument(id, entity, next(self.versions))
+        self.kinds.setdefault(kind, {})[id] = doc
+
+        return doc
+
+    def get_multiple(self, kind, db_keys, res_keys, filters):
+        """Returns all entities as a list of dicts
+
+        :param kind: Database kind of entity
+        :type kind: str
+        :param db_keys: List of keys for database entity
+        :type kind: list
+        :param res_keys: List of keys for response entity
+        :type kind: list
+        :param filters: List of query filters
+        :type kind: list
+
+        :rtype: array
+        """
+
+        change_set = get_change_set()
+        docs = self.query(kind, filters, change_set)
+
+        if change_set:
+            return change_set.annotate(create_response(res_keys, self.filter_changes(change_set, docs)))
+
+        return create_response(res_keys, docs)
+
+    def get_multiple_page(self, kind, db_keys, res_keys, filters, page_cursor, page_size, page_action,
+                          max_bytes=None):
+        """Returns all entities as a list of dicts
+
+        :param kind: Database kind of entity
+        :type kind: str
+        :param db_keys: List of keys for database entity
+        :type kind: list
+        :param res_keys: List of keys for response entity
+        :type kind: list
+        :param filters: List of query filters
+        :type kind: list
+        :param page_cursor: The position within the ordering to retrieve a specific page from
+        :type page_cursor: list
+        :param page_size: The numbers of items within a page
+        :type page_size: int
+        :param page_action: Selector to get next or previous page based on the cursor
+        :type page_action: str
+        :param max_bytes: The maximum size of the entities within the page
+        :type max_bytes: int | None
+
+        :rtype: dict
+        """
+
+        change_set = get_change_set()
+
+        # The documents are ordered like the other databases: by the inequality field, if any, and the identifier
+        inequality_field = get_inequality_field(filters, change_set)
+        docs = sorted(self.query(kind, filters, change_set), key=lambda doc: get_position(doc, inequality_field))
+
+        # A cursor without the inequality field value points to the document to read it from
+        if page_cursor and inequality_field and len(page_cursor) == 1:
+            doc = self.kinds.get(kind, {}).get(page_cursor[0])
+            if doc is None:
+                raise ValueError("Cursor is not valid")
+            page_cursor = get_position(doc, inequality_field)
+        if page_cursor and len(page_cursor) != (2 if inequality_field else 1):
+            raise ValueError("Cursor is not valid")
+
+        reverse = bool(page_cursor) and page_action == 'prev'
+        try:
+            if reverse:
+                docs = [doc for doc in docs if get_position(doc, inequality_field) < page_cursor][-(page_size + 1):]
+                has_prev, has_next = len(docs) > page_size, True
+                docs = docs[-page_size:]
+            else:
+                if page_cursor:
+                    docs = [doc for doc in docs if get_position(doc, inequality_field) > page_cursor]
+
+                docs = docs[:page_size + 1]
+                has_prev, has_next = bool(page_cursor), len(docs) > page_size
+                docs = docs[:page_size]
+        except TypeError:
+            raise ValueError("Cursor is not valid")
+
+        # A page is cut short when its entities exceed the byte budget, the rest of them are on the adjacent page
+        if max_bytes:
+            docs, cut = limit_page_bytes(docs, [doc.data for doc in docs], max_bytes, reverse)
+            has_prev, has_next = has_prev or (cut and reverse), has_next or (cut and not reverse)
+
+        response = create_response(
+            {'results': res_keys['results']}, list(self.filter_changes(change_set, docs)) if change_set else docs)
+
+        # Create response object
+        response['status'] = 'success'
+        response['page_size'] = page_size
+        response['next_page'] = get_position(docs[-1], inequality_field) if docs and has_next else None
+        response['prev_page'] = get_position(docs[0], inequality_field) if docs and has_prev else None
+
+        return change_set.annotate(response) if change_set else response
+
+    def get_multiple_partitioned(self, kind, db_keys, res_keys, filters, partition_count, max_workers, ordered):
+        """Returns the entities as pages of dicts, handing over ranges of identifiers like partitions read concurrently
+
+        :param kind: Database kind of entity
+        :type kind: str
+        :param db_keys: List of keys for database entity
+        :type kind: list
+        :param res_keys: List of keys for response entity
+        :type kind: list
+        :param filters: List of query filters
+        :type kind: list
+        :param partition_count: The desired number of partitions
+        :type partition_count: int
+        :param max_workers: The maximum number of partitions read at the same time
+        :type max_workers: int
+        :param ordered: Return the entities in document order
+        :type ordered: bool
+
+        :rtype: iterator
+        """
+
+        docs = sorted(self.query(kind, filters), key=lambda doc: doc.id)
+
+        partition_size = max(math.ceil(len(docs) / partition_count), 1)
+        partitions = [docs[i:i + partition_size] for i in range(0, len(docs), partition_size)]
+
+        chunks = read_partitions(partitions, lambda partition: [partition], max_workers, ordered)
+        return (create_response(res_keys, chunk).get('results', []) for chunk in chunks)
+
+    def get_aggregate(self, kind, filters, aggregate, field, group_by):
+        """Returns the count, sum or average of the entities matching the filters
+
+        :param kind: Database kind of entity
+        :type kind: str
+        :param filters: List of query filters
+        :type filters: list
+        :param aggregate: The aggregation: 'count', 'sum' or 'avg'
+        :type aggregate: str
+        :param field: The field to sum or average
+        :type field: str | None
+        :param group_by: The field to group the entities by
+        :type group_by: str | None
+
+        :rtype: int | float | list | None
+        """
+
+        rows = [(get_value(doc.data, field) if field else 1, get_value(doc.data, group_by))
+                for doc in self.query(kind, filters)]
+        return reduce_aggregate(rows, aggregate, group_by)
+
+    def filter_changes(self, change_set, docs):
+        """Filters documents on a change set"""
+        return change_set.filter(
+            docs, lambda doc: doc.id, lambda doc: get_value(doc.data, change_set.field),
+            lambda doc: get_value(doc.data, change_set.tombstone_field))
+
+    def watch_changes(self, kind, filters, publish):
+        """Starts polling for the changes of the documents matching the requested filters, by their change timestamp
+
+        Forced filters are left out of the poller, as it is shared by all subscribers, and applied per subscriber.
+
+        :param kind: Database kind of entity
+        :type kind: str
+        :param filters: List of query filters
+        :type filters: list
+        :param publish: Function publishing a list of change events
+        :type publish: function
+
+        :return: Function stopping the poller
+        :rtype: function
+        """
+
+        settings = g.changes
+
+        # The conditions are compiled within the request, the poller runs outside of it
+        conditions = self.get_conditions([filter for filter in filters or [] if filter['name'] != '_FORCED_FILTER'])
+
+        def poll(changed_since):
+            events = [create_change_event(
+                doc.id, doc.data, get_value(doc.data, settings['field']),
+                bool(settings.get('tombstone_field') and get_value(doc.data, settings['tombstone_field'])))
+                for doc in self.call(lambda: [
+                    doc for doc in list(self.kinds.get(kind, {}).values()) if matches(doc.data, conditions)])]
+
+            return [event for event in events if event['changed'] is not None and event['changed'] >= changed_since]
+
+        return ChangePoller(poll, publish, getattr(config, 'CHANGE_FEED', {}).get('poll_interval', 2)).stop
+
+    def query(self, kind, filters, change_set=None):
+        """Returns the documents of a kind matching the forced filters and requested query filters"""
+
+        conditions = self.get_conditions(filters, change_set)
+
+        return self.call(
+            lambda: [doc for doc in list(self.kinds.get(kind, {}).values()) if matches(doc.data, conditions)],
+            idempotent=True)
+
+    def get_conditions(self, filters, change_set=None):
+        """Returns the conditions of the forced filters and requested query filters"""
+
+        conditions = []
+        args = request.args.to_dict()
+
+        for filter in get_active_filters(filters):
+            conditions.append((filter['field'], COMPARISONS[filter['comparison']], get_filter_value(filter, args)))
+
+        # Changes within the same tick as the watermark are read again, the change set skips those already read
+        if change_set and change_set.changed_since:
+            conditions.append((change_set.field, operator.ge, change_set.changed_since))
+
+        return conditions
+
+
+def matches(entity, conditions):
+    """Returns if an entity matches all conditions, values of another type never match like within Firestore"""
+    for field, comparison, value in conditions:
+        try:
+            if not comparison(get_value(entity, field), value):
+                return False
+        except TypeError:
+            return False
+
+    return True
+
+
+def get_change_stamp():
+    """Returns the change timestamp to write when any path of the table tracks changes"""
+    if not g.get('change_stamp'):
+        return {}
+
+    return {g.change_stamp['field']: datetime.now(timezone.utc)}
+
+
+def get_position(doc, inequality_field):
+    """Returns the position of a document within the ordering of a page query"""
+
+    return [get_value(doc.data, inequality_field), doc.id] if inequality_field else [doc.id]
+
+
+def create_response(keys, data):
+    return create_entity_response(keys, data, lambda doc: doc.id)
@@ -1,16 +1,26 @@
 # flake8: noqa
 
 import config
+import copy
+import os
+import threading
+import time
 import yaml
 import re
 import operator
 import logging
 import json
 
+from flask import g
 from functools import reduce
-from flask import request
+from openapi_spec_validator import validate_v3_spec
 
 OPENAPI_PATH = "openapi_server/openapi/openapi.yaml"
+AGGREGATES = ['count', 'sum', 'avg']
+LIST_BUDGET_FALLBACKS = ['page', 'stream']
+RESERVED_PARAMETERS = ['page_cursor', 'page_size', 'page_action', 'changed_since']
+HTTP_METHODS = ['get', 'put', 'post', 'delete', 'options', 'head', 'patch', 'trace']
+UPDATE_TIME_FIELD = '_update_time'
 
 
 def get_from_dict(data_dict, map_list):
@@ -26,6 +36,13 @@ def get_specification():
     return spec
 
 
+def get_specification_version():
+    """Returns the modification time and size of the OpenAPI specification"""
+    stat = os.stat(OPENAPI_PATH)
+
+    return stat.st_mtime_ns, stat.st_size
+
+
 def transform_url_rule(url_rule):
     """Returns the path from the current request"""
     new_url_rule = str(url_rule).replace('int:', '')
@@ -34,12 +51,22 @@ def transform_url_rule(url_rule):
     return new_url_rule
 
 
-def get_path_schema_reference(path_object, object_type):
+def get_response_content_types(path_object):
+    """Returns the content-types of the first successful response, or None if there is no response"""
+    if 'responses' in path_object:
+        for code in ['200', '201', '202', '203', '204']:
+            if code in path_object['responses']:
+                content = path_object['responses'][code].get('content') if \
+                    isinstance(path_object['responses'][code], dict) else None
+                return list(content) if isinstance(content, dict) else []
+    return None
+
+
+def get_path_schema_reference(path_object, object_type, content_type='application/json'):
     """Returns the schema-reference from the current path item object"""
     if object_type == 'responses' and object_type in path_object:
         for code in ['200', '201', '202', '203', '204']:
             if code in path_object['responses']:
-                content_type = request.content_type if request.content_type else 'application/json'
                 try:
                     route_scheme_ref = get_from_dict(
                         path_object['responses'][code], ['content', content_type, 'schema', '$ref'])
@@ -49,16 +76,36 @@ def get_path_schema_reference(path_object, object_type):
                 else:
                     return route_scheme_ref
     elif object_type == 'requestBody' and object_type in path_object:
-        try:
-            route_scheme_ref = get_from_dict(
-                path_object['requestBody'], ['content', 'application/json', 'schema', '$ref'])
-        except (KeyError, AttributeError, TypeError):
-            pass
-        else:
-            return route_scheme_ref
+        for request_content_type in get_request_content_types(path_object):
+            if not is_json_content_type(request_content_type):
+                continue
+
+            try:
+                route_scheme_ref = get_from_dict(
+                    path_object['requestBody'], ['content', request_content_type, 'schema', '$ref'])
+            except (KeyError, AttributeError, TypeError):
+                pass
+            else:
+                return route_scheme_ref
     return None
 
 
+def get_request_content_types(path_object):
+    """Returns the content-types of the request body, 'application/json' first"""
+    content = path_object['requestBody'].get('content') if \
+        isinstance(path_object.get('requestBody'), dict) else None
+    if not isinstance(content, dict):
+        return []
+
+    return sorted(content, key=lambda content_type: content_type != 'application/json')
+
+
+def is_json_content_type(content_type):
+    """Returns if a content-type is JSON, like 'application/json' or 'application/merge-patch+json'"""
+    return content_type == 'application/json' or (content_type.startswith('application/') and
+                                                   content_type.endswith('+json'))
+
+
 def get_schema(spec, reference):
     """Returns the schema object based on a reference"""
     if reference and re.search(r"(?:#/)(.+)", reference):
@@ -143,6 +190,9 @@ def get_schema_id(spec, schema):
     """Returns the x-db-table-id from a schema"""
     schema_id = None
 
+    if not schema:
+        return schema_id
+
     if 'x-db-table-id' in schema:
         schema_id = schema['x-db-table-id']
     else:
@@ -160,7 +210,7 @@ def get_schema_id(spec, schema):
 def get_request_id(path_item_object):
     """Returns the first request parameter name"""
     if 'parameters' in path_item_object and 'name' in path_item_object['parameters'][0] and \
-            path_item_object['parameters'][0]['name'] not in ['page_cursor', 'page_size', 'page_action'] and \
+            path_item_object['parameters'][0]['name'] not in RESERVED_PARAMETERS and \
             path_item_object['parameters'][0]['in'] == 'path':
         return path_item_object['parameters'][0]['name']
 
@@ -199,11 +249,12 @@ def get_request_query_filters(spec, path_item_object, forced_filters):
     for filter in path_item_object.get('parameters', []):
         filter = get_schema(spec, filter['$ref']) if '$ref' in filter else filter
 
-        if filter['in'] == 'query' and filter['name'] not in ['page_cursor', 'page_size', 'page_action']:
-            for key in ['schema', 'x-query-filter-comparison', 'x-query-filter-field']:
-                if key not in filter:
-                    logging.info(f"Error: query param '{filter['name']}' is missing the required '{key}'")
-                    continue
+        if filter['in'] == 'query' and filter['name'] not in RESERVED_PARAMETERS:
+            missing_keys = [key for key in ['schema', 'x-query-filter-comparison', 'x-query-filter-field'] if
+                            key not in filter]
+            if missing_keys:
+                logging.info(f"Error: query param '{filter['name']}' is missing the required '{missing_keys[0]}'")
+                continue
 
             if filter['x-query-filter-comparison'] not in comparisons:
                 logging.info(
@@ -228,36 +279,256 @@ def get_request_query_filters(spec, path_item_object, forced_filters):
     return query_filters
 
 
-def get_database_info(request):
-    """Returns the all database info"""
-    request_rule = transform_url_rule(request.url_rule)
+def compile_database_info(spec, path_object, request_method, content_type):
+    """Returns the all database info for a path's method and content-type"""
+    path_item_object = path_object[request_method]
+    db_table_name = path_object.get('x-db-table-name', None)
+    forced_filters = path_item_object.get('x-forced-filters', [])
 
-    db_table_name = None
-    db_table_id = None
-    db_keys = None
-    response_keys = None
-    request_id = None
-    request_queries = None
-    forced_filters = []
+    request_id = get_request_id(path_item_object)
+    request_queries = get_request_query_filters(spec, path_item_object, forced_filters)
 
-    spec = get_specification()
-    request_method = str(request.method).lower()
-    path_object = spec.get('paths', {}).get(request_rule, None)
+    db_path_schema = get_schema(spec, get_path_schema_reference(path_item_object, 'requestBody'))
+    db_keys = get_schema_properties(spec, db_path_schema, request_method)
 
-    if path_object and request_method in path_object:
-        path_item_object = path_object[request_method]
-        db_table_name = path_object.get('x-db-table-name', None)
-        forced_filters = path_item_object.get('x-forced-filters', [])
+    response_path_schema = get_schema(spec, get_path_schema_reference(path_item_object, 'responses', content_type))
+    response_keys = get_schema_properties(spec, response_path_schema, request_method)
 
-        request_id = get_request_id(path_item_object)
-        request_queries = get_request_query_filters(spec, path_item_object, forced_filters)
+    db_table_id = get_schema_id(spec, response_path_schema if request_method == 'get' else db_path_schema)
 
-        db_path_schema = get_schema(spec, get_path_schema_reference(path_item_object, 'requestBody'))
-        db_keys = get_schema_properties(spec, db_path_schema, request_method)
+    return db_table_name, db_table_id, db_keys, response_keys, request_id, request_queries, forced_filters
 
-        response_path_schema = get_schema(spec, get_path_schema_reference(path_item_object, 'responses'))
-        response_keys = get_schema_properties(spec, response_path_schema, request_method)
 
-        db_table_id = get_schema_id(spec, response_path_schema if request_method == 'get' else db_path_schema)
+def get_aggregate_settings(method_object):
+    """Returns the aggregation of a path's method, declared with the extensions 'x-aggregate*'"""
+    if 'x-aggregate' not in method_object:
+        return None
 
-    return db_table_name, db_table_id, db_keys, response_keys, request_id, request_queries, forced_filters
+    aggregate = {
+        'aggregate': method_object['x-aggregate'],
+        'field': method_object.get('x-aggregate-field'),
+        'group_by': method_object.get('x-aggregate-group-by')
+    }
+
+    if aggregate['aggregate'] not in AGGREGATES:
+        logging.error(f"Error: aggregation '{aggregate['aggregate']}' is not supported")
+        return None
+
+    if aggregate['aggregate'] != 'count' and not aggregate['field']:
+        logging.error(f"Error: aggregation '{aggregate['aggregate']}' is missing the required 'x-aggregate-field'")
+        return None
+
+    return aggregate
+
+
+def get_change_settings(path_object):
+    """Returns the change tracking of a path, declared with the extensions 'x-changed-since-field' and
+    'x-tombstone-field'
+
+    The update time of an entity can not be queried, so '_UPDATE_TIME' tracks changes in a hidden stored field.
+    """
+    if 'x-changed-since-field' not in path_object:
+        return None
+
+    field = path_object['x-changed-since-field']
+    return {
+        'field': UPDATE_TIME_FIELD if field == '_UPDATE_TIME' else field,
+        'tombstone_field': path_object.get('x-tombstone-field')
+    }
+
+
+def get_table_change_settings(spec):
+    """Returns the change tracking of each table, so writes through any path of a table stamp its change field"""
+    table_changes = {}
+    for path, path_object in spec.get('paths', {}).items():
+        table_name = path_object.get('x-db-table-name')
+        changes = get_change_settings(path_object)
+        if not table_name or not changes:
+            continue
+
+        if table_name in table_changes and table_changes[table_name]['field'] != changes['field']:
+            logging.error(f"Error: path '{path}' tracks the changes of table '{table_name}' in field "
+                          f"'{changes['field']}' instead of '{table_changes[table_name]['field']}'")
+            continue
+
+        table_changes.setdefault(table_name, changes)
+
+    return table_changes
+
+
+def get_list_budget(method_object):
+    """Returns the row and byte budget of a path's method, declared with the extension 'x-list-budget'"""
+    list_budget = method_object.get('x-list-budget')
+    if list_budget is None:
+        return None
+
+    if not isinstance(list_budget, dict) or not isinstance(list_budget.get('max_rows', 0), int):
+        logging.error("Error: 'x-list-budget' is not an object with an integer 'max_rows'")
+        return None
+
+    if list_budget.get('fallback', 'page') not in LIST_BUDGET_FALLBACKS:
+        logging.error(f"Error: list budget fallback '{list_budget['fallback']}' is not supported")
+        return None
+
+    return list_budget
+
+
+class RoutePlan:
+    """The compiled database info of a path's method, for each of its response content-types"""
+
+    def __init__(self, spec, path_object, request_method, table_changes=None):
+        from openapi_server.resolver import get_operation_name  # The resolver imports this module
+
+        self.database_info = {}
+        self.errors = {}
+        self.route_class = path_object[request_method].get('x-route-class')
+        self.aggregate = get_aggregate_settings(path_object[request_method])
+        self.changes = get_change_settings(path_object)
+        self.change_stamp = (table_changes or {}).get(path_object.get('x-db-table-name'), self.changes)
+        self.list_budget = get_list_budget(path_object[request_method])
+
+        content_types = get_response_content_types(path_object[request_method])
+        self.content_type_bound = content_types is not None
+        self.change_feed = get_operation_name(path_object[request_method].get('operationId')) == 'generic_get_changes'
+        self.request_content_types = get_request_content_types(path_object[request_method])
+        self.default_content_type = 'application/json' if not content_types or 'application/json' in content_types \
+            else content_types[0]
+
+        for content_type in (content_types if self.content_type_bound else [None]):
+            # Compiling the schema properties alters the specification, so each content-type gets its own copy
+            try:
+                self.database_info[content_type] = compile_database_info(
+                    copy.deepcopy(spec), path_object, request_method, content_type or 'application/json')
+            except ValueError as e:
+                self.errors[content_type] = (ValueError, str(e))
+            except Exception as e:
+                logging.error(f"Error: method '{request_method}' of a path could not be compiled: {str(e)}")
+                self.errors[content_type] = (RuntimeError, "Database information insufficient")
+
+    def get_database_info(self, content_type):
+        """Returns the database info for a content-type
+
+        The content-type of a request selects the response content-type, e.g. for exports. A request without one, or
+        with a content-type only declared for the request body, gets the default response content-type. A change feed
+        is always streamed as Server-Sent Events, so it ignores the content-type of the request.
+
+        :param content_type: The content-type of the request, or None
+        :type content_type: str | None
+
+        :rtype: tuple
+        """
+        if not self.content_type_bound:
+            content_type = None
+        elif self.change_feed or not content_type or (
+                content_type in self.request_content_types and content_type not in self.database_info and
+                content_type not in self.errors):
+            content_type = self.default_content_type
+
+        if content_type in self.errors:
+            error_type, message = self.errors[content_type]
+            raise error_type(message)
+
+        if content_type not in self.database_info:
+            raise ValueError(f"The content-type '{content_type}' is not found within the specification")
+
+        return self.database_info[content_type]
+
+
+class RoutePlanner:
+    """Compiles the route plans of the OpenAPI specification and swaps them when the specification changes"""
+
+    def __init__(self, reload_interval=None):
+        self.version = get_specification_version()
+        self.plans = self.compile_plans(get_specification())
+        self.reload_interval = reload_interval
+
+        if self.reload_interval:
+            threading.Thread(target=self.watch_specification, daemon=True).start()
+
+    @staticmethod
+    def compile_plans(spec):
+        """Returns a route plan for each path and method within the specification"""
+        plans = {}
+        table_changes = get_table_change_settings(spec)
+        for path, path_object in spec.get('paths', {}).items():
+            for request_method in path_object:
+                if request_method in HTTP_METHODS:
+                    plans[(path, request_method)] = RoutePlan(spec, path_object, request_method, table_changes)
+
+        return plans
+
+    def watch_specification(self):
+        """Checks the specification for changes, outside of any request"""
+        while True:
+            time.sleep(self.reload_interval)
+            self.reload_specification()
+
+    def reload_specification(self):
+        """Swaps the route plans when the specification changed, a specification that is not valid is skipped
+
+        :return: If the changed specification is loaded
+        :rtype: bool
+        """
+        try:
+            version = get_specification_version()
+            if version == self.version:
+                return False
+
+            self.version = version
+
+            spec = get_specification()
+            validate_v3_spec(spec)
+            plans = self.compile_plans(spec)
+        except Exception as e:
+            logging.error(f"The changed OpenAPI specification is not loaded, keeping the active routes: {str(e)}")
+            return False
+
+        self.plans = plans  # Requests that already started keep the plan they retrieved
+        logging.info("The changed OpenAPI specification is loaded")
+
+        return True
+
+    def get_plan(self, path, request_method):
+        return self.plans.get((path, request_method))
+
+
+route_planner = None
+route_planner_lock = threading.Lock()
+
+
+def get_route_planner():
+    """Returns the route planner, compiling the specification on first use"""
+    global route_planner
+
+    if route_planner is None:
+        with route_planner_lock:
+            if route_planner is None:
+                route_planner = RoutePlanner(getattr(config, 'OPENAPI_RELOAD_INTERVAL', None))
+
+    return route_planner
+
+
+def get_route_plan(request):
+    """Returns the route plan of the current request"""
+    return get_route_planner().get_plan(transform_url_rule(request.url_rule), str(request.method).lower())
+
+
+def bind_route_plan(request, plan):
+    """Sets the settings and database info of a route plan as the globals of the current request"""
+    g.route_class = plan.route_class if plan else None
+    g.aggregate = plan.aggregate if plan else None
+    g.changes = plan.changes if plan else None
+    g.change_stamp = plan.change_stamp if plan else None
+    g.list_budget = plan.list_budget if plan else None
+    g.db_table_name, g.db_table_id, g.db_keys, g.response_keys, \
+        g.request_id, g.request_queries, g.forced_filters = get_database_info(request, plan)
+
+
+def get_database_info(request, plan=None):
+    """Returns the all database info"""
+    plan = plan or get_route_plan(request)
+
+    if not plan:
+        return None, None, None, None, None, None, []
+
+    return plan.get_database_info(request.mimetype or None)
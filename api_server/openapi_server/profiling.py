@@ -0,0 +1,205 @@
+import cProfile
+import functools
+import json
+import logging
+import pstats
+import sys
+import threading
+import time
+import uuid
+
+from collections import Counter
+from connexion import context
+from flask import current_app, g, has_app_context, jsonify, make_response, request
+from openapi_server.exportstore import CloudStorageExportStore, LocalExportStore
+
+
+class StackSampler:
+    """Samples the stack of a thread at an interval, counting the collapsed stacks"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+
+            stack = []
+            while frame is not None:
+                stack.append(get_function_name(frame.f_code))
+                frame = frame.f_back
+
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def create_result(self, top):
+        self_samples = Counter()
+        total_samples = Counter()
+
+        for stack, count in self.stacks.items():
+            functions = stack.split(';')
+            self_samples[functions[-1]] += count
+            for function in set(functions):
+                total_samples[function] += count
+
+        return {
+            'samples': sum(self.stacks.values()),
+            'top': [{'function': function, 'self': count, 'total': total_samples[function]}
+                    for function, count in self_samples.most_common(top)],
+            'collapsed': '\n'.join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+        }
+
+
+class DeterministicProfiler:
+    """Profiles every function call of the current thread"""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def create_result(self, top):
+        stats = pstats.Stats(self.profile).stats
+        functions = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+
+        return {
+            'top': [{
+                'function': f"{get_short_filename(filename)}:{name}", 'line': line, 'calls': calls,
+                'self_ms': round(self_time * 1000, 3), 'total_ms': round(total_time * 1000, 3)
+            } for (filename, line, name), (_, calls, self_time, total_time, _) in functions]
+        }
+
+
+class RequestProfiler:
+    """Profiles single requests on demand, when requested with an X-Profile header by a user with the profile scope
+
+    Nothing is registered on the app when the profiler is not configured, so requests have no overhead. The profile
+    starts within the handler of an operation, after connexion authenticated the request.
+    """
+
+    def __init__(self, app=None, scope='profile.admin', mode='sampling', interval=0.005, top=25, output='inline',
+                 directory='/tmp/profiles', bucket=None):
+        self.scope = scope
+        self.mode = mode
+        self.interval = interval
+        self.top = top
+        self.output = output
+
+        if output == 'gcs':
+            self.store = CloudStorageExportStore(bucket, prefix='profiles')
+        elif output == 'local':
+            self.store = LocalExportStore(directory)
+        else:
+            self.store = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['request_profiler'] = self
+        app.after_request(self.finish_profile)
+
+    def is_authorized(self):
+        """Returns if the token connexion validated for the request has the profile scope"""
+
+        token_info = context.get('token_info')
+        if token_info is None:
+            return False
+
+        scopes = token_info.get('scope', token_info.get('scopes', ''))
+        return self.scope in (scopes if isinstance(scopes, list) else scopes.split())
+
+    def start_profile(self):
+        if request.headers.get('X-Profile') != '1' or not self.is_authorized():
+            return
+
+        if self.mode == 'deterministic':
+            g.profiler = DeterministicProfiler()
+        else:
+            g.profiler = StackSampler(threading.get_ident(), self.interval)
+
+        g.profile_start = time.perf_counter()
+        g.profiler.start()
+
+    def finish_profile(self, response):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return response
+
+        profiler.stop()
+
+        profile_id = uuid.uuid4().hex
+        profile = {
+            'id': profile_id,
+            'mode': self.mode,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - g.profile_start) * 1000, 3),
+            # The body of a streamed response is generated after the profile has finished
+            'streamed': response.is_streamed,
+            **profiler.create_result(self.top)
+        }
+
+        logging.info(json.dumps({'request_profile': {
+            key: profile[key] for key in ['id', 'mode', 'method', 'path', 'status', 'duration_ms']}}))
+
+        if self.store is None:
+            return make_response(jsonify(profile), response.status_code)
+
+        self.store.save_file(f"{profile_id}.json", json.dumps(profile).encode(), 'application/json')
+        if 'collapsed' in profile:
+            self.store.save_file(f"{profile_id}.collapsed", profile['collapsed'].encode(), 'text/plain')
+
+        response.headers['X-Profile-Id'] = profile_id
+        return response
+
+
+def profiled(function):
+    """Runs a handler under the request profiler, when the profiler is configured and the request asks for a profile
+
+    :param function: The handler of an operation
+    :type function: function
+
+    :rtype: function
+    """
+
+    @functools.wraps(function)
+    def handler(*args, **kwargs):
+        request_profiler = current_app.extensions.get('request_profiler') if has_app_context() else None
+        if request_profiler is not None and 'profiler' not in g:
+            request_profiler.start_profile()
+
+        return function(*args, **kwargs)
+
+    return handler
+
+
+@functools.lru_cache(maxsize=4096)
+def get_function_name(code):
+    return f"{get_short_filename(code.co_filename)}:{code.co_name}"
+
+
+def get_short_filename(filename):
+    """Returns a filename relative to the Python path it is found in"""
+
+    for path in sorted((path for path in sys.path if path), key=len, reverse=True):
+        if filename.startswith(path):
+            return filename[len(path):].lstrip('/')
+
+    return filename
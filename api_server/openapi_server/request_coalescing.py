@@ -0,0 +1,104 @@
+import copy
+import json
+import logging
+import threading
+
+from flask import g, request
+from openapi_server.controllers.export_controller import get_preferences
+
+
+class InFlightCall:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Shares one in-flight call, and its result, between concurrent callers with the same key"""
+
+    def __init__(self, max_wait=10):
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.metrics = {'calls': 0, 'coalesced': 0, 'timeouts': 0}
+
+    def do(self, key, func):
+        """Returns the result of a function, shared with a concurrent call with the same key if there is one
+
+        :param key: The identity of the call
+        :type key: tuple
+        :param func: The function to call
+        :type func: function
+
+        :return: The result and if it was shared with another call
+        :rtype: tuple
+        """
+
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = self.calls[key] = InFlightCall()
+                self.metrics['calls'] += 1
+
+        if leader:
+            try:
+                call.result = func()
+            except Exception as e:
+                call.error = e
+                raise
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call.done.set()
+
+            return call.result, False
+
+        # Run the call separately when the shared call takes too long
+        if not call.done.wait(self.max_wait):
+            self.count('timeouts')
+            return func(), False
+
+        self.count('coalesced')
+        if call.error is not None:
+            raise copy.copy(call.error)
+
+        return call.result, True
+
+    def count(self, metric):
+        with self.lock:
+            self.metrics[metric] += 1
+            metrics = dict(self.metrics)
+
+        logging.info(json.dumps({'request_coalescing': metrics}))
+
+
+def get_forced_filter_values():
+    """Returns the values of the forced filters of the current request, which differ per user"""
+
+    forced_filter_values = []
+    for forced_filter in g.forced_filters or []:
+        if forced_filter['value'] == '_UPN':
+            forced_filter_values.append(g.get('user'))
+        elif forced_filter['value'] == '_IP':
+            forced_filter_values.append(g.get('ip'))
+
+    return forced_filter_values
+
+
+def get_request_key():
+    """Returns the identity of the current read request, including the values of its forced filters and its
+    preferences, e.g. 'Prefer: ordered' changing the order of an export"""
+
+    return (
+        str(request.url_rule),
+        request.method,
+        tuple(sorted((request.view_args or {}).items())),
+        request.content_type,
+        tuple(sorted(request.args.items(multi=True))),
+        tuple(get_forced_filter_values()),
+        tuple(sorted(set(get_preferences()) - {''}))
+    )
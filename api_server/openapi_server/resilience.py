@@ -0,0 +1,251 @@
+import collections
+import logging
+import math
+import random
+import threading
+import time
+
+from flask import current_app, g, has_app_context
+from google.api_core import exceptions
+from openapi_server.admission_control import create_rejection
+
+# The errors of a backend that is overloaded, unreachable or too slow, which are worth retrying
+TRANSIENT_ERRORS = (
+    exceptions.ServiceUnavailable, exceptions.DeadlineExceeded, exceptions.InternalServerError,
+    exceptions.ResourceExhausted, exceptions.GatewayTimeout, ConnectionError, TimeoutError)
+
+
+class BackendUnavailable(Exception):
+    """Raised when a backend keeps failing, does not respond within the deadline or its circuit is open"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Fails calls to a backend fast once the rate of failed calls within a rolling window is exceeded
+
+    After being open for a while, a single trial call is let through: the circuit closes when it succeeds and opens
+    again when it fails. The trial is held by the thread making the call, until it records an outcome or releases it.
+    """
+
+    def __init__(self, name, failure_rate=0.5, min_calls=20, window=30, open_seconds=30):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.calls = collections.deque()
+        self.failures = 0
+        self.opened = None
+        self.trial = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Returns None when a call is allowed, otherwise the number of seconds until the circuit may close
+
+        :rtype: int | None
+        """
+
+        with self.lock:
+            if self.opened is None:
+                return None
+
+            remaining = self.opened + self.open_seconds - time.monotonic()
+            if remaining > 0:
+                return math.ceil(remaining)
+
+            if self.trial is not None:
+                return 1
+
+            self.trial = threading.get_ident()
+            return None
+
+    def record(self, failed):
+        """Records the outcome of a call
+
+        :param failed: If the call failed with a transient error
+        :type failed: bool
+        """
+
+        now = time.monotonic()
+
+        with self.lock:
+            if self.opened is not None:
+                # Only the trial call decides on an open circuit, calls started before it opened are ignored
+                if self.trial != threading.get_ident():
+                    return
+
+                self.trial = None
+                if failed:
+                    self.opened = now
+                    logging.warning(f"The circuit of backend '{self.name}' opens again after a failed trial call")
+                else:
+                    self.opened = None
+                    self.calls.clear()
+                    self.failures = 0
+                    logging.info(f"The circuit of backend '{self.name}' is closed")
+                return
+
+            self.calls.append((now, failed))
+            self.failures += failed
+            while self.calls and self.calls[0][0] < now - self.window:
+                self.failures -= self.calls.popleft()[1]
+
+            if len(self.calls) >= self.min_calls and self.failures / len(self.calls) >= self.failure_rate:
+                self.opened = now
+                logging.warning(
+                    f"The circuit of backend '{self.name}' opens after {self.failures} of {len(self.calls)} calls "
+                    f"failed within {self.window} seconds")
+
+    def release(self):
+        """Releases the trial held by the current thread without an outcome, so another trial call is let through"""
+
+        with self.lock:
+            if self.trial == threading.get_ident():
+                self.trial = None
+
+
+class Resilience:
+    """Runs the calls to backends within the deadline of the request, with retries and a circuit breaker per backend
+
+    Each request gets a budget of seconds, from which the timeout of each backend call is derived. Idempotent calls
+    are retried on transient errors with an exponential backoff and full jitter, other calls are never retried.
+    Failing backends and an exhausted budget are answered with 503 Service Unavailable. A streamed response renews
+    the budget for each part it reads, as its headers are already sent.
+    """
+
+    def __init__(self, app=None, request_budget=60, operation_timeout=30, timeouts=None, retries=None,
+                 circuit_breaker=None):
+        self.request_budget = request_budget
+        self.operation_timeout = operation_timeout
+        self.timeouts = timeouts or {}
+        self.retries = {'attempts': 3, 'base_delay': 0.1, 'max_delay': 1, **(retries or {})}
+        self.circuit_breaker = circuit_breaker or {}
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['resilience'] = self
+        app.before_request(self.start_request)
+        app.register_error_handler(BackendUnavailable, handle_backend_unavailable)
+
+    def start_request(self):
+        g.request_deadline = time.monotonic() + self.request_budget
+
+    def get_breaker(self, backend):
+        with self.lock:
+            if backend not in self.breakers:
+                self.breakers[backend] = CircuitBreaker(backend, **self.circuit_breaker)
+
+            return self.breakers[backend]
+
+    def get_timeout(self, backend):
+        """Returns the timeout of a call to a backend, which is bounded by the remaining budget of the request
+
+        :param backend: The name of the backend
+        :type backend: str
+
+        :rtype: float
+        """
+
+        timeout = self.timeouts.get(backend, self.operation_timeout)
+
+        deadline = g.get('request_deadline')
+        if deadline is None:
+            return timeout
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise BackendUnavailable("The request did not finish within its deadline")
+
+        return min(timeout, remaining)
+
+    def call(self, backend, func, idempotent):
+        breaker = self.get_breaker(backend)
+        attempts = self.retries['attempts'] if idempotent else 1
+
+        for attempt in range(attempts):
+            timeout = self.get_timeout(backend)
+
+            retry_after = breaker.allow()
+            if retry_after:
+                raise BackendUnavailable(f"The {backend} backend is unavailable", retry_after)
+
+            try:
+                result = func(timeout)
+            except TRANSIENT_ERRORS as e:
+                breaker.record(True)
+                logging.warning(f"A call to the {backend} backend failed (attempt {attempt + 1}): {str(e)}")
+
+                delay = random.uniform(0, min(self.retries['max_delay'], self.retries['base_delay'] * 2 ** attempt))
+                deadline = g.get('request_deadline')
+                if attempt == attempts - 1 or (deadline is not None and time.monotonic() + delay >= deadline):
+                    raise BackendUnavailable(f"The {backend} backend is unavailable") from e
+
+                time.sleep(delay)
+            except Exception:
+                # Any other error is an answer of the backend, which is available
+                breaker.record(False)
+                raise
+            else:
+                breaker.record(False)
+                return result
+            finally:
+                # A call interrupted without an outcome, e.g. by a BaseException, must not keep the trial
+                breaker.release()
+
+
+def call_backend(backend, func, idempotent=False):
+    """Calls a backend within the deadline of the current request, if resilience is configured
+
+    :param backend: The name of the backend, each backend has its own circuit breaker
+    :type backend: str
+    :param func: Function calling the backend, with the timeout in seconds of the call or None as argument
+    :type func: function
+    :param idempotent: If the call can be retried on transient errors
+    :type idempotent: bool
+    """
+
+    resilience = current_app.extensions.get('resilience') if has_app_context() else None
+    if resilience is None:
+        return func(None)
+
+    return resilience.call(backend, func, idempotent)
+
+
+def get_call_options(timeout):
+    """Returns the keyword arguments of a Google Cloud client call for a timeout
+
+    The retries of the client itself are disabled when a timeout is set, as they would not stop at the deadline.
+
+    :param timeout: The timeout in seconds of the call, or None to use the defaults of the client
+    :type timeout: float | None
+
+    :rtype: dict
+    """
+
+    return {} if timeout is None else {'timeout': timeout, 'retry': None}
+
+
+def get_timeout(backend):
+    """Returns the timeout of a call to a backend outside of call_backend, e.g. within worker threads, or None"""
+
+    resilience = current_app.extensions.get('resilience') if has_app_context() else None
+    return resilience.get_timeout(backend) if resilience else None
+
+
+def renew_deadline():
+    """Gives the next part of a streamed response a deadline of its own, if resilience is configured"""
+
+    resilience = current_app.extensions.get('resilience') if has_app_context() else None
+    if resilience is not None:
+        resilience.start_request()
+
+
+def handle_backend_unavailable(e):
+    return create_rejection(503, "Service Unavailable", str(e), e.retry_after)
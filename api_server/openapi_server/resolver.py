@@ -0,0 +1,113 @@
+import functools
+import logging
+import re
+
+from connexion.resolver import Resolution, Resolver
+from flask import g, request
+from openapi_server import openapi_spec
+from openapi_server.profiling import profiled
+
+DEFAULT_CONTROLLER = 'openapi_server.controllers.default_controller'
+
+# The generic operations of the default controller, the longest names first so a suffix is never mistaken for a name
+GENERIC_OPERATIONS = sorted([
+    'generic_get_multiple', 'generic_get_multiple_page', 'generic_get_single', 'generic_post_single',
+    'generic_put_single', 'generic_patch_single', 'generic_get_aggregate', 'generic_get_changes',
+    'generic_get_export', 'generic_get_export_file'], key=len, reverse=True)
+
+# A generic operation's operationId is its name, optionally followed by a number or an underscore and a name
+OPERATION_SUFFIX = re.compile(r'^(\d+|_\w+)?$')
+
+
+class GenericOperationResolver(Resolver):
+    """Resolves each operationId of a generic operation to a handler bound to the route plan of its path's method
+
+    OpenAPI requires unique operationId's, so a generic operation can be used by any number of paths as its name
+    followed by a suffix, e.g. 'generic_get_multiple_pets' or 'generic_get_single2'. Other operations are resolved
+    by their operationId. Each handler can be profiled on demand.
+    """
+
+    def resolve(self, operation):
+        operation_name = get_generic_operation(operation)
+        if operation_name is None:
+            resolution = super().resolve(operation)
+            return Resolution(profiled(resolution.function), resolution.operation_id)
+
+        operation_id = self.resolve_operation_id(operation)
+        function = self.resolve_function_from_operation_id(f"{DEFAULT_CONTROLLER}.{operation_name}")
+
+        logging.debug(f"Operation '{operation.operation_id}' resolves to the generic operation '{operation_name}'")
+        return Resolution(profiled(create_generic_handler(function, operation.path, operation.method)), operation_id)
+
+
+def get_generic_operation(operation):
+    """Returns the name of the generic operation an operation's operationId refers to
+
+    :param operation: The operation to resolve
+    :type operation: connexion.operations.AbstractOperation
+
+    :rtype: str | None
+    """
+
+    if operation.router_controller not in [None, DEFAULT_CONTROLLER]:
+        return None
+
+    return get_operation_name(operation.operation_id)
+
+
+def get_operation_name(operation_id):
+    """Returns the name of the generic operation an operationId refers to, the longest name it starts with
+
+    :param operation_id: The operationId within the specification
+    :type operation_id: str | None
+
+    :rtype: str | None
+    """
+
+    if not operation_id:
+        return None
+
+    for operation_name in GENERIC_OPERATIONS:
+        if operation_id.startswith(operation_name) and OPERATION_SUFFIX.match(operation_id[len(operation_name):]):
+            return operation_name
+
+    return None
+
+
+def create_generic_handler(function, path, method):
+    """Returns a handler running a generic operation with the route plan of a path's method
+
+    The handler holds the key of its route plan instead of the plan itself, so a reloaded specification still applies.
+
+    :param function: The generic operation
+    :type function: function
+    :param path: The path of the operation within the specification
+    :type path: str
+    :param method: The HTTP method of the operation
+    :type method: str
+
+    :rtype: function
+    """
+
+    route_key = (path, method.lower())
+
+    @functools.wraps(function)
+    def handler(*args, **kwargs):
+        try:
+            openapi_spec.bind_route_plan(request, openapi_spec.get_route_planner().get_plan(*route_key))
+        except ValueError as e:
+            g.ip = request.remote_addr
+            g.user = ''
+
+            return str(e), 400
+
+        return function(*args, **kwargs)
+
+    handler.route_key = route_key
+    return handler
+
+
+def is_generic_handler(view_function):
+    """Returns if a view function runs a generic operation, connexion's decorators keep the handler's attributes"""
+
+    return getattr(view_function, 'route_key', None) is not None
@@ -1,16 +1,33 @@
 import logging
+import os
 
-import connexion
+from flask import g, request
 from flask_testing import TestCase
 
-from openapi_server.encoder import JSONEncoder
+from openapi_server import get_app
+
+TEST_USER = 'tester@example.com'
+
+
+def info_from_test_token(token):
+    """Accepts any bearer token within the tests, the token is the user"""
+
+    g.ip = request.remote_addr
+    g.user = token
+    g.token = {'upn': token, 'scopes': ['tests.read', 'tests.edit']}
+
+    return g.token
 
 
 class BaseTestCase(TestCase):
 
     def create_app(self):
         logging.getLogger('connexion.operation').setLevel('ERROR')
-        app = connexion.App(__name__, specification_dir='../openapi/')
-        app.app.json_encoder = JSONEncoder
-        app.add_api('openapi.yaml', pythonic_params=True)
+        app = get_app(specification_dir=os.path.join(os.path.dirname(__file__), 'openapi'))
         return app.app
+
+    @staticmethod
+    def get_headers(user=TEST_USER, **headers):
+        """Returns the headers of a request by a user"""
+
+        return {'Authorization': f"Bearer {user}", **headers}
@@ -0,0 +1,12 @@
+# Configuration of the tests, which run the API with the in-memory database instead of a cloud database
+
+OAUTH_EXPECTED_AUDIENCE = ""
+OAUTH_EXPECTED_ISSUER = ""
+OAUTH_JWKS_URL = ""
+
+BASE_URL = 'https://example.com/'
+ORIGINS = []
+
+DATABASE_TYPE = 'memory'
+MEMORY_DATABASE = {}
+AUDIT_LOGS_NAME = 'AuditLogs'
@@ -0,0 +1,162 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+import time
+import unittest
+
+from flask import Flask
+
+from openapi_server.abstractdatabase import AuditDiff, get_active_filters, has_active_filters, read_partitions, \
+    reduce_aggregate
+
+
+class TestReadPartitions(unittest.TestCase):
+    """Tests reading partitions concurrently through bounded queues"""
+
+    @staticmethod
+    def read_slowly(partition):
+        # The first partitions are the slowest, so they complete last
+        time.sleep(0.01 * (10 - partition[0]))
+        for value in partition:
+            yield [value]
+
+    def test_ordered(self):
+        partitions = [[0, 1], [2, 3], [4, 5], [6, 7], [8, 9]]
+        chunks = list(read_partitions(partitions, self.read_slowly, max_workers=3, ordered=True))
+
+        self.assertEqual(chunks, [[value] for value in range(10)])
+
+    def test_completion_order(self):
+        partitions = [[0, 1], [2, 3], [4, 5], [6, 7], [8, 9]]
+        chunks = list(read_partitions(partitions, self.read_slowly, max_workers=5, ordered=False))
+
+        self.assertEqual(sorted(chunks), [[value] for value in range(10)])
+        self.assertNotEqual(chunks, [[value] for value in range(10)])
+
+    def test_bounded_queue(self):
+        """A reader waits for the consumer once its queue is full, and stops when the consumer closes the generator"""
+
+        read = []
+
+        def reader(partition):
+            for value in range(100):
+                read.append(value)
+                yield [value]
+
+        chunks = read_partitions([None], reader, max_workers=1, ordered=False, queue_size=2)
+        self.assertEqual(next(chunks), [0])
+        time.sleep(0.1)
+        self.assertLessEqual(len(read), 4)
+
+        chunks.close()
+        time.sleep(0.2)
+        self.assertLessEqual(len(read), 5)
+
+    def test_error(self):
+        def reader(partition):
+            if partition == 1:
+                raise ValueError("Partition can not be read")
+            return [[partition]]
+
+        with self.assertRaises(ValueError):
+            list(read_partitions([0, 1, 2], reader, max_workers=2, ordered=True))
+
+
+class TestAuditDiff(unittest.TestCase):
+    """Tests the changes logged per leaf path touched by an update"""
+
+    def test_compare(self):
+        old_data = {'name': 'Rex', 'age': 3, 'owner': {'email': 'owner@example.com', 'address': {'city': 'Utrecht'}}}
+        update_object = {'name': 'Rex', 'age': 4, 'breed': 'Boxer', 'owner': {'address': {'city': 'Zwolle'}}}
+
+        changes = AuditDiff().compare(old_data, update_object)
+
+        self.assertEqual(changes, {
+            'age': {'old': 3, 'new': 4},
+            'breed': {'new': 'Boxer'},
+            'owner.address.city': {'old': 'Utrecht', 'new': 'Zwolle'},
+            'owner.email': {'old': 'owner@example.com', 'new': None}})
+
+        # The entity is compared in place, never altered
+        self.assertEqual(old_data['owner'], {'email': 'owner@example.com', 'address': {'city': 'Utrecht'}})
+
+    def test_compare_type_change(self):
+        """A nested object replacing a value, or the other way around, is logged as a whole"""
+
+        changes = AuditDiff().compare({'owner': 'Unknown', 'tags': {'a': 1}}, {'owner': {'city': 'Zwolle'}, 'tags': []})
+
+        self.assertEqual(changes, {
+            'owner': {'old': 'Unknown', 'new': {'city': 'Zwolle'}},
+            'tags': {'old': {'a': 1}, 'new': []}})
+
+    def test_compare_new_object(self):
+        """A new nested object is logged per leaf, leaves and attributes that stay empty are left out"""
+
+        changes = AuditDiff().compare({}, {'owner': {'address': {'city': 'Zwolle'}, 'email': None}, 'breed': None})
+
+        self.assertEqual(changes, {'owner.address.city': {'new': 'Zwolle'}})
+
+    def test_compare_paths(self):
+        """The field paths of a partial update are compared, a None value removing the field"""
+
+        old_data = {'name': 'Rex', 'owner': {'city': 'Utrecht'}}
+        changes = AuditDiff().compare_paths(old_data, {
+            'name': 'Rex', 'owner.city': 'Zwolle', 'owner.email': 'owner@example.com', 'breed': None, 'age': None})
+
+        self.assertEqual(changes, {
+            'owner.city': {'old': 'Utrecht', 'new': 'Zwolle'},
+            'owner.email': {'new': 'owner@example.com'}})
+
+        changes = AuditDiff().compare_paths(old_data, {'owner': None})
+        self.assertEqual(changes, {'owner': {'old': {'city': 'Utrecht'}, 'new': None}})
+
+
+class TestReduceAggregate(unittest.TestCase):
+    """Tests reducing (value, group) rows to a count, sum or average"""
+
+    def test_count(self):
+        self.assertEqual(reduce_aggregate([(1, None)] * 3, 'count', None), 3)
+        self.assertEqual(reduce_aggregate([], 'count', None), 0)
+        self.assertEqual(reduce_aggregate([(1, 'a'), (1, 'b'), (1, 'a')], 'count', 'group'), [
+            {'group': 'a', 'value': 2}, {'group': 'b', 'value': 1}])
+
+    def test_sum(self):
+        """Values that are not numbers are left out, the result is a Python number"""
+
+        value = reduce_aggregate([(1, None), (2.5, None), ('x', None), (None, None)], 'sum', None)
+        self.assertEqual(value, 3.5)
+        self.assertIsInstance(value, float)
+
+        self.assertEqual(reduce_aggregate([(1, 'a'), (2, 'a'), (4, 'b')], 'sum', 'group'), [
+            {'group': 'a', 'value': 3}, {'group': 'b', 'value': 4}])
+
+    def test_avg(self):
+        self.assertEqual(reduce_aggregate([(1, None), (2, None)], 'avg', None), 1.5)
+        self.assertIsNone(reduce_aggregate([], 'avg', None))
+        self.assertIsNone(reduce_aggregate([('x', None)], 'avg', None))
+
+    def test_group_not_valid(self):
+        with self.assertRaises(ValueError):
+            reduce_aggregate([(1, {'a': 1}), (2, {'b': 2})], 'sum', 'group')
+
+
+class TestActiveFilters(unittest.TestCase):
+
+    def test_active_filters(self):
+        """Forced filters always apply, query filters only when they are requested"""
+
+        forced_filter = {'name': '_FORCED_FILTER', 'field': 'owner.email', 'comparison': '==', 'value': '_UPN'}
+        query_filter = {'name': 'breed', 'field': 'breed', 'comparison': '==', 'value': None}
+
+        with Flask(__name__).test_request_context('/pets?breed=Labrador'):
+            self.assertEqual(get_active_filters([forced_filter, query_filter]), [forced_filter, query_filter])
+            self.assertTrue(has_active_filters([query_filter]))
+
+        with Flask(__name__).test_request_context('/pets'):
+            self.assertEqual(get_active_filters([forced_filter, query_filter]), [forced_filter])
+            self.assertFalse(has_active_filters([query_filter]))
+            self.assertFalse(has_active_filters(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
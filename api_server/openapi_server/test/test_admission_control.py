@@ -0,0 +1,146 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+import unittest
+
+import config
+
+from flask import Response, current_app
+from unittest import mock
+
+from openapi_server.admission_control import AdmissionControl, RouteClassLimiter, TokenBucket
+from openapi_server.test import BaseTestCase
+
+
+class TestRouteClassLimiter(unittest.TestCase):
+
+    def test_queue(self):
+        """A request waits in the queue until a slot is released or its wait takes too long"""
+
+        limiter = RouteClassLimiter(limit=1, queue_size=1, max_wait=0.1)
+
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+        self.assertEqual(limiter.waiting, 0)
+
+        limiter.release()
+        self.assertTrue(limiter.acquire())
+
+    def test_queue_full(self):
+        limiter = RouteClassLimiter(limit=1, queue_size=0, max_wait=5)
+
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_take(self):
+        """A user exceeding its burst waits for the next token, other users are not limited"""
+
+        token_bucket = TokenBucket(rate=0.5, burst=2)
+
+        self.assertIsNone(token_bucket.take('user'))
+        self.assertIsNone(token_bucket.take('user'))
+        self.assertEqual(token_bucket.take('user'), 2)
+        self.assertIsNone(token_bucket.take('other'))
+
+    def test_max_users(self):
+        """The buckets of users at their burst are removed when the maximum number of users is reached"""
+
+        token_bucket = TokenBucket(rate=1, burst=2)
+        token_bucket.MAX_USERS = 2
+
+        token_bucket.take('user')
+        token_bucket.buckets['idle'] = (2, 0)
+        token_bucket.take('other')
+
+        self.assertEqual(set(token_bucket.buckets), {'user', 'other'})
+
+
+class TestAdmissionControl(BaseTestCase):
+    """Tests the admission control of the generic operations"""
+
+    def setUp(self):
+        self.admission_control = AdmissionControl({
+            'limits': {'export': 1, 'single': 1}, 'queue_sizes': {'export': 0, 'single': 0},
+            'user_rate': {'rate': 1, 'burst': 5}})
+        self.patch = mock.patch('openapi_server.admission_control.admission_control', self.admission_control)
+        self.patch.start()
+
+        current_app.db_client.write('Pets', '1', {'name': 'Rex'})
+        for id in range(3):
+            current_app.db_client.write('Owners', str(id), {'name': f"Owner {id}", 'city': 'Utrecht'})
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def test_release(self):
+        """The slot of a response is released when the controller returns, also when it raises an error"""
+
+        limiter = self.admission_control.limiters['single']
+
+        for _ in range(2):
+            response = self.client.get('/pets/1', headers=self.get_headers())
+            self.assert200(response)
+
+        with self.app.test_request_context('/pets/1'):
+            with self.assertRaises(RuntimeError):
+                self.admission_control.run('single', mock.Mock(side_effect=RuntimeError))
+
+        self.assertTrue(limiter.acquire())
+
+    def test_streamed_export(self):
+        """A streamed export holds its slot until the response is closed"""
+
+        with mock.patch.object(config, 'PARTITIONED_EXPORTS', {'partition_count': 2, 'max_workers': 1}, create=True):
+            response = self.client.get('/owners', content_type='text/csv', headers=self.get_headers())
+            self.assert200(response)
+
+            rejected = self.client.get('/owners', content_type='text/csv', headers=self.get_headers())
+            self.assertStatus(rejected, 503)
+            self.assertEqual(rejected.json['detail'], "The capacity for 'export' requests is exhausted")
+            self.assertEqual(rejected.headers['Retry-After'], '1')
+
+            self.assertEqual(len(response.data.decode('utf-8').splitlines()), 4)
+            response.close()
+
+            response = self.client.get('/owners', content_type='text/csv', headers=self.get_headers())
+            self.assert200(response)
+            response.close()
+
+    def test_streamed_response_error(self):
+        """A streamed response of which the body fails still releases its slot when it is closed"""
+
+        def stream():
+            yield 'a'
+            raise RuntimeError("The stream failed")
+
+        limiter = self.admission_control.limiters['export']
+
+        with self.app.test_request_context('/owners'):
+            response = self.admission_control.run('export', lambda: Response(stream()))
+
+        self.assertFalse(limiter.acquire())
+
+        with self.assertRaises(RuntimeError):
+            list(response.response)
+        response.close()
+
+        self.assertTrue(limiter.acquire())
+
+    def test_user_rate(self):
+        """A user exceeding its rate gets a 429 response"""
+
+        for _ in range(5):
+            self.assert200(self.client.get('/pets/1', headers=self.get_headers()))
+
+        response = self.client.get('/pets/1', headers=self.get_headers())
+        self.assertStatus(response, 429)
+        self.assertEqual(response.headers['Retry-After'], '1')
+
+        self.assert200(self.client.get('/pets/1', headers=self.get_headers('other@example.com')))
+
+
+if __name__ == '__main__':
+    unittest.main()
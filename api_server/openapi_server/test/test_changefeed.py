@@ -0,0 +1,101 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+import threading
+import time
+import unittest
+
+import config
+
+from datetime import datetime, timezone
+from flask import current_app
+from unittest import mock
+
+from openapi_server.changefeed import ChangeFeedHub
+from openapi_server.test import BaseTestCase
+
+
+def parse_events(data):
+    """Returns the (event, id, data) of each Server-Sent Event within a stream, leaving out comments"""
+
+    events = []
+    for block in data.decode('utf-8').split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if not line.startswith(':'))
+        if 'event' in fields:
+            events.append((fields['event'], fields.get('id'), fields['data']))
+
+    return events
+
+
+class TestChangeFeed(BaseTestCase):
+    """Tests the change feeds with the polling listener of the memory database"""
+
+    def setUp(self):
+        self.hub = ChangeFeedHub(queue_size=10, max_subscribers=2)
+        settings = {'heartbeat': 0.1, 'max_duration': 0.6, 'poll_interval': 0.05}
+
+        self.patches = [
+            mock.patch.object(config, 'CHANGE_FEED', settings, create=True),
+            mock.patch('openapi_server.controllers.default_controller.change_feed_hub', self.hub)]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def test_live_changes(self):
+        """A change written after subscribing is streamed, whatever the content-type of the request"""
+
+        db_client = current_app.db_client
+
+        def write_later():
+            time.sleep(0.2)
+            db_client.write('Pets', '1', {'name': 'Rex', 'updated': datetime.now(timezone.utc)})
+
+        writer = threading.Thread(target=write_later)
+        writer.start()
+
+        response = self.client.get('/pets/changes', content_type='application/json', headers=self.get_headers())
+        writer.join()
+
+        self.assert200(response, f"Response body is : {response.data.decode('utf-8')}")
+        self.assertEqual(response.mimetype, 'text/event-stream')
+
+        events = parse_events(response.data)
+        self.assertEqual([event for event, _, _ in events], ['ready', 'changes'])
+        self.assertIn('"name": "Rex"', events[1][2])
+
+        # The listener stops once its last subscriber leaves
+        response.close()
+        self.assertEqual(self.hub.feeds, {})
+
+    def test_resume(self):
+        """A client resuming with Last-Event-ID first receives the changes after that event"""
+
+        changed = datetime(2021, 3, 1, 12, tzinfo=timezone.utc)
+        current_app.db_client.write('Pets', '1', {'name': 'Rex', 'updated': changed})
+        current_app.db_client.write('Pets', '2', {'name': 'Bello', 'updated': changed, 'deleted': True})
+
+        response = self.client.get(
+            '/pets/changes', headers=self.get_headers(**{'Last-Event-ID': '2021-03-01T12:00:00.000000Z~1'}))
+        self.assert200(response, f"Response body is : {response.data.decode('utf-8')}")
+
+        events = parse_events(response.data)
+        self.assertEqual([event for event, _, _ in events], ['changes', 'ready'])
+        self.assertEqual(events[0][1], '2021-03-01T12:00:00.000000Z~2')
+        self.assertIn('"results": [], "deleted": ["2"]', events[0][2])
+        response.close()
+
+    def test_max_subscribers(self):
+        """A subscriber beyond the maximum of the worker is rejected"""
+
+        self.hub.max_subscribers = 0
+
+        response = self.client.get('/pets/changes', headers=self.get_headers())
+        self.assertStatus(response, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+import gzip
+import json
+import unittest
+
+import config
+
+from flask import current_app
+from unittest import mock
+
+from openapi_server.compression import ResponseCompression
+from openapi_server.test import BaseTestCase
+
+
+class TestResponseCompression(BaseTestCase):
+    """Tests the compression of responses based on the Accept-Encoding header"""
+
+    def setUp(self):
+        self.compression = ResponseCompression(self.app, min_size=10)
+
+        current_app.db_client.write('Pets', '1', {'name': 'Rex', 'breed': 'Labrador', 'age': 3})
+        for id in range(10):
+            current_app.db_client.write('Owners', str(id), {'name': f"Owner {id}", 'city': 'Utrecht'})
+
+    def test_get_encoding(self):
+        """The supported encoding with the highest quality is preferred"""
+
+        with mock.patch('openapi_server.compression.brotli', object()):
+            self.assertEqual(self.compression.get_encoding('gzip;q=0.5, br'), 'br')
+            self.assertEqual(self.compression.get_encoding('gzip, br;q=0'), 'gzip')
+            self.assertEqual(self.compression.get_encoding('*'), 'br')
+
+        with mock.patch('openapi_server.compression.brotli', None):
+            self.assertEqual(self.compression.get_encoding('br, gzip;q=0.1'), 'gzip')
+            self.assertIsNone(self.compression.get_encoding('br'))
+
+        self.assertIsNone(self.compression.get_encoding('identity'))
+        self.assertIsNone(self.compression.get_encoding('gzip;q=x'))
+
+    def test_compress_response(self):
+        """A response is compressed with gzip and its ETag is weak, which is still accepted within If-Match"""
+
+        response = self.client.get('/pets/1', headers=self.get_headers())
+        self.assert200(response)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        etag = response.headers['ETag']
+        self.assertFalse(etag.startswith('W/'))
+
+        response = self.client.get('/pets/1', headers=self.get_headers(**{'Accept-Encoding': 'gzip'}))
+        self.assert200(response)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['ETag'], f"W/{etag}")
+        self.assertEqual(json.loads(gzip.decompress(response.data))['name'], 'Rex')
+
+        response = self.client.put('/pets/1', json={'name': 'Rex', 'age': 4}, headers=self.get_headers(**{
+            'If-Match': f"W/{etag}"}))
+        self.assertStatus(response, 201)
+
+    def test_min_size(self):
+        """A response smaller than the minimum size is not compressed"""
+
+        self.compression.min_size = 10000
+
+        response = self.client.get('/pets/1', headers=self.get_headers(**{'Accept-Encoding': 'gzip'}))
+        self.assert200(response)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertFalse(response.headers['ETag'].startswith('W/'))
+
+    def test_compress_stream(self):
+        """A streamed response is compressed incrementally"""
+
+        with mock.patch.object(config, 'PARTITIONED_EXPORTS', {'partition_count': 4, 'max_workers': 2}, create=True):
+            response = self.client.get('/owners', content_type='text/csv', headers=self.get_headers(**{
+                'Accept-Encoding': 'gzip', 'Prefer': 'ordered'}))
+
+        self.assert200(response)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', response.headers)
+        rows = gzip.decompress(response.data).decode('utf-8').splitlines()
+        self.assertEqual(rows, ['owner_id;name;city'] + [f"{id};Owner {id};Utrecht" for id in range(10)])
+
+
+if __name__ == '__main__':
+    unittest.main()
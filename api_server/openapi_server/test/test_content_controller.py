@@ -0,0 +1,110 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+import unittest
+
+import pandas as pd
+
+from datetime import datetime, timezone
+from flask import Flask, g
+
+from openapi_server.controllers.content_controller import create_column, create_dataframe, get_entity_keys, \
+    get_export_columns, stream_csv
+
+KEYS = {
+    'pet_id': {'type': 'string', '_target': ['pet_id']},
+    'age': {'type': 'integer', '_target': ['age']},
+    'weight': {'type': 'number', '_target': ['weight']},
+    'neutered': {'type': 'boolean', '_target': ['neutered']},
+    'born': {'type': 'string', 'format': 'date-time', '_target': ['born']},
+    'owner': {'_target': ['owner'], '_properties': {
+        'email': {'type': 'string', '_target': ['email']},
+        'address': {'type': 'object', 'properties': {'city': {'type': 'string'}}}}},
+    '_links': {'type': 'object'}
+}
+
+
+class TestExportColumns(unittest.TestCase):
+    """Tests the columns and dtypes of exported entities"""
+
+    def test_export_columns(self):
+        """Nested objects are flattened to dotted columns, internal keys are skipped"""
+
+        columns = get_export_columns(KEYS)
+
+        self.assertEqual([name for name, _, _ in columns], [
+            'pet_id', 'age', 'weight', 'neutered', 'born', 'owner.email', 'owner.address.city'])
+        self.assertEqual(columns[-1][1], ('owner', 'address', 'city'))
+
+    def test_entity_keys(self):
+        """The keys of a list are those of its results, results without compiled properties have no keys"""
+
+        self.assertEqual(get_entity_keys({'status': {'type': 'string'}, 'results': KEYS}), KEYS)
+        self.assertIsNone(get_entity_keys({'results': {'type': 'array', 'items': {}}}))
+        self.assertEqual(get_entity_keys(KEYS), KEYS)
+        self.assertIsNone(get_entity_keys(None))
+
+    def test_column_dtypes(self):
+        """Integers and booleans are nullable, values not matching their type keep the column as objects"""
+
+        self.assertEqual(str(create_column([1, None], {'type': 'integer'}).dtype), 'Int64')
+        self.assertEqual(str(create_column([1.5, None], {'type': 'number'}).dtype), 'float64')
+        self.assertEqual(str(create_column([True, None], {'type': 'boolean'}).dtype), 'boolean')
+        self.assertEqual(str(create_column(['a', None], {'type': 'string'}).dtype), 'object')
+
+        column = create_column([1, 'two'], {'type': 'integer'})
+        self.assertEqual(str(column.dtype), 'object')
+        self.assertEqual(list(column), [1, 'two'])
+
+    def test_datetime_column(self):
+        """Date-times are converted to the export timezone, without the timezone, dates are kept as they are"""
+
+        column = create_column(
+            ['2021-03-01T12:00:00Z', datetime(2021, 7, 1, 12, tzinfo=timezone.utc), None],
+            {'type': 'string', 'format': 'date-time'})
+        self.assertEqual(list(column[:2]), [pd.Timestamp('2021-03-01 13:00:00'), pd.Timestamp('2021-07-01 14:00:00')])
+        self.assertTrue(pd.isna(column[2]))
+
+        column = create_column(['2021-03-01'], {'type': 'string', 'format': 'date'})
+        self.assertEqual(list(column), [pd.Timestamp('2021-03-01')])
+
+        column = create_column(['not a date'], {'type': 'string', 'format': 'date-time'})
+        self.assertEqual(list(column), ['not a date'])
+
+    def test_create_dataframe(self):
+        """Each schema property is a column, also when no entity has a value for it"""
+
+        df = create_dataframe([
+            {'pet_id': '1', 'age': 3, 'owner': {'email': 'tester@example.com', 'address': {'city': 'Utrecht'}}},
+            {'pet_id': '2', 'weight': 12.5, 'neutered': True, 'owner': None}
+        ], KEYS)
+
+        self.assertEqual(list(df.columns), [name for name, _, _ in get_export_columns(KEYS)])
+        self.assertEqual(str(df['age'].dtype), 'Int64')
+        self.assertEqual(list(df['owner.address.city']), ['Utrecht', None])
+        self.assertTrue(df['born'].isna().all())
+
+    def test_create_dataframe_without_keys(self):
+        """Without schema properties the columns are inferred, with date-times in the export timezone"""
+
+        df = create_dataframe(
+            {'name': 'Rex', 'born': pd.Timestamp('2021-03-01T12:00:00Z'), 'owner': {'city': 'Utrecht'}})
+
+        self.assertEqual(list(df.columns), ['name', 'born', 'owner.city'])
+        self.assertEqual(df['born'][0], pd.Timestamp('2021-03-01 13:00:00'))
+
+
+class TestStreamCSV(unittest.TestCase):
+
+    def test_stream_csv(self):
+        """The header is written once and the pages share the same columns"""
+
+        with Flask(__name__).test_request_context('/pets'):
+            g.response_keys = {'results': {'pet_id': KEYS['pet_id'], 'weight': KEYS['weight']}}
+            rows = ''.join(stream_csv([[{'pet_id': '1', 'weight': 12.5}], [], [{'pet_id': '2'}]])).splitlines()
+
+        self.assertEqual(rows, ['pet_id;weight', '1;12,5', '2;'])
+
+
+if __name__ == '__main__':
+    unittest.main()
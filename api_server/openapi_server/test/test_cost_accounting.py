@@ -0,0 +1,183 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+import json
+import unittest
+
+import config
+
+from flask import Flask, current_app, g
+from unittest import mock
+
+from openapi_server.cost_accounting import CostAccounting, record_costs, track_query
+from openapi_server.test import BaseTestCase
+
+FILTERS = [
+    {'name': 'breed', 'field': 'breed', 'comparison': '==', 'value': 'Boxer'},
+    {'name': 'age', 'field': 'age', 'comparison': '>', 'value': 3},
+    {'name': '_FORCED_FILTER', 'field': 'owner.email', 'comparison': '==', 'value': 'tester@example.com'}
+]
+
+
+def get_log_entries(logs, name):
+    return [json.loads(record.getMessage())[name] for record in logs.records if record.getMessage().startswith(
+        f'{{"{name}"')]
+
+
+class TestCostAccounting(BaseTestCase):
+    """Tests counting the backend costs of each request"""
+
+    def setUp(self):
+        current_app.db_client.write('Pets', '1', {'name': 'Rex', 'breed': 'Boxer', 'age': 3})
+
+        # The memory database does not count costs, a read is charged as the backends charge it
+        get_single = current_app.db_client.get_single
+
+        def get_single_with_costs(*args, **kwargs):
+            record_costs(reads=1, rpcs=1)
+            return get_single(*args, **kwargs)
+
+        patcher = mock.patch.object(current_app.db_client, 'get_single', side_effect=get_single_with_costs)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_header(self):
+        """The costs of a request are returned in a header and logged"""
+
+        CostAccounting(self.app)
+
+        with self.assertLogs(level='INFO') as logs:
+            response = self.client.get('/pets/1', headers=self.get_headers())
+
+        self.assert200(response)
+        self.assertEqual(response.headers['X-Backend-Cost'], 'reads=1, writes=0, index-entries=0, rpcs=1')
+
+        entries = get_log_entries(logs, 'request_costs')
+        self.assertEqual(len(entries), 1)
+        self.assertEqual({key: entries[0][key] for key in ['method', 'path', 'route', 'user', 'status', 'reads']}, {
+            'method': 'GET', 'path': '/pets/1', 'route': '/pets/<pet_id>', 'user': 'tester@example.com',
+            'status': 200, 'reads': 1})
+
+    def test_without_header(self):
+        """The header and the log line can each be turned off"""
+
+        CostAccounting(self.app, header=False)
+
+        with self.assertLogs(level='INFO') as logs:
+            response = self.client.get('/pets/1', headers=self.get_headers())
+
+        self.assert200(response)
+        self.assertNotIn('X-Backend-Cost', response.headers)
+        self.assertEqual(len(get_log_entries(logs, 'request_costs')), 1)
+
+        cost_accounting = self.app.extensions['cost_accounting']
+        cost_accounting.header, cost_accounting.log = True, False
+
+        with mock.patch('logging.info') as log_info:
+            response = self.client.get('/pets/1', headers=self.get_headers())
+
+        self.assertIn('X-Backend-Cost', response.headers)
+        log_info.assert_not_called()
+
+    def test_streamed_response(self):
+        """A streamed response has no header, its costs are logged once its body is read"""
+
+        CostAccounting(self.app)
+        current_app.db_client.write('Owners', '1', {'name': 'Owner 1', 'city': 'Utrecht'})
+
+        with mock.patch.object(config, 'PARTITIONED_EXPORTS', {'partition_count': 2, 'max_workers': 1}, create=True), \
+                self.assertLogs(level='INFO') as logs:
+            response = self.client.get('/owners', content_type='text/csv', headers=self.get_headers())
+            self.assert200(response)
+            self.assertNotIn('X-Backend-Cost', response.headers)
+            response.close()
+
+        self.assertEqual([entry['path'] for entry in get_log_entries(logs, 'request_costs')], ['/owners'])
+
+    def test_slow_query(self):
+        """A slow query is logged with the filters of its request, without their values"""
+
+        CostAccounting(self.app, log=False, slow_query_ms=0)
+
+        with self.app.test_request_context('/pets', query_string={'breed': 'Boxer'}), \
+                self.assertLogs(level='WARNING') as logs:
+            g.request_costs = {'reads': 0, 'writes': 0, 'index_entries': 0, 'rpcs': 0}
+            self.assertEqual(list(track_query(iter(['Rex']), 'Pets', FILTERS, order='age')), ['Rex'])
+
+        entries = get_log_entries(logs, 'slow_query')
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['filters'], [
+            {'name': 'breed', 'field': 'breed', 'comparison': '=='},
+            {'name': '_FORCED_FILTER', 'field': 'owner.email', 'comparison': '=='}])
+        self.assertNotIn('Boxer', json.dumps(entries[0]['filters']))
+        self.assertEqual((entries[0]['kind'], entries[0]['order'], entries[0]['results']), ('Pets', 'age', 1))
+        self.assertFalse(entries[0]['changed_since'])
+        self.assertEqual(entries[0]['path'], '/pets')
+
+    def test_fast_query(self):
+        """A query within the slow query threshold is not logged"""
+
+        CostAccounting(self.app, log=False, slow_query_ms=60000)
+
+        with self.app.test_request_context('/pets'), mock.patch('logging.warning') as log_warning:
+            list(track_query(iter(['Rex']), 'Pets', FILTERS))
+
+        log_warning.assert_not_called()
+
+
+class TestTrackQuery(unittest.TestCase):
+    """Tests counting the costs of the results of a query"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+
+    def track(self, results, **kwargs):
+        with self.app.test_request_context('/pets'):
+            g.request_costs = {'reads': 0, 'writes': 0, 'index_entries': 0, 'rpcs': 0}
+            list(track_query(iter(results), 'Pets', [], **kwargs))
+            return g.request_costs
+
+    def test_reads(self):
+        """Each result is a read, a query issues one RPC by default"""
+
+        self.assertEqual(self.track(['Rex', 'Bello']), {'reads': 2, 'writes': 0, 'index_entries': 0, 'rpcs': 1})
+
+    def test_min_reads(self):
+        """A query is charged its minimum number of reads, also without results"""
+
+        self.assertEqual(self.track([], min_reads=1)['reads'], 1)
+        self.assertEqual(self.track(['Rex', 'Bello'], min_reads=1)['reads'], 2)
+
+    def test_index_entries(self):
+        """Keys and projections are counted as index entries, the number of RPCs is known after the last result"""
+
+        rpcs = mock.Mock(return_value=3)
+        costs = self.track(['Rex', 'Bello'], unit='index_entries', rpcs=rpcs, min_reads=1)
+
+        self.assertEqual(costs, {'reads': 0, 'writes': 0, 'index_entries': 2, 'rpcs': 3})
+        rpcs.assert_called_once_with()
+
+    def test_partially_read(self):
+        """The results that were read are counted when a query is not read to its end"""
+
+        with self.app.test_request_context('/pets'):
+            g.request_costs = {'reads': 0, 'writes': 0, 'index_entries': 0, 'rpcs': 0}
+            results = track_query(iter(['Rex', 'Bello', 'Max']), 'Pets', [])
+            next(results)
+            results.close()
+
+            self.assertEqual(g.request_costs['reads'], 1)
+
+    def test_not_counted(self):
+        """Costs are not recorded outside a request or when they are not counted"""
+
+        record_costs(reads=1)
+
+        with self.app.test_request_context('/pets'):
+            record_costs(reads=1)
+            self.assertIsNone(g.get('request_costs'))
+            self.assertEqual(list(track_query(iter(['Rex']), 'Pets', [])), ['Rex'])
+
+
+if __name__ == '__main__':
+    unittest.main()
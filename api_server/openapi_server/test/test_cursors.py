@@ -0,0 +1,34 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+import unittest
+
+from datetime import datetime, timezone
+from flask import g
+
+from openapi_server.cursors import decode_cursor, encode_cursor
+from openapi_server.test import BaseTestCase
+
+
+class TestCursors(BaseTestCase):
+    """Tests the compact cursors"""
+
+    def test_round_trip(self):
+        with self.app.test_request_context('/pets'):
+            g.db_table_name, g.forced_filters = 'Pets', []
+            position = [datetime(2021, 3, 1, 12, tzinfo=timezone.utc), '1']
+
+            self.assertEqual(decode_cursor(encode_cursor(position)), position)
+
+    def test_unpackable_sort_value(self):
+        """A sort value that can not be packed is left out, the database reads it from the entity at the cursor"""
+
+        with self.app.test_request_context('/pets'):
+            g.db_table_name, g.forced_filters = 'Pets', []
+
+            for value in [{'city': 'Utrecht'}, ['a', 'b'], 2 ** 70, 'x' * 70000]:
+                self.assertEqual(decode_cursor(encode_cursor([value, '1'])), ['1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
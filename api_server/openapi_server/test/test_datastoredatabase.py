@@ -0,0 +1,171 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+import unittest
+
+from flask import g
+from google.api_core.exceptions import ServiceUnavailable
+from google.cloud import datastore
+from unittest import mock
+
+from openapi_server.cursors import CursorKey
+from openapi_server.datastoredatabase import DatastoreDatabase, datastoredatabase
+from openapi_server.resilience import Resilience
+from openapi_server.test import BaseTestCase
+
+RES_KEYS = {'results': {'owner_id': {'_target': ['owner_id']}, 'name': {'_target': ['name']}}}
+AGE_FILTER = {'name': '_FORCED_FILTER', 'field': 'age', 'comparison': '>=', 'value': 0}
+
+
+def create_key(id):
+    return datastore.Key('Owners', id, project='test')
+
+
+def create_entity(id, age):
+    entity = datastore.Entity(key=create_key(id))
+    entity.update({'name': f"Owner {id}", 'age': age})
+    return entity
+
+
+class QueryIterator(list):
+    """Results of a query, which are read within one RPC"""
+
+    page_number = 1
+
+    def __init__(self, results, next_page_token=None):
+        super().__init__(results)
+        self.next_page_token = next_page_token
+
+
+class TestDatastorePages(BaseTestCase):
+    """Tests reading pages of entities in both directions with keyset cursors"""
+
+    def setUp(self):
+        self.db = DatastoreDatabase.__new__(DatastoreDatabase)
+        self.db.db_client = mock.Mock()
+        self.db.db_client.key.side_effect = lambda *path: datastore.Key(*path, project='test')
+
+        self.query = self.db.db_client.query.return_value
+        self.query.add_filter.return_value = self.query
+
+    def get_page(self, entities, page_cursor=None, page_action='next', filters=None):
+        self.query.fetch.return_value = QueryIterator(entities)
+
+        with self.app.test_request_context('/owners'):
+            g.forced_filters, g.db_table_id = [], 'owner_id'
+            return self.db.get_multiple_page('Owners', None, RES_KEYS, filters, page_cursor, 2, page_action)
+
+    def test_first_page(self):
+        """Without an inequality field the entities are ordered by descending key"""
+
+        response = self.get_page([create_entity(id, 0) for id in [9, 8, 7]])
+
+        self.assertEqual([owner['owner_id'] for owner in response['results']], [9, 8])
+        self.assertEqual((response['prev_page'], response['next_page']), (None, [create_key(8)]))
+        self.assertEqual(self.query.order, ['-__key__'])
+        self.assertEqual(self.query.fetch.call_args[1]['limit'], 3)
+
+    def test_prev_page(self):
+        """A previous page is read in the inverted order and reversed"""
+
+        response = self.get_page([create_entity(id, 0) for id in [6, 7, 8]], [CursorKey(('Owners', 5))], 'prev')
+
+        self.assertEqual([owner['owner_id'] for owner in response['results']], [7, 6])
+        self.assertEqual((response['prev_page'], response['next_page']), ([create_key(7)], [create_key(6)]))
+        self.assertEqual(self.query.order, ['__key__'])
+        self.query.add_filter.assert_called_once_with('__key__', '>', create_key(5))
+
+    def test_inequality_field(self):
+        """Entities with the same inequality field value as the cursor are skipped up to and including the cursor"""
+
+        entities = [create_entity(2, 30), create_entity(3, 30), create_entity(4, 30), create_entity(1, 40),
+                    create_entity(5, 50)]
+        response = self.get_page(entities, [30, CursorKey(('Owners', 3))], filters=[AGE_FILTER])
+
+        self.assertEqual([owner['owner_id'] for owner in response['results']], [4, 1])
+        self.assertEqual((response['prev_page'], response['next_page']), ([30, create_key(4)], [40, create_key(1)]))
+        self.assertEqual(self.query.order, ['age', '__key__'])
+        self.query.add_filter.assert_called_with('age', '>=', 30)
+        self.assertIsNone(self.query.fetch.call_args[1]['limit'])
+
+    def test_inequality_field_prev_page(self):
+        entities = [create_entity(2, 30), create_entity(1, 20), create_entity(6, 10)]
+        response = self.get_page(entities, [30, CursorKey(('Owners', 3))], 'prev', filters=[AGE_FILTER])
+
+        self.assertEqual([owner['owner_id'] for owner in response['results']], [1, 2])
+        self.assertEqual((response['prev_page'], response['next_page']), ([20, create_key(1)], [30, create_key(2)]))
+        self.assertEqual(self.query.order, ['-age', '-__key__'])
+        self.query.add_filter.assert_called_with('age', '<=', 30)
+
+    def test_cursor_without_value(self):
+        """A cursor of which the inequality field value could not be packed reads it from the entity at the cursor"""
+
+        self.db.db_client.get.return_value = create_entity(3, 30)
+        response = self.get_page([create_entity(4, 30)], [CursorKey(('Owners', 3))], filters=[AGE_FILTER])
+
+        self.assertEqual([owner['owner_id'] for owner in response['results']], [4])
+        self.db.db_client.get.assert_called_once()
+        self.query.add_filter.assert_called_with('age', '>=', 30)
+
+    def test_cursor_not_valid(self):
+        for page_cursor in [['3'], [CursorKey(('Pets', 3))], [30, 40, CursorKey(('Owners', 3))]]:
+            with self.assertRaisesRegex(ValueError, "Cursor is not valid"):
+                self.get_page([], page_cursor, filters=[AGE_FILTER])
+
+
+class TestDatastoreBatches(BaseTestCase):
+    """Tests reading a whole query in batches, each by a backend call of its own"""
+
+    def setUp(self):
+        self.db = DatastoreDatabase.__new__(DatastoreDatabase)
+        self.db.db_client = mock.Mock()
+        self.query = self.db.db_client.query.return_value
+
+        self.patch = mock.patch.object(datastoredatabase, 'READ_BATCH_SIZE', 2)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def get_multiple(self):
+        with self.app.test_request_context('/owners'):
+            g.forced_filters, g.db_table_id = [], 'owner_id'
+            return self.db.get_multiple('Owners', None, RES_KEYS, [])
+
+    def test_batches(self):
+        """Each batch continues from the cursor of the previous batch, until a batch is not full"""
+
+        self.query.fetch.side_effect = [
+            QueryIterator([create_entity(1, 0), create_entity(2, 0)], 'cursor-1'),
+            QueryIterator([create_entity(3, 0)])]
+
+        response = self.get_multiple()
+
+        self.assertEqual([owner['owner_id'] for owner in response['results']], [1, 2, 3])
+        self.assertEqual([kwargs['start_cursor'] for _, kwargs in self.query.fetch.call_args_list], [None, 'cursor-1'])
+        self.assertEqual([kwargs['limit'] for _, kwargs in self.query.fetch.call_args_list], [2, 2])
+
+    def test_no_entities(self):
+        self.query.fetch.side_effect = [QueryIterator([])]
+
+        self.assertIsNone(self.get_multiple())
+
+    def test_batch_timeout(self):
+        """Each batch gets the timeout of a call and a failed batch is retried from its own cursor"""
+
+        Resilience(self.app, operation_timeout=5, retries={'base_delay': 0})
+
+        self.query.fetch.side_effect = [
+            QueryIterator([create_entity(1, 0), create_entity(2, 0)], 'cursor-1'), ServiceUnavailable("Unavailable"),
+            QueryIterator([create_entity(3, 0)])]
+
+        with self.assertLogs(level='WARNING'):
+            response = self.get_multiple()
+
+        self.assertEqual([owner['owner_id'] for owner in response['results']], [1, 2, 3])
+        self.assertEqual([(kwargs['start_cursor'], kwargs['timeout']) for _, kwargs in self.query.fetch.call_args_list],
+                         [(None, 5), ('cursor-1', 5), ('cursor-1', 5)])
+
+
+if __name__ == '__main__':
+    unittest.main()
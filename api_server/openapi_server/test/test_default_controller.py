@@ -3,6 +3,13 @@
 from __future__ import absolute_import
 import unittest
 
+import config
+
+from datetime import datetime, timezone
+from flask import current_app
+from unittest import mock
+from urllib.parse import urlsplit
+
 from openapi_server.test import BaseTestCase
 
 
@@ -12,6 +19,151 @@ class TestDefaultController(BaseTestCase):
     def test_generic_get_multiple(self):
         pass
 
+    def test_generic_get_multiple_partitioned(self):
+        """Test case for generic_get_multiple, streaming a CSV export as its partitions are read"""
+
+        for id in range(10):
+            current_app.db_client.write('Owners', str(id), {'name': f"Owner {id}", 'city': 'Utrecht'})
+
+        with mock.patch.object(config, 'PARTITIONED_EXPORTS', {'partition_count': 4, 'max_workers': 2}, create=True):
+            response = self.client.get('/owners', content_type='text/csv', headers=self.get_headers())
+            self.assert200(response, f"Response body is : {response.data.decode('utf-8')}")
+            self.assertNotIn('Preference-Applied', response.headers)
+            rows = response.data.decode('utf-8').splitlines()
+            self.assertEqual(len(rows), 11)
+            self.assertEqual(sorted(rows[1:]), sorted(f"{id};Owner {id};Utrecht" for id in range(10)))
+
+            response = self.client.get(
+                '/owners', content_type='text/csv', headers=self.get_headers(Prefer='ordered'))
+            self.assert200(response, f"Response body is : {response.data.decode('utf-8')}")
+            self.assertEqual(response.headers['Preference-Applied'], 'ordered')
+            rows = response.data.decode('utf-8').splitlines()
+            self.assertEqual(rows[1:], [f"{id};Owner {id};Utrecht" for id in range(10)])
+
+    def test_generic_get_multiple_list_budget(self):
+        """Test case for generic_get_multiple, linking to the next page of a list exceeding its budget"""
+
+        for id in range(5):
+            current_app.db_client.write('Owners', str(id), {'name': f"Owner {id}", 'city': 'Utrecht'})
+
+        with mock.patch.object(config, 'LIST_BUDGET', {'max_rows': 3}, create=True), \
+                self.assertLogs(level='INFO') as logs:
+            response = self.client.get('/owners', headers=self.get_headers())
+            self.assert200(response, f"Response body is : {response.data.decode('utf-8')}")
+            self.assertEqual(response.headers['X-Response-Truncated'], 'true')
+            self.assertEqual([owner['owner_id'] for owner in response.json['results']], ['0', '1', '2'])
+            self.assertRegex(response.json['next_page'], r'/owners/pages/[\w-]+\?page_size=3&page_action=next$')
+            self.assertIn(f'"fallback": "page", "pages": 1, "rows": 3, "peak_rows": 3, "bytes": {len(response.data)}',
+                          ''.join(logs.output))
+
+            next_page = urlsplit(response.json['next_page'])
+            response = self.client.get(f"{next_page.path}?{next_page.query}", headers=self.get_headers())
+            self.assert200(response, f"Response body is : {response.data.decode('utf-8')}")
+            self.assertEqual([owner['owner_id'] for owner in response.json['results']], ['3', '4'])
+
+    def test_generic_get_multiple_page_prev(self):
+        """Test case for generic_get_multiple_page, following the next pages to the end and the previous pages back"""
+
+        for id in range(7):
+            current_app.db_client.write('Owners', str(id), {'name': f"Owner {id}", 'city': 'Utrecht'})
+
+        def get_page(url):
+            page = urlsplit(url)
+            response = self.client.get(f"{page.path}?{page.query}", headers=self.get_headers())
+            self.assert200(response, f"Response body is : {response.data.decode('utf-8')}")
+            return response.json, [owner['owner_id'] for owner in response.json['results']]
+
+        with mock.patch.object(config, 'LIST_BUDGET', {'max_rows': 3}, create=True), self.assertLogs(level='INFO'):
+            response = self.client.get('/owners', headers=self.get_headers())
+            self.assertEqual([owner['owner_id'] for owner in response.json['results']], ['0', '1', '2'])
+
+        page, ids = get_page(response.json['next_page'])
+        self.assertEqual(ids, ['3', '4', '5'])
+        self.assertRegex(page['prev_page'], r'/owners/pages/[\w-]+\?page_size=3&page_action=prev$')
+
+        page, ids = get_page(page['next_page'])
+        self.assertEqual(ids, ['6'])
+        self.assertIsNone(page['next_page'])
+
+        page, ids = get_page(page['prev_page'])
+        self.assertEqual(ids, ['3', '4', '5'])
+        self.assertIsNotNone(page['next_page'])
+
+        page, ids = get_page(page['prev_page'])
+        self.assertEqual(ids, ['0', '1', '2'])
+        self.assertIsNone(page['prev_page'])
+
+        page, ids = get_page(page['next_page'])
+        self.assertEqual(ids, ['3', '4', '5'])
+
+    def test_generic_get_multiple_list_budget_stream(self):
+        """Test case for generic_get_multiple, streaming a list exceeding its budget without a path for its pages"""
+
+        for id in range(5):
+            current_app.db_client.write('Owners', str(id), {'name': f"Owner {id}", 'city': 'Utrecht'})
+
+        with mock.patch.object(config, 'LIST_BUDGET', {'max_rows': 2}, create=True), \
+                mock.patch('openapi_server.controllers.default_controller.has_pages_route', return_value=False), \
+                self.assertLogs(level='INFO') as logs:
+            response = self.client.get('/owners', headers=self.get_headers())
+            self.assert200(response, f"Response body is : {response.data.decode('utf-8')}")
+            self.assertNotIn('X-Response-Truncated', response.headers)
+            self.assertEqual([owner['owner_id'] for owner in response.json['results']], ['0', '1', '2', '3', '4'])
+
+        self.assertIn(f'"fallback": "stream", "pages": 3, "rows": 5, "peak_rows": 2, "bytes": {len(response.data)}',
+                      ''.join(logs.output))
+
+    def test_generic_get_multiple_changed_since(self):
+        """Test case for generic_get_multiple, returning changes within the same tick as the watermark"""
+
+        changed = datetime(2021, 3, 1, 12, tzinfo=timezone.utc)
+        current_app.db_client.write('Pets', '1', {'name': 'Rex', 'updated': changed})
+
+        response = self.client.get('/pets', headers=self.get_headers())
+        self.assert200(response, f"Response body is : {response.data.decode('utf-8')}")
+        self.assertEqual(response.json['watermark'], '2021-03-01T12:00:00.000000Z~1')
+        self.assertEqual(response.headers['X-Watermark'], response.json['watermark'])
+
+        current_app.db_client.write('Pets', '2', {'name': 'Bello', 'updated': changed})
+
+        response = self.client.get(
+            '/pets', query_string={'changed_since': response.json['watermark']}, headers=self.get_headers())
+        self.assert200(response, f"Response body is : {response.data.decode('utf-8')}")
+        self.assertEqual([pet['name'] for pet in response.json['results']], ['Bello'])
+        self.assertEqual(response.json['watermark'], '2021-03-01T12:00:00.000000Z~2')
+
+        response = self.client.get(
+            '/pets', query_string={'changed_since': '2021-03-01T12:00:00.000000Z'}, headers=self.get_headers())
+        self.assertEqual(sorted(pet['name'] for pet in response.json['results']), ['Bello', 'Rex'])
+
+    def test_generic_get_aggregate(self):
+        """Test case for generic_get_aggregate, counting the entities matching the query parameters"""
+
+        for id, breed in enumerate(['Boxer', 'Beagle', 'Boxer']):
+            current_app.db_client.write('Pets', str(id), {'name': f"Pet {id}", 'breed': breed})
+
+        response = self.client.get('/pets/count', headers=self.get_headers())
+        self.assert200(response, f"Response body is : {response.data.decode('utf-8')}")
+        self.assertEqual(response.json, {'aggregate': 'count', 'value': 3})
+
+        response = self.client.get('/pets/count', query_string={'breed': 'Boxer'}, headers=self.get_headers())
+        self.assertEqual(response.json['value'], 2)
+
+    def test_generic_get_aggregate_group_by(self):
+        """Test case for generic_get_aggregate, averaging a field per group, leaving out values that are not numbers"""
+
+        pets = [('Boxer', 4), ('Beagle', 2), ('Boxer', 6), ('Beagle', 'unknown'), (None, 1)]
+        for id, (breed, age) in enumerate(pets):
+            current_app.db_client.write('Pets', str(id), {'name': f"Pet {id}", 'breed': breed, 'age': age})
+
+        response = self.client.get('/pets/age', headers=self.get_headers())
+        self.assert200(response, f"Response body is : {response.data.decode('utf-8')}")
+        self.assertEqual(response.json['aggregate'], 'avg')
+        self.assertEqual(response.json['field'], 'age')
+        self.assertEqual(response.json['group_by'], 'breed')
+        self.assertEqual(sorted(response.json['results'], key=lambda result: str(result['group'])), [
+            {'group': 'Beagle', 'value': 2.0}, {'group': 'Boxer', 'value': 5.0}, {'group': None, 'value': 1.0}])
+
     def test_generic_get_single(self):
         pass
 
@@ -19,7 +171,51 @@ class TestDefaultController(BaseTestCase):
         pass
 
     def test_generic_put_single(self):
-        pass
+        """Test case for generic_put_single, stamping the change field of the table on a path without change tracking"""
+
+        current_app.db_client.write('Pets', '1', {'name': 'Rex'})
+
+        response = self.client.put('/pets/1', json={'name': 'Rex', 'age': 3}, headers=self.get_headers())
+        self.assertStatus(response, 201, f"Response body is : {response.data.decode('utf-8')}")
+
+        self.assertIsInstance(current_app.db_client.kinds['Pets']['1'].data.get('updated'), datetime)
+
+    def test_generic_put_single_audit_log(self):
+        """Test case for generic_put_single, auditing the fields it changes or empties"""
+
+        current_app.db_client.write('Pets', '1', {'name': 'Rex', 'age': 3, 'breed': 'Boxer'})
+
+        response = self.client.put('/pets/1', json={'name': 'Rex', 'age': 4}, headers=self.get_headers())
+        self.assertStatus(response, 201, f"Response body is : {response.data.decode('utf-8')}")
+
+        audit_logs = [doc.data for doc in current_app.db_client.kinds['AuditLogs'].values()]
+        self.assertEqual(len(audit_logs), 1)
+        self.assertEqual(audit_logs[0]['attributes_changed'], {
+            'age': {'old': 3, 'new': 4},
+            'breed': {'old': 'Boxer', 'new': None}})
+        self.assertEqual(audit_logs[0]['user'], 'tester@example.com')
+
+    def test_generic_patch_single(self):
+        """Test case for generic_patch_single, which only writes and audits the paths within the merge-patch"""
+
+        current_app.db_client.write('Pets', '1', {
+            'name': 'Rex', 'breed': 'Boxer', 'owner': {'email': 'owner@example.com', 'city': 'Utrecht'}})
+
+        for content_type in ['application/merge-patch+json', 'application/json']:
+            response = self.client.patch(
+                '/pets/1', data='{"owner": {"city": "Zwolle"}}', content_type=content_type,
+                headers=self.get_headers())
+            self.assert200(response, f"Response body is : {response.data.decode('utf-8')}")
+
+        data = dict(current_app.db_client.kinds['Pets']['1'].data)
+        self.assertIsInstance(data.pop('updated'), datetime)
+        self.assertEqual(data, {
+            'name': 'Rex', 'breed': 'Boxer', 'owner': {'email': 'owner@example.com', 'city': 'Zwolle'}})
+
+        audit_logs = [doc.data for doc in current_app.db_client.kinds['AuditLogs'].values()]
+        self.assertEqual(len(audit_logs), 1)
+        self.assertEqual(audit_logs[0]['attributes_changed'], {'owner.city': {'old': 'Utrecht', 'new': 'Zwolle'}})
+        self.assertEqual(audit_logs[0]['table_id'], '1')
 
 
 if __name__ == '__main__':
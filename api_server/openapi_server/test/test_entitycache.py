@@ -0,0 +1,71 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+import pickle
+import unittest
+
+from datetime import datetime, timezone
+
+from openapi_server.entitycache.entitycache import LocalEntityCache, RedisEntityCache
+
+
+class FakeRedis:
+    """Keeps the values of a Redis server in a dict"""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def setex(self, key, ttl, value):
+        self.values[key] = value.encode() if isinstance(value, str) else value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+class TestEntityCache(unittest.TestCase):
+    """Tests the entity caches"""
+
+    def create_redis_cache(self):
+        cache = RedisEntityCache.__new__(RedisEntityCache)
+        cache.ttl, cache.kinds, cache.prefix, cache.client = 60, None, 'entities', FakeRedis()
+        return cache
+
+    def test_redis_json(self):
+        cache = self.create_redis_cache()
+        entity = {'name': 'Rex', 'owner': {'city': 'Utrecht'}, 'updated': datetime(2021, 3, 1, 12, tzinfo=timezone.utc)}
+
+        cache.set('Pets', 1, entity, 'v1')
+
+        self.assertEqual(cache.get('Pets', '1'), (entity, 'v1'))
+        self.assertTrue(cache.client.values['entities:Pets:1'].startswith(b'[{"name": "Rex"'))
+
+    def test_redis_pickle_is_not_loaded(self):
+        cache = self.create_redis_cache()
+        cache.client.values['entities:Pets:1'] = pickle.dumps(({'name': 'Rex'}, 'v1'))
+
+        with self.assertLogs(level='WARNING'):
+            self.assertIsNone(cache.get('Pets', '1'))
+
+    def test_redis_unsupported_value(self):
+        cache = self.create_redis_cache()
+
+        with self.assertLogs(level='WARNING'):
+            cache.set('Pets', '1', {'name': 'Rex', 'tags': {'a', 'b'}}, 'v1')
+        self.assertIsNone(cache.get('Pets', '1'))
+
+    def test_local_id_types(self):
+        """An entity cached under its numeric identifier is found and deleted under the identifier from a path"""
+
+        cache = LocalEntityCache()
+        cache.set('Pets', 1, {'name': 'Rex'}, 'v1')
+        self.assertEqual(cache.get('Pets', '1'), ({'name': 'Rex'}, 'v1'))
+
+        cache.delete('Pets', '1')
+        self.assertIsNone(cache.get('Pets', 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+import json
+import shutil
+import tempfile
+import unittest
+
+import config
+
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from unittest import mock
+
+from openapi_server.controllers import export_controller
+from openapi_server.exportstore import LocalExportStore
+from openapi_server.test import BaseTestCase
+
+
+class TestExportController(BaseTestCase):
+    """Tests the export jobs with a local export store"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = LocalExportStore(self.directory)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        self.patches = [
+            mock.patch.object(config, 'EXPORT_JOBS', {'directory': self.directory, 'page_size': 2}, create=True),
+            mock.patch.object(export_controller, 'export_store', self.store),
+            mock.patch.object(export_controller, 'export_executor', self.executor)]
+        for patch in self.patches:
+            patch.start()
+
+        for id in range(3):
+            current_app.db_client.write('Owners', str(id), {'name': f"Owner {id}", 'city': 'Utrecht'})
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+        self.executor.shutdown()
+        shutil.rmtree(self.directory)
+
+    def start_export(self, content_type='text/csv'):
+        """Starts an export job of the owners and returns its identifier once it has run"""
+
+        response = self.client.get(
+            '/owners', content_type=content_type, headers=self.get_headers(Prefer='respond-async'))
+        self.assertStatus(response, 202)
+        self.assertEqual(response.headers['Preference-Applied'], 'respond-async')
+        self.assertEqual(response.headers['Location'], f"https://example.com/exports/{response.json['id']}")
+        self.assertEqual(response.json['status'], 'pending')
+
+        self.executor.shutdown(wait=True)
+        return response.json['id']
+
+    def test_export_csv(self):
+        """A finished CSV export has its rows, a download URL and its file"""
+
+        export_id = self.start_export()
+
+        response = self.client.get(f"/exports/{export_id}", headers=self.get_headers())
+        self.assert200(response, f"Response body is : {response.data.decode('utf-8')}")
+        self.assertEqual(response.json['status'], 'finished')
+        self.assertEqual(response.json['rows'], 3)
+        self.assertEqual(response.json['download_url'], f"https://example.com/exports/{export_id}/file")
+
+        response = self.client.get(f"/exports/{export_id}/file", headers=self.get_headers())
+        self.assert200(response)
+        self.assertEqual(response.headers['Content-Type'], 'text/csv')
+        self.assertRegex(response.headers['Content-Disposition'], r'^attachment; filename=Owners_\d{8}T\d{6}Z\.csv$')
+        self.assertEqual(response.data.decode('utf-8').splitlines(), [
+            'owner_id;name;city', '0;Owner 0;Utrecht', '1;Owner 1;Utrecht', '2;Owner 2;Utrecht'])
+
+    def test_export_json(self):
+        """A JSON export is written page by page as well"""
+
+        export_id = self.start_export('application/json')
+
+        response = self.client.get(f"/exports/{export_id}/file", headers=self.get_headers())
+        self.assert200(response)
+        self.assertEqual([owner['owner_id'] for owner in json.loads(response.data)['results']], ['0', '1', '2'])
+
+    def test_export_progress(self):
+        """The number of rows of a running export is updated after each page it has read"""
+
+        saved_rows = []
+        save_status = self.store.save_status
+
+        def record_status(export_id, status):
+            saved_rows.append((status['status'], status['rows']))
+            save_status(export_id, status)
+
+        with mock.patch.object(self.store, 'save_status', record_status):
+            self.start_export()
+
+        self.assertEqual(saved_rows, [('pending', 0), ('running', 0), ('running', 2), ('running', 3), ('finished', 3)])
+
+    def test_export_owner(self):
+        """An export job can only be retrieved by the user that started it"""
+
+        export_id = self.start_export()
+
+        response = self.client.get(f"/exports/{export_id}", headers=self.get_headers('other@example.com'))
+        self.assert404(response)
+
+        response = self.client.get(f"/exports/{export_id}/file", headers=self.get_headers('other@example.com'))
+        self.assert404(response)
+
+    def test_export_failed(self):
+        """An export failing to read its entities is marked as failed"""
+
+        with mock.patch.object(current_app.db_client, 'get_multiple_page', side_effect=RuntimeError("Unavailable")), \
+                self.assertLogs(level='ERROR'):
+            export_id = self.start_export()
+
+        response = self.client.get(f"/exports/{export_id}", headers=self.get_headers())
+        self.assert200(response)
+        self.assertEqual(response.json['status'], 'failed')
+        self.assertNotIn('download_url', response.json)
+
+        response = self.client.get(f"/exports/{export_id}/file", headers=self.get_headers())
+        self.assert404(response)
+
+
+if __name__ == '__main__':
+    unittest.main()
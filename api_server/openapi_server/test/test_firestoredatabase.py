@@ -0,0 +1,268 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+import unittest
+
+from datetime import datetime, timedelta, timezone
+from flask import g
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.api_core.exceptions import FailedPrecondition, ServiceUnavailable
+from google.cloud.firestore_v1.field_path import FieldPath
+from unittest import mock
+
+from openapi_server.abstractdatabase import PreconditionFailed, create_etag
+from openapi_server.entitycache.entitycache import LocalEntityCache
+from openapi_server.firestoredatabase import FirestoreDatabase, firestoredatabase
+from openapi_server.resilience import Resilience
+from openapi_server.test import BaseTestCase
+
+RES_KEYS = {'results': {'owner_id': {'_target': ['owner_id']}, 'name': {'_target': ['name']}}}
+UPDATE_TIME = DatetimeWithNanoseconds.from_rfc3339('2021-03-01T12:00:00.123456Z')
+NEW_UPDATE_TIME = DatetimeWithNanoseconds.from_rfc3339('2021-03-01T12:00:01.000000Z')
+
+
+class TestFirestoreDatabase(BaseTestCase):
+    """Tests updating Firestore documents with the update time within the If-Match header as write precondition"""
+
+    def setUp(self):
+        self.db = FirestoreDatabase.__new__(FirestoreDatabase)
+        self.db.db_client = mock.Mock()
+        self.db.entity_cache = LocalEntityCache()
+
+        self.doc_ref = self.db.db_client.collection.return_value.document.return_value
+        self.doc_ref.id = '1'
+        self.doc_ref.parent.id = 'Pets'
+        self.doc_ref.get.return_value = self.create_doc({'name': 'Rex', 'age': 4}, NEW_UPDATE_TIME)
+
+    def create_doc(self, data, update_time):
+        doc = mock.Mock(exists=True, id='1', update_time=update_time, reference=self.doc_ref)
+        doc.to_dict.return_value = data
+        return doc
+
+    def put(self, etag):
+        with self.app.test_request_context('/pets/1', method='PUT', headers={'If-Match': etag}):
+            g.forced_filters, g.db_table_id, g.user = [], 'pet_id', 'tester@example.com'
+            keys = {'name': {'_target': ['name']}, 'age': {'_target': ['age']}}
+            return self.db.put_single('1', {'name': 'Rex', 'age': 4}, 'Pets', keys, keys), g.get('etag')
+
+    def test_etag_is_update_time(self):
+        self.assertEqual(create_etag(UPDATE_TIME.rfc3339()), '"MjAyMS0wMy0wMVQxMjowMDowMC4xMjM0NTZa"')
+
+    def test_put_cached_version(self):
+        """The cached version of the If-Match header is written with its update time as precondition, without a read"""
+
+        self.db.entity_cache.set('Pets', '1', {'name': 'Rex', 'age': 3}, UPDATE_TIME.rfc3339())
+
+        response, etag = self.put(create_etag(UPDATE_TIME.rfc3339()))
+
+        self.assertEqual(response, {'name': 'Rex', 'age': 4})
+        self.assertEqual(etag, create_etag(NEW_UPDATE_TIME.rfc3339()))
+        self.db.db_client.write_option.assert_called_once_with(last_update_time=UPDATE_TIME)
+        self.assertEqual(self.doc_ref.update.call_count, 1)
+        self.assertEqual(self.doc_ref.get.call_count, 1)  # Only the updated document is read back
+
+    def test_put_changed_version(self):
+        self.db.entity_cache.set('Pets', '1', {'name': 'Rex', 'age': 3}, UPDATE_TIME.rfc3339())
+        self.doc_ref.update.side_effect = FailedPrecondition("The update time does not match")
+
+        with self.assertRaises(PreconditionFailed):
+            self.put(create_etag(UPDATE_TIME.rfc3339()))
+
+        self.assertEqual(self.doc_ref.update.call_count, 1)
+        self.assertIsNone(self.db.entity_cache.get('Pets', '1'))
+
+    def test_put_uncached_version(self):
+        """Without the cached version the audit log needs the existing document, which is read first"""
+
+        self.doc_ref.get.side_effect = [
+            self.create_doc({'name': 'Rex', 'age': 3}, UPDATE_TIME),
+            self.create_doc({'name': 'Rex', 'age': 4}, NEW_UPDATE_TIME)]
+
+        with mock.patch.object(self.db, 'process_audit_logging') as process_audit_logging:
+            response, etag = self.put(create_etag(UPDATE_TIME.rfc3339()))
+
+        self.assertEqual(etag, create_etag(NEW_UPDATE_TIME.rfc3339()))
+        self.db.db_client.write_option.assert_called_once_with(last_update_time=UPDATE_TIME)
+        process_audit_logging.assert_called_once_with(changes={'age': {'old': 3, 'new': 4}}, entity_id='1')
+
+    def test_watch_changes_since_start(self):
+        """The change feed listener only queries the documents changed since it started"""
+
+        collection = self.db.db_client.collection.return_value
+        with self.app.test_request_context('/pets/changes'):
+            g.changes = {'field': 'updated', 'tombstone_field': 'deleted'}
+            self.db.watch_changes('Pets', [], mock.Mock())
+
+        field, comparison, since = collection.where.call_args[0]
+        self.assertEqual((field, comparison), ('updated', '>='))
+        self.assertLess(datetime.now(timezone.utc) - since, timedelta(seconds=61))
+        collection.where.return_value.on_snapshot.assert_called_once()
+
+
+class TestFirestorePages(BaseTestCase):
+    """Tests reading pages of documents in both directions with keyset cursors"""
+
+    def setUp(self):
+        self.db = FirestoreDatabase.__new__(FirestoreDatabase)
+        self.db.db_client = mock.Mock()
+
+        self.query = mock.Mock()
+        for method in ['order_by', 'start_after', 'end_before', 'limit', 'limit_to_last']:
+            getattr(self.query, method).return_value = self.query
+        self.db.create_db_query = mock.Mock(return_value=self.query)
+
+    def create_docs(self, *ids):
+        docs = []
+        for id in ids:
+            data = {'name': f"Owner {id}", 'age': int(id) * 10}
+            doc = mock.Mock(id=id)
+            doc.to_dict.return_value = data
+            doc.get.side_effect = data.__getitem__
+            docs.append(doc)
+
+        return docs
+
+    def get_page(self, page_cursor=None, page_action='next', filters=None):
+        with self.app.test_request_context('/owners'):
+            g.forced_filters, g.db_table_id = [], 'owner_id'
+            return self.db.get_multiple_page('Owners', None, RES_KEYS, filters, page_cursor, 2, page_action)
+
+    def get_order(self):
+        return [args[0] for args, _ in self.query.order_by.call_args_list]
+
+    def test_first_page(self):
+        """One document more than the page size is read to know there is a next page"""
+
+        self.query.stream.return_value = iter(self.create_docs('1', '2', '3'))
+
+        response = self.get_page()
+
+        self.assertEqual([owner['owner_id'] for owner in response['results']], ['1', '2'])
+        self.assertEqual((response['prev_page'], response['next_page']), (None, ['2']))
+        self.assertEqual(self.get_order(), [FieldPath.document_id()])
+        self.query.limit.assert_called_once_with(3)
+        self.query.start_after.assert_not_called()
+
+    def test_next_page(self):
+        self.query.stream.return_value = iter(self.create_docs('3', '4'))
+
+        response = self.get_page(['2'])
+
+        self.assertEqual([owner['owner_id'] for owner in response['results']], ['3', '4'])
+        self.assertEqual((response['prev_page'], response['next_page']), (['3'], None))
+        self.query.start_after.assert_called_once_with(['2'])
+
+    def test_prev_page(self):
+        """A previous page is read with the reversed limit, which returns the documents in their original order"""
+
+        self.query.get.return_value = self.create_docs('3', '4', '5')
+
+        response = self.get_page(['6'], 'prev')
+
+        self.assertEqual([owner['owner_id'] for owner in response['results']], ['4', '5'])
+        self.assertEqual((response['prev_page'], response['next_page']), (['4'], ['5']))
+        self.query.end_before.assert_called_once_with(['6'])
+        self.query.limit_to_last.assert_called_once_with(3)
+        self.query.stream.assert_not_called()
+
+    def test_prev_first_page(self):
+        self.query.get.return_value = self.create_docs('1', '2')
+
+        response = self.get_page(['3'], 'prev')
+
+        self.assertEqual([owner['owner_id'] for owner in response['results']], ['1', '2'])
+        self.assertEqual((response['prev_page'], response['next_page']), (None, ['2']))
+
+    def test_inequality_field(self):
+        """The inequality field is ordered first and is part of the cursors"""
+
+        filters = [{'name': '_FORCED_FILTER', 'field': 'age', 'comparison': '>=', 'value': 0}]
+        self.query.stream.return_value = iter(self.create_docs('4', '5', '6'))
+
+        response = self.get_page([30, '3'], filters=filters)
+
+        self.assertEqual(self.get_order(), ['age', FieldPath.document_id()])
+        self.query.start_after.assert_called_once_with([30, '3'])
+        self.assertEqual((response['prev_page'], response['next_page']), ([40, '4'], [50, '5']))
+
+        with self.assertRaisesRegex(ValueError, "Cursor is not valid"):
+            self.get_page(['2', '3'], filters=[])
+
+        with self.assertRaisesRegex(ValueError, "Cursor is not valid"):
+            self.get_page([30, '3', '4'], filters=filters)
+
+
+class TestFirestoreBatches(BaseTestCase):
+    """Tests reading a whole query in batches, each by a backend call of its own"""
+
+    def setUp(self):
+        self.db = FirestoreDatabase.__new__(FirestoreDatabase)
+        self.db.db_client = mock.Mock()
+
+        self.query = mock.Mock()
+        self.query.limit.return_value = self.query
+        self.query.start_after.return_value = self.query
+        self.db.create_db_query = mock.Mock(return_value=self.query)
+
+        self.patch = mock.patch.object(firestoredatabase, 'READ_BATCH_SIZE', 2)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def create_docs(self, *ids):
+        docs = []
+        for id in ids:
+            doc = mock.Mock(id=id)
+            doc.to_dict.return_value = {'name': f"Owner {id}"}
+            docs.append(doc)
+
+        return docs
+
+    def get_multiple(self):
+        with self.app.test_request_context('/owners'):
+            g.forced_filters, g.db_table_id = [], 'owner_id'
+            return self.db.get_multiple('Owners', None, RES_KEYS, [])
+
+    def test_batches(self):
+        """Each batch starts after the last document of the previous batch, until a batch is not full"""
+
+        docs = self.create_docs('1', '2', '3', '4', '5')
+        self.query.stream.side_effect = [iter(docs[:2]), iter(docs[2:4]), iter(docs[4:])]
+
+        response = self.get_multiple()
+
+        self.assertEqual([owner['owner_id'] for owner in response['results']], ['1', '2', '3', '4', '5'])
+        self.assertEqual([args[0] for args, _ in self.query.start_after.call_args_list], [docs[1], docs[3]])
+        self.assertEqual(self.query.stream.call_count, 3)
+
+    def test_empty_batch(self):
+        """A query with a multiple of the batch size reads one empty batch to know it is complete"""
+
+        self.query.stream.side_effect = [iter(self.create_docs('1', '2')), iter([])]
+
+        self.assertEqual([owner['owner_id'] for owner in self.get_multiple()['results']], ['1', '2'])
+        self.assertEqual(self.query.stream.call_count, 2)
+
+        self.query.stream.side_effect = [iter([])]
+        self.assertEqual(self.get_multiple(), {'results': []})
+
+    def test_batch_timeout(self):
+        """Each batch gets the timeout of a call and a failed batch is retried by itself"""
+
+        Resilience(self.app, operation_timeout=5, retries={'base_delay': 0})
+
+        docs = self.create_docs('1', '2', '3')
+        self.query.stream.side_effect = [iter(docs[:2]), ServiceUnavailable("Unavailable"), iter(docs[2:])]
+
+        with self.assertLogs(level='WARNING'):
+            response = self.get_multiple()
+
+        self.assertEqual([owner['owner_id'] for owner in response['results']], ['1', '2', '3'])
+        self.assertEqual([kwargs for _, kwargs in self.query.stream.call_args_list],
+                         [{'timeout': 5, 'retry': None}] * 3)
+        self.query.start_after.assert_called_once_with(docs[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+import pickle
+import unittest
+
+from openapi_server.idempotencystore.idempotencystore import RedisIdempotencyStore
+
+
+class FakeRedis:
+    """Keeps the values of a Redis server in a dict"""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.values:
+            return None
+
+        self.values[key] = value.encode() if isinstance(value, str) else value
+        return True
+
+    def setex(self, key, ttl, value):
+        self.set(key, value)
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+
+class TestIdempotencyStore(unittest.TestCase):
+    """Tests the idempotency stores"""
+
+    def create_redis_store(self):
+        store = RedisIdempotencyStore.__new__(RedisIdempotencyStore)
+        store.ttl, store.lock_ttl, store.prefix, store.client = 60, 10, 'idempotency', FakeRedis()
+        return store
+
+    def test_redis_json(self):
+        store = self.create_redis_store()
+        response = {'status': 201, 'headers': [['Content-Type', 'application/json']], 'body': b'{"name": "Rex"}\n'}
+
+        self.assertTrue(store.claim('key', 'fingerprint'))
+        self.assertFalse(store.claim('key', 'fingerprint'))
+        self.assertEqual(store.get('key'), {'state': 'in_flight', 'fingerprint': 'fingerprint'})
+
+        store.complete('key', 'fingerprint', response)
+
+        self.assertEqual(store.get('key'), {'state': 'completed', 'fingerprint': 'fingerprint', 'response': response})
+        self.assertTrue(store.client.values['idempotency:key'].startswith(b'{"state": "completed"'))
+
+    def test_redis_pickle_is_not_loaded(self):
+        store = self.create_redis_store()
+        store.client.values['idempotency:key'] = pickle.dumps({'state': 'in_flight', 'fingerprint': 'fingerprint'})
+
+        with self.assertLogs(level='WARNING'):
+            self.assertIsNone(store.get('key'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import yaml
+
+from openapi_server.index_advisor import BACKENDS, Query, advise_route, get_composite_index, get_filter_combinations, \
+    get_page_orders, get_routes, write_datastore_indexes, write_firestore_indexes
+
+OPENAPI_PATH = os.path.join(os.path.dirname(__file__), 'openapi', 'openapi.yaml')
+
+
+def create_filter(field, comparison, name=None, required=False):
+    return {'name': name or field, 'field': field, 'comparison': comparison, 'required': required}
+
+
+def create_route(parameters=None, operation_id='generic_get_multiple_pets'):
+    method_object = {'operationId': operation_id, 'parameters': [{
+        'in': 'query', 'name': name, 'schema': {'type': 'integer'}, 'x-query-filter-field': name,
+        'x-query-filter-comparison': comparison
+    } for name, comparison in (parameters or [])]}
+
+    return {'x-db-table-name': 'Pets', 'get': method_object}
+
+
+class TestCompositeIndexes(unittest.TestCase):
+    """Tests the composite indexes of the queries of each backend"""
+
+    def test_equality_filters(self):
+        """Equality filters are merged from the single-field indexes"""
+
+        for backend in BACKENDS:
+            self.assertIsNone(get_composite_index(backend, Query('', ['breed', 'name'], None, [], [])))
+
+    def test_inequality_filter(self):
+        """An inequality filter is combined with the equality filters, which come first"""
+
+        query = Query('', ['breed'], 'age', [], [])
+        for backend in BACKENDS:
+            self.assertEqual(get_composite_index(backend, query), (('breed', False), ('age', False)))
+            self.assertIsNone(get_composite_index(backend, Query('', [], 'age', [], [])))
+
+    def test_page_orders(self):
+        """Datastore pages without an inequality field are read by descending key, which needs an index"""
+
+        self.assertEqual(get_page_orders('datastore', None), [[('__key__', True)], [('__key__', False)]])
+        self.assertEqual(get_page_orders('firestore', 'age'), [
+            [('age', False), ('__name__', False)], [('age', True), ('__name__', True)]])
+
+        self.assertEqual(
+            get_composite_index('datastore', Query('', [], None, [('__key__', True)], [])), (('__key__', True),))
+        self.assertEqual(get_composite_index('datastore', Query('', ['breed'], None, [('__key__', True)], [])),
+                         (('breed', False), ('__key__', True)))
+        self.assertIsNone(get_composite_index('firestore', Query('', ['breed'], None, [('__name__', True)], [])))
+        self.assertEqual(
+            get_composite_index('firestore', Query('', ['breed', 'name'], None, [('__name__', True)], [])),
+            (('breed', False), ('name', False), ('__name__', True)))
+
+    def test_projection(self):
+        """Only Datastore needs an index to project the fields of an aggregation"""
+
+        query = Query('', [], None, [], ['age', 'breed'])
+        self.assertEqual(get_composite_index('datastore', query), (('age', False), ('breed', False)))
+        self.assertIsNone(get_composite_index('firestore', query))
+
+
+class TestAdviseRoute(unittest.TestCase):
+    """Tests advising the routes of a specification"""
+
+    def test_filter_combinations(self):
+        """Forced and required filters apply to each combination of optional filters"""
+
+        forced = create_filter('owner', '==', '_FORCED_FILTER')
+        required = create_filter('breed', '==', required=True)
+        optional = create_filter('age', '>')
+
+        self.assertEqual(list(get_filter_combinations([optional, forced, required])), [
+            [forced, required], [forced, required, optional]])
+
+    def test_routes(self):
+        """Only the list operations of the generic controller query a table"""
+
+        with open(OPENAPI_PATH, 'r') as openapi:
+            spec = yaml.safe_load(openapi.read())
+
+        routes = [(path, operation) for path, _, operation, _ in get_routes(spec)]
+        self.assertIn(('/owners/pages/{page_cursor}', 'generic_get_multiple_page'), routes)
+        self.assertIn(('/pets/count', 'generic_get_aggregate'), routes)
+        self.assertNotIn('/pets/{pet_id}', [path for path, _ in routes])
+
+        advice = advise_route(spec, '/owners/pages/{page_cursor}', 'get', 'generic_get_multiple_page',
+                              spec['paths']['/owners/pages/{page_cursor}'], BACKENDS, None)
+        self.assertEqual(advice.indexes, {'datastore': [('Owners', (('__key__', True),))], 'firestore': []})
+        self.assertEqual(advice.findings, [])
+
+    def test_list_budget(self):
+        """A list within a budget is read as pages, which are ordered"""
+
+        path_object = create_route([('breed', 'equal_to')])
+
+        advice = advise_route({}, '/pets', 'get', 'generic_get_multiple', path_object, BACKENDS, None)
+        self.assertEqual(advice.indexes, {'datastore': [], 'firestore': []})
+
+        advice = advise_route({}, '/pets', 'get', 'generic_get_multiple', path_object, BACKENDS, {'max_rows': 100})
+        self.assertEqual(advice.indexes['datastore'], [
+            ('Pets', (('__key__', True),)), ('Pets', (('breed', False), ('__key__', True)))])
+
+    def test_inequality_fields(self):
+        """Inequality filters on more than one field can not be combined"""
+
+        path_object = create_route([('age', 'greater_than'), ('weight', 'less_than')])
+
+        advice = advise_route({}, '/pets', 'get', 'generic_get_multiple', path_object, BACKENDS, None)
+        self.assertEqual([finding.severity for finding in advice.findings], ['error'])
+        self.assertIn('age, weight', advice.findings[0].message)
+
+    def test_not_equal_page(self):
+        """A page without an inequality field is ordered by key, which a '!=' filter does not allow"""
+
+        path_object = create_route([('breed', 'not_equal_to')], 'generic_get_multiple_page_pets')
+
+        advice = advise_route({}, '/pets', 'get', 'generic_get_multiple_page', path_object, BACKENDS, None)
+        self.assertIn("A '!=' filter on 'breed'", advice.findings[0].message)
+
+
+class TestWriteIndexes(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.indexes = [('Pets', (('breed', False), ('__key__', True)))]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_datastore_indexes(self):
+        file_name = os.path.join(self.directory, 'index.yaml')
+        write_datastore_indexes(self.indexes, file_name)
+
+        with open(file_name, 'r') as index_file:
+            self.assertEqual(yaml.safe_load(index_file), {'indexes': [{'kind': 'Pets', 'properties': [
+                {'name': 'breed', 'direction': 'asc'}, {'name': '__key__', 'direction': 'desc'}]}]})
+
+    def test_write_firestore_indexes(self):
+        file_name = os.path.join(self.directory, 'firestore.indexes.json')
+        write_firestore_indexes(self.indexes, file_name)
+
+        with open(file_name, 'r') as index_file:
+            indexes = json.load(index_file)
+
+        self.assertEqual(indexes['indexes'][0]['fields'][1], {'fieldPath': '__key__', 'order': 'DESCENDING'})
+        self.assertEqual(indexes['fieldOverrides'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
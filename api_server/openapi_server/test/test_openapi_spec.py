@@ -0,0 +1,131 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import current_app
+from unittest import mock
+
+from openapi_server import openapi_spec
+from openapi_server.openapi_spec import RoutePlanner, get_aggregate_settings
+from openapi_server.test import BaseTestCase
+
+
+class TestRoutePlanner(BaseTestCase):
+    """Tests compiling the route plans and swapping them when the specification changes"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'openapi.yaml')
+        shutil.copyfile(openapi_spec.OPENAPI_PATH, self.path)
+
+        self.patch = mock.patch.object(openapi_spec, 'OPENAPI_PATH', self.path)
+        self.patch.start()
+
+        self.planner = RoutePlanner()
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.directory)
+
+    def write_specification(self, content):
+        with open(self.path, 'w') as openapi:
+            openapi.write(content)
+
+        # The modification time of a file written within the same tick can be unchanged
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+
+    def rename_table(self, table_name, new_table_name):
+        with open(self.path, 'r') as openapi:
+            content = openapi.read()
+
+        self.write_specification(
+            content.replace(f"x-db-table-name: {table_name}", f"x-db-table-name: {new_table_name}"))
+
+    def test_compile_plans(self):
+        """Each path's method has a plan with the database info of each of its response content-types"""
+
+        plan = self.planner.get_plan('/owners', 'get')
+        self.assertEqual(plan.get_database_info(None)[:2], ('Owners', 'owner_id'))
+        self.assertEqual(plan.get_database_info('text/csv')[0], 'Owners')
+
+        with self.assertRaisesRegex(ValueError, "The content-type 'application/xml' is not found"):
+            plan.get_database_info('application/xml')
+
+        self.assertIsNotNone(self.planner.get_plan('/pets/{pet_id}', 'patch'))
+        self.assertIsNone(self.planner.get_plan('/pets/{pet_id}', 'delete'))
+
+    def test_request_content_type(self):
+        """A content-type only declared for the request body selects the default response content-type"""
+
+        plan = self.planner.get_plan('/pets/{pet_id}', 'patch')
+        self.assertEqual(plan.get_database_info('application/merge-patch+json')[0], 'Pets')
+
+    def test_reload_specification(self):
+        """A changed specification swaps the plans, a plan already retrieved by a request is left as it was"""
+
+        self.assertFalse(self.planner.reload_specification())
+
+        plan = self.planner.get_plan('/owners', 'get')
+        self.rename_table('Owners', 'People')
+
+        with self.assertLogs(level='INFO'):
+            self.assertTrue(self.planner.reload_specification())
+
+        self.assertEqual(self.planner.get_plan('/owners', 'get').get_database_info(None)[0], 'People')
+        self.assertEqual(plan.get_database_info(None)[0], 'Owners')
+        self.assertFalse(self.planner.reload_specification())
+
+    def test_reload_invalid_specification(self):
+        """A changed specification that is not valid keeps the active plans and is not retried until it changes"""
+
+        plans = self.planner.plans
+        self.write_specification("openapi: 3.0.0\npaths: []\n")
+
+        with self.assertLogs(level='ERROR'):
+            self.assertFalse(self.planner.reload_specification())
+
+        self.assertIs(self.planner.plans, plans)
+        self.assertFalse(self.planner.reload_specification())
+
+    def test_reload_requests(self):
+        """Requests after a reload use the plans of the changed specification"""
+
+        current_app.db_client.write('Owners', '1', {'name': 'Owner 1'})
+        current_app.db_client.write('People', '2', {'name': 'Person 2'})
+
+        with mock.patch.object(openapi_spec, 'route_planner', self.planner):
+            response = self.client.get('/owners', headers=self.get_headers())
+            self.assertEqual([owner['name'] for owner in response.json['results']], ['Owner 1'])
+
+            self.rename_table('Owners', 'People')
+            with self.assertLogs(level='INFO'):
+                self.planner.reload_specification()
+
+            response = self.client.get('/owners', headers=self.get_headers())
+            self.assertEqual([owner['name'] for owner in response.json['results']], ['Person 2'])
+
+
+class TestAggregateSettings(unittest.TestCase):
+
+    def test_aggregate_settings(self):
+        self.assertIsNone(get_aggregate_settings({}))
+        self.assertEqual(get_aggregate_settings({'x-aggregate': 'sum', 'x-aggregate-field': 'age'}), {
+            'aggregate': 'sum', 'field': 'age', 'group_by': None})
+
+    def test_aggregate_settings_not_valid(self):
+        """An aggregation that is not supported, or a sum or average without a field, is not compiled"""
+
+        with self.assertLogs(level='ERROR'):
+            self.assertIsNone(get_aggregate_settings({'x-aggregate': 'median', 'x-aggregate-field': 'age'}))
+
+        with self.assertLogs(level='ERROR'):
+            self.assertIsNone(get_aggregate_settings({'x-aggregate': 'avg'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
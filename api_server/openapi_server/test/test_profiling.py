@@ -0,0 +1,93 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+
+import flask
+
+from flask import current_app
+
+from openapi_server.profiling import RequestProfiler
+from openapi_server.test import BaseTestCase
+
+
+class TestRequestProfiler(BaseTestCase):
+    """Tests profiling requests on demand by users with the profile scope"""
+
+    def setUp(self):
+        current_app.db_client.write('Pets', '1', {'name': 'Rex', 'breed': 'Labrador', 'age': 3})
+
+    def test_profile_inline(self):
+        """A profile replaces the response body, keeping its status"""
+
+        RequestProfiler(self.app, scope='tests.read', mode='deterministic')
+
+        with self.assertLogs(level='INFO'):
+            response = self.client.get('/pets/1', headers=self.get_headers(**{'X-Profile': '1'}))
+
+        self.assert200(response)
+        self.assertEqual((response.json['mode'], response.json['path']), ('deterministic', '/pets/1'))
+        self.assertEqual(response.json['status'], 200)
+        self.assertTrue(response.json['top'])
+
+    def test_not_profiled(self):
+        """A request without the header, or by a user without the profile scope, is not profiled"""
+
+        RequestProfiler(self.app, scope='tests.read')
+
+        response = self.client.get('/pets/1', headers=self.get_headers())
+        self.assert200(response)
+        self.assertEqual(response.json['name'], 'Rex')
+
+        self.app.extensions['request_profiler'].scope = 'profile.admin'
+
+        response = self.client.get('/pets/1', headers=self.get_headers(**{'X-Profile': '1'}))
+        self.assert200(response)
+        self.assertEqual(response.json['name'], 'Rex')
+
+    def test_not_authenticated(self):
+        """A request that is not authenticated is rejected by connexion before it can be profiled"""
+
+        RequestProfiler(self.app, scope='tests.read')
+
+        response = self.client.get('/pets/1', headers={'X-Profile': '1'})
+        self.assert401(response)
+        self.assertNotIn('top', response.json)
+
+    def test_token_info(self):
+        """The scopes are read from the token info connexion resolved for the request"""
+
+        request_profiler = RequestProfiler(scope='profile.admin')
+
+        with self.app.test_request_context('/pets/1'):
+            flask._request_ctx_stack.top.connexion_context = {}
+            self.assertFalse(request_profiler.is_authorized())
+
+            flask._request_ctx_stack.top.connexion_context = {'token_info': {'scope': 'tests.read profile.admin'}}
+            self.assertTrue(request_profiler.is_authorized())
+
+            flask._request_ctx_stack.top.connexion_context = {'token_info': {'scopes': ['tests.read']}}
+            self.assertFalse(request_profiler.is_authorized())
+
+    def test_profile_local(self):
+        """A written profile leaves the response as it is and returns the profile's id"""
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        RequestProfiler(self.app, scope='tests.read', output='local', directory=directory)
+
+        with self.assertLogs(level='INFO'):
+            response = self.client.get('/pets/1', headers=self.get_headers(**{'X-Profile': '1'}))
+
+        self.assert200(response)
+        self.assertEqual(response.json['name'], 'Rex')
+        profile_id = response.headers['X-Profile-Id']
+        self.assertTrue(os.path.exists(os.path.join(directory, f"{profile_id}.json")))
+        self.assertTrue(os.path.exists(os.path.join(directory, f"{profile_id}.collapsed")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+import threading
+import time
+import unittest
+
+from flask import current_app, g
+from unittest import mock
+
+from openapi_server.request_coalescing import SingleFlight, get_request_key
+from openapi_server.test import BaseTestCase
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Tests sharing one in-flight call between concurrent callers"""
+
+    def run_concurrently(self, single_flight, keys, func):
+        """Runs a call for each key, each starting shortly after the previous one, and returns their results"""
+
+        results = [None] * len(keys)
+
+        def run(index):
+            try:
+                results[index] = single_flight.do(keys[index], func)
+            except Exception as e:
+                results[index] = e
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(len(keys))]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.05)
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def test_coalesce(self):
+        calls = []
+
+        def func():
+            calls.append(None)
+            call = len(calls)
+            time.sleep(0.2)
+            return call
+
+        single_flight = SingleFlight()
+        with self.assertLogs(level='INFO'):
+            results = self.run_concurrently(single_flight, ['a', 'a', 'b'], func)
+
+        self.assertEqual(results, [(1, False), (1, True), (2, False)])
+        self.assertEqual(single_flight.metrics, {'calls': 2, 'coalesced': 1, 'timeouts': 0})
+        self.assertEqual(single_flight.calls, {})
+
+    def test_error(self):
+        """The error of a shared call is raised for each caller"""
+
+        def func():
+            time.sleep(0.2)
+            raise ValueError("Not valid")
+
+        with self.assertLogs(level='INFO'):
+            results = self.run_concurrently(SingleFlight(), ['a', 'a'], func)
+
+        self.assertEqual([type(result) for result in results], [ValueError, ValueError])
+        self.assertIsNot(results[0], results[1])
+
+    def test_timeout(self):
+        """A caller waiting longer than the maximum runs its own call"""
+
+        def func():
+            time.sleep(0.3)
+            return threading.get_ident()
+
+        single_flight = SingleFlight(max_wait=0.1)
+        with self.assertLogs(level='INFO'):
+            results = self.run_concurrently(single_flight, ['a', 'a'], func)
+
+        self.assertNotEqual(results[0][0], results[1][0])
+        self.assertEqual(single_flight.metrics['timeouts'], 1)
+
+
+class TestRequestCoalescing(BaseTestCase):
+    """Tests coalescing concurrent identical list requests"""
+
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.patch = mock.patch('openapi_server.controllers.default_controller.single_flight', self.single_flight)
+        self.patch.start()
+
+        current_app.db_client.write('Pets', '1', {'name': 'Rex', 'owner': {'email': 'tester@example.com'}})
+        current_app.db_client.write('Pets', '2', {'name': 'Bello', 'owner': {'email': 'other@example.com'}})
+
+        self.calls = []
+        get_multiple = current_app.db_client.get_multiple
+
+        def slow_get_multiple(**kwargs):
+            self.calls.append(g.user)
+            time.sleep(0.3)
+            return get_multiple(**kwargs)
+
+        self.db_patch = mock.patch.object(current_app.db_client, 'get_multiple', slow_get_multiple)
+        self.db_patch.start()
+
+    def tearDown(self):
+        self.db_patch.stop()
+        self.patch.stop()
+
+    def get_concurrently(self, path, users):
+        """Requests a path for each user, each request starting shortly after the previous one"""
+
+        responses = [None] * len(users)
+
+        def get(index):
+            responses[index] = self.app.test_client().get(path, headers=self.get_headers(users[index]))
+
+        threads = [threading.Thread(target=get, args=(index,)) for index in range(len(users))]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.1)
+        for thread in threads:
+            thread.join()
+
+        return responses
+
+    def test_identical_requests(self):
+        """Concurrent identical requests share one database query"""
+
+        with self.assertLogs(level='INFO'):
+            responses = self.get_concurrently('/pets', ['tester@example.com', 'other@example.com'])
+
+        self.assertEqual(len(self.calls), 1)
+        for response in responses:
+            self.assert200(response)
+            self.assertEqual(sorted(pet['name'] for pet in response.json['results']), ['Bello', 'Rex'])
+
+    def test_forced_filter_users(self):
+        """Concurrent requests of different users with a forced filter on the user run their own query"""
+
+        responses = self.get_concurrently('/my-pets', ['tester@example.com', 'other@example.com'])
+
+        self.assertEqual(sorted(self.calls), ['other@example.com', 'tester@example.com'])
+        self.assertEqual([pet['name'] for pet in responses[0].json['results']], ['Rex'])
+        self.assertEqual([pet['name'] for pet in responses[1].json['results']], ['Bello'])
+
+    def test_request_key_preferences(self):
+        """The preferences of a request, e.g. the order of an export, are part of its identity"""
+
+        def get_key(headers):
+            with self.app.test_request_context('/owners', headers=headers):
+                g.forced_filters = []
+                return get_request_key()
+
+        self.assertEqual(get_key({}), get_key({'Prefer': ''}))
+        self.assertEqual(get_key({'Prefer': 'ordered, wait=5'}), get_key({'Prefer': 'wait=10,ordered'}))
+        self.assertNotEqual(get_key({}), get_key({'Prefer': 'ordered'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
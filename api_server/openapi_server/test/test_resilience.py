@@ -0,0 +1,118 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+import time
+import unittest
+
+import config
+
+from flask import current_app
+from unittest import mock
+
+from openapi_server.resilience import Resilience
+from openapi_server.test import BaseTestCase
+
+
+class TestResilience(BaseTestCase):
+    """Tests the deadlines, retries and circuit breakers with latency and faults injected into the memory database"""
+
+    def setUp(self):
+        self.resilience = Resilience(
+            self.app, request_budget=1, operation_timeout=1, retries={'attempts': 3, 'base_delay': 0},
+            circuit_breaker={'failure_rate': 0.5, 'min_calls': 2, 'window': 30, 'open_seconds': 30})
+        current_app.db_client.write('Pets', '1', {'name': 'Rex'})
+
+    def test_circuit_breaker(self):
+        """The circuit opens after failed calls, and a trial call after open_seconds closes or opens it again"""
+
+        breaker = self.resilience.get_breaker('memory')
+        current_app.db_client.error_rate = 1
+
+        response = self.client.get('/pets/1', headers=self.get_headers())
+        self.assertStatus(response, 503)
+        self.assertIsNotNone(breaker.opened)
+
+        # An open circuit fails calls without calling the backend
+        current_app.db_client.error_rate = 0
+        with mock.patch.object(current_app.db_client, 'kinds', {}) as kinds:
+            response = self.client.get('/pets/1', headers=self.get_headers())
+            self.assertStatus(response, 503)
+            self.assertEqual(kinds, {})
+        self.assertEqual(response.headers['Retry-After'], '30')
+
+        # A failed trial call opens the circuit again
+        breaker.opened -= 30
+        current_app.db_client.error_rate = 1
+        response = self.client.get('/pets/1', headers=self.get_headers())
+        self.assertStatus(response, 503)
+        self.assertGreater(breaker.opened, time.monotonic() - 1)
+
+        # A successful trial call closes it
+        breaker.opened -= 30
+        current_app.db_client.error_rate = 0
+        response = self.client.get('/pets/1', headers=self.get_headers())
+        self.assert200(response, f"Response body is : {response.data.decode('utf-8')}")
+        self.assertIsNone(breaker.opened)
+
+    def test_trial_interrupted(self):
+        """A trial call interrupted by a BaseException lets the next trial call through"""
+
+        breaker = self.resilience.get_breaker('memory')
+        breaker.opened = time.monotonic() - 30
+
+        def interrupt(timeout):
+            raise KeyboardInterrupt()
+
+        with self.app.test_request_context('/pets/1'):
+            with self.assertRaises(KeyboardInterrupt):
+                self.resilience.call('memory', interrupt, idempotent=True)
+
+            self.assertIsNone(breaker.trial)
+            self.assertEqual(self.resilience.call('memory', lambda timeout: 'result', idempotent=True), 'result')
+            self.assertIsNone(breaker.opened)
+
+    def test_retries(self):
+        """Reads are retried on transient errors, writes are not"""
+
+        current_app.db_client.error_rate = 1
+        self.resilience.circuit_breaker = {'min_calls': 100}
+        self.resilience.breakers = {}
+
+        with self.assertLogs(level='WARNING') as logs:
+            response = self.client.get('/pets/1', headers=self.get_headers())
+        self.assertStatus(response, 503)
+        self.assertEqual(sum('A call to the memory backend failed' in line for line in logs.output), 3)
+
+        with self.assertLogs(level='WARNING') as logs:
+            response = self.client.put('/pets/1', json={'name': 'Rex'}, headers=self.get_headers())
+        self.assertStatus(response, 503)
+        self.assertEqual(sum('A call to the memory backend failed' in line for line in logs.output), 1)
+
+    def test_deadline(self):
+        """A call exceeding the remaining budget of the request fails within the budget"""
+
+        self.resilience.request_budget = 0.2
+        current_app.db_client.latency = (0.5, 0.5)
+
+        start = time.monotonic()
+        response = self.client.get('/pets/1', headers=self.get_headers())
+        self.assertStatus(response, 503)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    def test_streamed_list_deadline(self):
+        """Each page of a streamed list is read within a deadline of its own"""
+
+        for id in range(5):
+            current_app.db_client.write('Owners', str(id), {'name': f"Owner {id}", 'city': 'Utrecht'})
+
+        self.resilience.request_budget = 0.25
+        current_app.db_client.latency = (0.1, 0.1)
+
+        with mock.patch.object(config, 'LIST_BUDGET', {'max_rows': 1, 'fallback': 'stream'}, create=True):
+            response = self.client.get('/owners', headers=self.get_headers())
+            self.assert200(response, f"Response body is : {response.data.decode('utf-8')}")
+            self.assertEqual([owner['owner_id'] for owner in response.json['results']], ['0', '1', '2', '3', '4'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+import unittest
+
+from flask import current_app
+from unittest import mock
+
+from openapi_server.resolver import DEFAULT_CONTROLLER, GenericOperationResolver, get_generic_operation, \
+    get_operation_name, is_generic_handler
+from openapi_server.test import BaseTestCase
+
+
+class TestOperationName(unittest.TestCase):
+    """Tests resolving operationId's to generic operations"""
+
+    def test_operation_name(self):
+        """An operationId is the name of a generic operation, optionally followed by a number or a name"""
+
+        self.assertEqual(get_operation_name('generic_get_multiple'), 'generic_get_multiple')
+        self.assertEqual(get_operation_name('generic_get_multiple_pets'), 'generic_get_multiple')
+        self.assertEqual(get_operation_name('generic_get_single2'), 'generic_get_single')
+        self.assertEqual(get_operation_name('generic_get_export_owners'), 'generic_get_export')
+
+    def test_longest_name(self):
+        """A suffix is never mistaken for a name, the longest generic operation wins"""
+
+        self.assertEqual(get_operation_name('generic_get_multiple_page'), 'generic_get_multiple_page')
+        self.assertEqual(get_operation_name('generic_get_multiple_page_owners'), 'generic_get_multiple_page')
+        self.assertEqual(get_operation_name('generic_get_export_file3'), 'generic_get_export_file')
+
+    def test_not_generic(self):
+        for operation_id in [None, '', 'get_pets', 'generic_get_multiplepets', 'generic_get_single-2',
+                             'generic_get_single_', 'my_generic_get_single']:
+            self.assertIsNone(get_operation_name(operation_id), operation_id)
+
+    def test_router_controller(self):
+        """Only operations of the default controller are generic"""
+
+        operation = mock.Mock(operation_id='generic_get_multiple_pets', router_controller=DEFAULT_CONTROLLER)
+        self.assertEqual(get_generic_operation(operation), 'generic_get_multiple')
+
+        operation.router_controller = None
+        self.assertEqual(get_generic_operation(operation), 'generic_get_multiple')
+
+        operation.router_controller = 'openapi_server.controllers.pets_controller'
+        self.assertIsNone(get_generic_operation(operation))
+
+
+class TestGenericOperationResolver(BaseTestCase):
+    """Tests the handlers of generic operations"""
+
+    def test_resolve(self):
+        """A generic operation resolves to a handler bound to its path's method, other operations to their function"""
+
+        resolver = GenericOperationResolver()
+
+        operation = mock.Mock(
+            operation_id='generic_get_multiple_pets', router_controller=DEFAULT_CONTROLLER, path='/my-pets',
+            method='GET')
+        resolution = resolver.resolve(operation)
+        self.assertEqual(resolution.function.route_key, ('/my-pets', 'get'))
+        self.assertTrue(is_generic_handler(resolution.function))
+
+        operation = mock.Mock(operation_id='openapi_server.test.info_from_test_token', router_controller=None)
+        resolution = resolver.resolve(operation)
+        self.assertFalse(is_generic_handler(resolution.function))
+        self.assertEqual(resolution.function.__name__, 'info_from_test_token')
+
+    def test_suffixed_operations(self):
+        """Paths with suffixed operationId's of the same generic operation each read their own table"""
+
+        current_app.db_client.write('Pets', '1', {'name': 'Rex', 'owner': {'email': 'tester@example.com'}})
+        current_app.db_client.write('Pets', '2', {'name': 'Bello', 'owner': {'email': 'other@example.com'}})
+        current_app.db_client.write('Owners', '1', {'name': 'Owner 1'})
+
+        response = self.client.get('/my-pets', headers=self.get_headers())
+        self.assert200(response)
+        self.assertEqual([pet['name'] for pet in response.json['results']], ['Rex'])
+
+        response = self.client.get('/owners', headers=self.get_headers())
+        self.assert200(response)
+        self.assertEqual([owner['name'] for owner in response.json['results']], ['Owner 1'])
+
+        endpoint = next(rule.endpoint for rule in self.app.url_map.iter_rules() if rule.rule == '/my-pets')
+        self.assertTrue(is_generic_handler(self.app.view_functions[endpoint]))
+
+
+if __name__ == '__main__':
+    unittest.main()
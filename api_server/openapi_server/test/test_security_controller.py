@@ -0,0 +1,182 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+import json
+import time
+import unittest
+
+import config
+import jwt
+
+from cryptography.hazmat.primitives.asymmetric import rsa
+from flask import Flask, g
+from jwkaas import JWKaas
+from jwkaas.algorithms import RSAAlgorithm
+from unittest import mock
+
+from openapi_server.controllers import security_controller_
+from openapi_server.controllers.security_controller_ import JWKSRefresher, info_from_oAuth2
+from openapi_server.lru_cache import LRUCache
+
+AUDIENCE = 'api://tests'
+ISSUER = 'https://issuer.example.com'
+
+
+def create_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+class TestTokenCache(unittest.TestCase):
+    """Tests validating tokens with a token cache and public keys refreshed in the background"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.key = create_key()
+
+    def setUp(self):
+        self.verifier = JWKaas(AUDIENCE, ISSUER)
+        self.verifier.pubkeys = {'key-1': self.key.public_key()}
+        self.token_cache = LRUCache(10)
+        self.jwks_refresher = mock.Mock()
+
+        self.patches = [
+            mock.patch.object(security_controller_, 'my_jwkaas', self.verifier),
+            mock.patch.object(security_controller_, 'my_e2e_jwkaas', None),
+            mock.patch.object(security_controller_, 'token_cache', self.token_cache),
+            mock.patch.object(security_controller_, 'jwks_refresher', self.jwks_refresher),
+            mock.patch.object(config, 'TOKEN_CACHE', {'max_ttl': 600}, create=True)]
+        for patch in self.patches:
+            patch.start()
+
+        self.context = Flask(__name__).test_request_context()
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+
+        for patch in self.patches:
+            patch.stop()
+
+    def create_token(self, key=None, kid='key-1', **claims):
+        claims = {'aud': AUDIENCE, 'iss': ISSUER, 'upn': 'tester@example.com', 'exp': int(time.time()) + 3600, **claims}
+        return jwt.encode(claims, key or self.key, algorithm='RS256', headers={'kid': kid})
+
+    def test_cached_token(self):
+        """A validated token is cached, so its signature is only verified once"""
+
+        token = self.create_token()
+
+        get_token_info = self.verifier.get_connexion_token_info
+        with mock.patch.object(self.verifier, 'get_connexion_token_info', wraps=get_token_info) as get_token_info:
+            self.assertEqual(info_from_oAuth2(token)['upn'], 'tester@example.com')
+            g.user = None
+            self.assertEqual(info_from_oAuth2(token)['upn'], 'tester@example.com')
+
+        get_token_info.assert_called_once()
+        self.assertEqual(g.user, 'tester@example.com')
+        self.assertEqual(len(self.token_cache.items), 1)
+
+        # The cache is keyed by a hash of the token instead of the token itself
+        self.assertNotIn(token, self.token_cache.items)
+
+    def test_cache_expiry(self):
+        """A token is cached until it expires, within the maximum time to live"""
+
+        now = time.time()
+        self.assertIsNotNone(info_from_oAuth2(self.create_token(exp=int(now) + 60)))
+        self.assertIsNotNone(info_from_oAuth2(self.create_token(exp=int(now) + 3600)))
+
+        expires = sorted(expires for _, expires in self.token_cache.items.values())
+        self.assertEqual(expires[0], int(now) + 60)
+        self.assertAlmostEqual(expires[1], now + 600, delta=5)
+
+    def test_expired_cached_token(self):
+        """A cached token is validated again after it expired within the cache"""
+
+        token = self.create_token()
+        self.assertIsNotNone(info_from_oAuth2(token))
+
+        token_key, (token_info, _) = next(iter(self.token_cache.items.items()))
+        self.token_cache.items[token_key] = (token_info, time.time() - 1)
+
+        with mock.patch.object(self.verifier, 'get_connexion_token_info', return_value=None) as get_token_info:
+            self.assertIsNone(info_from_oAuth2(token))
+
+        get_token_info.assert_called_once_with(token)
+
+    def test_tokens_not_cached(self):
+        """Tokens that are expired, not yet valid, without an expiry or with an invalid signature are not cached"""
+
+        with self.assertLogs(level='WARNING'):
+            self.assertIsNone(info_from_oAuth2(self.create_token(exp=int(time.time()) - 60)))
+            self.assertIsNone(info_from_oAuth2(self.create_token(key=create_key())))
+
+        self.assertIsNone(info_from_oAuth2(self.create_token(nbf=int(time.time()) + 60)))
+
+        token = jwt.encode({'aud': AUDIENCE, 'iss': ISSUER, 'upn': 'tester@example.com'}, self.key, algorithm='RS256',
+                           headers={'kid': 'key-1'})
+        self.assertIsNotNone(info_from_oAuth2(token))
+
+        self.assertEqual(self.token_cache.items, {})
+
+    def test_unknown_key(self):
+        """A token signed with an unknown key is rejected and requests a refresh, without fetching keys itself"""
+
+        with mock.patch('requests.get') as get, self.assertLogs(level='INFO'):
+            self.assertIsNone(info_from_oAuth2(self.create_token(kid='key-2')))
+
+        get.assert_not_called()
+        self.jwks_refresher.request_refresh.assert_called_once()
+
+    def test_token_not_valid(self):
+        with self.assertLogs(level='WARNING'):
+            self.assertIsNone(info_from_oAuth2('not-a-token'))
+
+        self.jwks_refresher.request_refresh.assert_not_called()
+
+
+class TestJWKSRefresher(unittest.TestCase):
+    """Tests refreshing the public keys of verifiers"""
+
+    def setUp(self):
+        self.verifier = JWKaas(AUDIENCE, ISSUER)
+        self.verifier.jwks_url = 'https://issuer.example.com/keys'
+        self.verifier.pubkeys = {'key-1': 'old'}
+
+    def test_refresh(self):
+        """All keys are swapped at once"""
+
+        jwk = json.loads(RSAAlgorithm.to_jwk(create_key().public_key()))
+        response = mock.Mock(json=mock.Mock(return_value={'keys': [{**jwk, 'kid': 'key-2'}]}))
+
+        with mock.patch('requests.get', return_value=response) as get:
+            JWKSRefresher.refresh(self.verifier)
+
+        get.assert_called_once_with('https://issuer.example.com/keys', timeout=10)
+        self.assertEqual(list(self.verifier.pubkeys), ['key-2'])
+
+    def test_refresh_error(self):
+        """The keys are kept when they can not be fetched"""
+
+        with mock.patch('requests.get', side_effect=ConnectionError("Unreachable")), self.assertLogs(level='ERROR'):
+            JWKSRefresher.refresh(self.verifier)
+
+        self.assertEqual(self.verifier.pubkeys, {'key-1': 'old'})
+
+    def test_request_refresh(self):
+        """An early refresh is requested at most once per minimum refresh interval"""
+
+        refresher = JWKSRefresher([None, JWKaas(AUDIENCE, ISSUER)], interval=3600)
+        self.assertEqual(refresher.verifiers, [])
+
+        with mock.patch.object(refresher, 'event') as event:
+            refresher.request_refresh()
+            event.set.assert_not_called()
+
+            refresher.last_refresh -= JWKSRefresher.MIN_REFRESH_INTERVAL + 1
+            refresher.request_refresh()
+            event.set.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -30,7 +30,8 @@ setup(
     package_data={'': ['openapi/openapi.yaml']},
     include_package_data=True,
     entry_points={
-        'console_scripts': ['openapi_server=openapi_server.__main__:main']},
+        'console_scripts': ['openapi_server=openapi_server.__main__:main',
+                            'openapi_server_indexes=openapi_server.index_advisor:main']},
     long_description="""\
     Endpoint to dynamic manipulate data
     """